@@ -1,26 +1,147 @@
-import { defineComponent, h } from 'vue'
+import { computed, defineComponent, h, ref } from 'vue'
+
+const PAGE_SIZE = 100
 
 export default defineComponent({
 	name: 'PivotTransform',
 	props: {
-		tableHtml: {
-			type: String,
+		pivot: {
+			type: Object,
 			required: true,
 		},
 	},
 	setup(props) {
-		return () =>
-			h(
-				'div',
-				{
-					class: 'flex w-full select-text flex-col text-base',
-				},
-				[
-					h('div', {
-						class: 'relative overflow-scroll border',
-						innerHTML: props.tableHtml,
-					}),
-				]
-			)
+		const sortBy = ref(null)
+		const ascending = ref(true)
+		const page = ref(0)
+
+		const columns = computed(() => {
+			const { index_columns, pivot_values, value_columns } = props.pivot
+			const columns = index_columns.map((label, idx) => ({ label, index: idx }))
+			pivot_values.forEach((pivotValue, pivotIdx) => {
+				value_columns.forEach((valueColumn, valueIdx) => {
+					columns.push({
+						label:
+							value_columns.length == 1
+								? `${pivotValue ?? 'Not Set'}`
+								: `${valueColumn.label} - ${pivotValue ?? 'Not Set'}`,
+						pivotIdx,
+						valueIdx,
+					})
+				})
+			})
+			return columns
+		})
+
+		// sparse pivots only hold filled cells, look them up by their position
+		const sparseCells = computed(() => {
+			if (props.pivot.layout != 'sparse') {
+				return null
+			}
+			const cells = new Map()
+			const pivotCount = props.pivot.pivot_values.length
+			props.pivot.cells.row.forEach((row, idx) => {
+				cells.set(row * pivotCount + props.pivot.cells.column[idx], idx)
+			})
+			return cells
+		})
+
+		function getCell(row, column) {
+			if (column.index !== undefined) {
+				return props.pivot.index[row][column.index]
+			}
+			const values = props.pivot.values[column.valueIdx]
+			if (props.pivot.layout == 'dense') {
+				return values[row][column.pivotIdx]
+			}
+			const cell = sparseCells.value.get(row * props.pivot.pivot_values.length + column.pivotIdx)
+			return cell === undefined ? null : values[cell]
+		}
+
+		const rowOrder = computed(() => {
+			const order = props.pivot.index.map((_, idx) => idx)
+			if (sortBy.value === null) {
+				return order
+			}
+			const column = columns.value[sortBy.value]
+			const direction = ascending.value ? 1 : -1
+			return order.sort((a, b) => {
+				const left = getCell(a, column)
+				const right = getCell(b, column)
+				// empty cells go last in either direction
+				if (left === null || right === null) {
+					return left === right ? 0 : left === null ? 1 : -1
+				}
+				return (left > right ? 1 : left < right ? -1 : 0) * direction
+			})
+		})
+
+		const pageCount = computed(() => Math.max(Math.ceil(rowOrder.value.length / PAGE_SIZE), 1))
+
+		function sort(columnIdx) {
+			ascending.value = sortBy.value === columnIdx ? !ascending.value : true
+			sortBy.value = columnIdx
+			page.value = 0
+		}
+
+		function formatCell(value) {
+			return value === null || value === undefined ? '-' : `${value}`
+		}
+
+		return () => {
+			const rows = rowOrder.value.slice(page.value * PAGE_SIZE, (page.value + 1) * PAGE_SIZE)
+			return h('div', { class: 'flex w-full select-text flex-col text-base' }, [
+				h('div', { class: 'relative overflow-scroll border' }, [
+					h('table', { class: 'w-full' }, [
+						h(
+							'thead',
+							h(
+								'tr',
+								columns.value.map((column, idx) =>
+									h(
+										'th',
+										{
+											class: 'cursor-pointer whitespace-nowrap border-b px-3 py-2 text-left',
+											onClick: () => sort(idx),
+										},
+										column.label +
+											(sortBy.value === idx ? (ascending.value ? ' ↑' : ' ↓') : '')
+									)
+								)
+							)
+						),
+						h(
+							'tbody',
+							rows.map((row) =>
+								h(
+									'tr',
+									columns.value.map((column) =>
+										h(
+											'td',
+											{ class: 'whitespace-nowrap border-b px-3 py-2' },
+											formatCell(getCell(row, column))
+										)
+									)
+								)
+							)
+						),
+					]),
+				]),
+				pageCount.value > 1 &&
+					h('div', { class: 'mt-2 flex items-center justify-end space-x-2 text-sm' }, [
+						h(
+							'button',
+							{ disabled: page.value == 0, onClick: () => page.value-- },
+							'Previous'
+						),
+						h('span', `${page.value + 1} of ${pageCount.value}`),
+						h(
+							'button',
+							{ disabled: page.value == pageCount.value - 1, onClick: () => page.value++ },
+							'Next'
+						),
+					]),
+			])
+		}
 	},
 })
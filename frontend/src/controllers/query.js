@@ -1,10 +1,14 @@
-import { computed } from 'vue'
+import { computed, getCurrentScope, onScopeDispose, ref, watch } from 'vue'
 import { createDocumentResource } from 'frappe-ui'
 import { safeJSONParse } from '@/utils'
+import { fetchColumnarResult } from '@/utils/columnarResult'
+import socket from '@/socket'
 
 const API_METHODS = {
 	run: 'run',
 	reset: 'reset',
+	cancelRun: 'cancel_run',
+	fetchResult: 'fetch_result',
 	setLimit: 'set_limit',
 	fetchTables: 'fetch_tables',
 	fetchColumns: 'fetch_columns',
@@ -29,12 +33,15 @@ const API_METHODS = {
 	// visualization methods
 	getVisualizations: 'get_visualizations',
 	applyTransform: 'apply_transform',
+
+	// profiling methods
+	getExecutionHistory: 'get_execution_history',
 }
 
 export default class Query {
 	NUMBER_FIELD_TYPES = ['Int', 'Decimal', 'Bigint', 'Float', 'Double']
 
-	constructor(id) {
+	constructor(id, { result } = {}) {
 		this.id = id
 		this.resource = getQueryResource(id)
 		this._doc = computed(() => this.resource.doc)
@@ -53,8 +60,9 @@ export default class Query {
 			}
 		})
 
-		this.makeResult()
+		this.makeResult(result)
 		this.visualizations = this.getVisualizations().data
+		this.listenToRunStatus()
 	}
 
 	get doc() {
@@ -66,6 +74,9 @@ export default class Query {
 	get dataSource() {
 		return this.doc.data_source
 	}
+	get planWarnings() {
+		return safeJSONParse(this.doc?.plan_warnings, [])
+	}
 	get tables() {
 		if (!this.doc) {
 			return []
@@ -100,15 +111,72 @@ export default class Query {
 		return safeJSONParse(this.doc.filters)
 	}
 
-	makeResult() {
+	makeResult(result) {
+		if (result) {
+			// result is loaded by the caller, eg. a dashboard loads results of all its queries
+			this.result = computed(() => new QueryResult(result.value || [], this.columns))
+			return
+		}
+
+		// result is stored separately from the query doc, fetch it whenever it changes
+		this.resultData = ref([])
+		watch(
+			() => this.doc?.result_key,
+			(resultKey) => resultKey && this.loadResult(resultKey),
+			{ immediate: true }
+		)
 		this.result = computed(() => {
 			if (!this.doc) {
 				return []
 			}
-			return new QueryResult(this.doc, this.columns)
+			const data = this.doc.result_key ? this.resultData.value : []
+			return new QueryResult(data || [], this.columns)
 		})
 	}
 
+	async loadResult(resultKey) {
+		const range = { start: 0, end: QueryResult.MAX_ROWS }
+		let data
+		try {
+			// the columnar result is smaller & decoded faster, JSON is the fallback
+			data = await fetchColumnarResult(this.id, range)
+		} catch (e) {
+			await this.fetchResult(range).req
+			data = this.fetchResultData.value
+		}
+		// a newer result may have been stored meanwhile
+		if (this.doc?.result_key === resultKey) {
+			this.resultData.value = data
+		}
+	}
+
+	listenToRunStatus() {
+		// long running queries are executed in background, the server notifies when they finish
+		this.runStatus = ref(null)
+		const onRunStatus = (data) => {
+			if (data.query !== this.id) {
+				return
+			}
+			this.runStatus.value = data
+			if (
+				['Execution Successful', 'Execution Failed', 'Execution Cancelled'].includes(
+					data.status
+				)
+			) {
+				this.reload()
+			}
+		}
+		socket.on('insights_query_status', onRunStatus)
+		// a query is created per component, stop listening once the component unmounts
+		if (getCurrentScope()) {
+			onScopeDispose(() => socket.off('insights_query_status', onRunStatus))
+		}
+	}
+
+	get isRunning() {
+		return ['Queued', 'Running'].includes(this.doc?.status)
+	}
+
 	getColumnValues(column) {
 		const columnIdx = this.columns.findIndex((c) => c.column === column)
 		if (columnIdx > -1) {
@@ -147,13 +215,12 @@ export default class Query {
 }
 
 class QueryResult {
-	MAX_ROWS = 1000
+	static MAX_ROWS = 1000
 	NUMBER_FIELD_TYPES = ['Int', 'Decimal', 'Bigint', 'Float', 'Double']
 
-	constructor(doc, columns) {
-		this.doc = doc
+	constructor(data, columns) {
 		this.columns = columns
-		this.data = safeJSONParse(doc.result, []).slice(0, this.MAX_ROWS)
+		this.data = data.slice(0, QueryResult.MAX_ROWS)
 		this.formattedData = this.data
 		this.formatCells()
 	}
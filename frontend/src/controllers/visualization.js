@@ -143,10 +143,7 @@ function useVisualization({ visualizationID, queryID, query }) {
 			// request backend to perform pivot transform
 			applyPivot(data)
 			// if previous pivot transformed result exists, display it
-			visualization.componentProps =
-				query.doc.transform_result !== '{}'
-					? { tableHtml: query.doc.transform_result }
-					: null
+			visualization.componentProps = getPivotProps(query.doc.transform_result)
 			return
 		}
 	}
@@ -211,11 +208,17 @@ function useVisualization({ visualizationID, queryID, query }) {
 
 	const pivotResult = computed(() => query.doc?.transform_result)
 	watch(pivotResult, (result) => {
-		if (result !== '{}') {
-			visualization.componentProps = { tableHtml: result }
+		const props = getPivotProps(result)
+		if (props) {
+			visualization.componentProps = props
 		}
 	})
 
+	function getPivotProps(result) {
+		const pivot = safeJSONParse(result, {})
+		return pivot?.layout ? { pivot } : null
+	}
+
 	function updateDoc({ onSuccess }) {
 		const params = {
 			doc: {
@@ -0,0 +1,9 @@
+import io from 'socket.io-client'
+
+// socketio server runs on a separate port in development
+const port = window.location.port ? ':9000' : ''
+const socket = io(`${window.location.protocol}//${window.location.hostname}${port}`, {
+	withCredentials: true,
+})
+
+export default socket
@@ -0,0 +1,139 @@
+// results encoded column by column by `columnar_result.py`, see it for the layout
+const MAGIC = 'IQR1'
+const ENCODINGS = {
+	NULL: 0,
+	INT32: 1,
+	FLOAT64: 2,
+	DATE: 3,
+	DATETIME: 4,
+	DICTIONARY: 5,
+	STRING: 6,
+	JSON: 7,
+}
+const TYPED_ENCODINGS = [
+	ENCODINGS.INT32,
+	ENCODINGS.FLOAT64,
+	ENCODINGS.DATE,
+	ENCODINGS.DATETIME,
+	ENCODINGS.STRING,
+]
+const NULL_INDEX = 0xffffffff
+const DAY_MS = 24 * 60 * 60 * 1000
+
+export async function fetchColumnarResult(query, { start = 0, end = null } = {}) {
+	// compressed results are inflated by the browser, if it can
+	const compress = typeof DecompressionStream !== 'undefined'
+	const params = new URLSearchParams({
+		dt: 'Query',
+		dn: query,
+		method: 'fetch_columnar_result',
+		args: JSON.stringify({ start, end, compress: compress ? 1 : 0 }),
+	})
+	const response = await fetch(`/api/method/run_doc_method?${params}`)
+	if (!response.ok) {
+		throw new Error(`Could not fetch the result of ${query}`)
+	}
+
+	let body = response.body
+	if (compress) {
+		body = body.pipeThrough(new DecompressionStream('deflate'))
+	}
+	return decodeColumnarResult(await new Response(body).arrayBuffer())
+}
+
+export function decodeColumnarResult(buffer) {
+	const view = new DataView(buffer)
+	const decoder = new TextDecoder()
+	if (decoder.decode(new Uint8Array(buffer, 0, 4)) !== MAGIC) {
+		throw new Error('Unknown result encoding')
+	}
+
+	const rowCount = view.getUint32(4, true)
+	const columnCount = view.getUint16(8, true)
+	let offset = 10
+
+	function readString() {
+		const length = view.getUint32(offset, true)
+		const value = decoder.decode(new Uint8Array(buffer, offset + 4, length))
+		offset += 4 + length
+		return value
+	}
+
+	function readValues(size, read) {
+		const values = new Array(rowCount)
+		for (let idx = 0; idx < rowCount; idx++) {
+			values[idx] = read(offset)
+			offset += size
+		}
+		return values
+	}
+
+	const columns = []
+	for (let columnIdx = 0; columnIdx < columnCount; columnIdx++) {
+		const encoding = view.getUint8(offset)
+		offset += 1
+
+		let bitmap = null
+		if (TYPED_ENCODINGS.includes(encoding)) {
+			bitmap = new Uint8Array(buffer, offset, Math.ceil(rowCount / 8))
+			offset += bitmap.length
+		}
+
+		let values
+		switch (encoding) {
+			case ENCODINGS.NULL:
+				values = new Array(rowCount).fill(null)
+				break
+			case ENCODINGS.INT32:
+				values = readValues(4, (at) => view.getInt32(at, true))
+				break
+			case ENCODINGS.FLOAT64:
+				values = readValues(8, (at) => view.getFloat64(at, true))
+				break
+			case ENCODINGS.DATE:
+				values = readValues(4, (at) => formatDate(view.getInt32(at, true)))
+				break
+			case ENCODINGS.DATETIME:
+				values = readValues(8, (at) => formatDatetime(view.getFloat64(at, true)))
+				break
+			case ENCODINGS.DICTIONARY: {
+				const size = view.getUint32(offset, true)
+				offset += 4
+				const dictionary = Array.from({ length: size }, readString)
+				values = readValues(4, (at) => {
+					const index = view.getUint32(at, true)
+					return index === NULL_INDEX ? null : dictionary[index]
+				})
+				break
+			}
+			case ENCODINGS.STRING:
+				values = Array.from({ length: rowCount }, readString)
+				break
+			case ENCODINGS.JSON:
+				values = JSON.parse(readString())
+				break
+			default:
+				throw new Error(`Unknown column encoding: ${encoding}`)
+		}
+
+		if (bitmap) {
+			values = values.map((value, idx) => ((bitmap[idx >> 3] >> (idx & 7)) & 1 ? value : null))
+		}
+		columns.push(values)
+	}
+
+	// rows are handed out as arrays, alike the JSON result
+	return Array.from({ length: rowCount }, (_, rowIdx) => columns.map((values) => values[rowIdx]))
+}
+
+// dates & datetimes are sent as they're stored, eg. `2022-09-01 10:30:00`
+function formatDate(days) {
+	return new Date(days * DAY_MS).toISOString().slice(0, 10)
+}
+
+function formatDatetime(micros) {
+	const iso = new Date(Math.floor(micros / 1000)).toISOString()
+	const fraction = ((micros % 1e6) + 1e6) % 1e6
+	const datetime = `${iso.slice(0, 10)} ${iso.slice(11, 19)}`
+	return fraction ? `${datetime}.${String(fraction).padStart(6, '0')}` : datetime
+}
@@ -104,34 +104,40 @@ after_install = "insights.setup.after_install"
 # ---------------
 # Hook on document methods and events
 
-# doc_events = {
-# 	"*": {
-# 		"on_update": "method",
-# 		"on_cancel": "method",
-# 		"on_trash": "method"
-# 	}
-# }
+doc_events = {
+    "DocType": {
+        "on_update": "insights.insights.doctype.data_source.data_source.sync_columns_on_schema_change",
+        "on_trash": "insights.insights.doctype.data_source.data_source.sync_columns_on_schema_change",
+    },
+    "Custom Field": {
+        "on_update": "insights.insights.doctype.data_source.data_source.sync_columns_on_schema_change",
+        "on_trash": "insights.insights.doctype.data_source.data_source.sync_columns_on_schema_change",
+    },
+}
 
 # Scheduled Tasks
 # ---------------
 
-# scheduler_events = {
-# 	"all": [
-# 		"insights.tasks.all"
-# 	],
-# 	"daily": [
-# 		"insights.tasks.daily"
-# 	],
-# 	"hourly": [
-# 		"insights.tasks.hourly"
-# 	],
-# 	"weekly": [
-# 		"insights.tasks.weekly"
-# 	],
-# 	"monthly": [
-# 		"insights.tasks.monthly"
-# 	],
-# }
+scheduler_events = {
+    "hourly": [
+        "insights.insights.doctype.data_source.data_source.sync_all_columns",
+        "insights.insights.doctype.table_rollup.table_rollup.refresh_rollups",
+    ],
+    "daily": [
+        "insights.insights.doctype.table_rollup.table_rollup.create_rollups",
+        "insights.insights.doctype.query.calendar_table.update_calendar",
+    ],
+    "cron": {
+        "*/5 * * * *": [
+            "insights.insights.doctype.insights_dashboard.insights_dashboard.refresh_due_dashboards",
+        ],
+    },
+}
+
+# executions are kept for this many days, can be changed from Log Settings
+default_log_clearing_doctypes = {
+    "Query Execution Log": 30,
+}
 
 # Testing
 # -------
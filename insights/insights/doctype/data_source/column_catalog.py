@@ -0,0 +1,152 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import frappe
+
+from insights.utils import bulk_insert
+
+VERSION_KEY = "insights_column_catalog_version"
+
+# per process copy of the column catalog, keyed by (site, data source)
+_catalogs = {}
+
+
+def get_columns(data_source, table):
+    """Returns columns of `table` from the local catalog, None if the table isn't synced yet"""
+    return get_catalog(data_source).get(table)
+
+
+def get_catalog(data_source):
+    key = (getattr(frappe.local, "site", None), data_source)
+    version = frappe.cache().hget(VERSION_KEY, data_source)
+    cached = _catalogs.get(key)
+    if version and cached and cached[0] == version:
+        return cached[1]
+
+    catalog = load_catalog(data_source)
+    _catalogs[key] = (version or invalidate(data_source), catalog)
+    return catalog
+
+
+def load_catalog(data_source):
+    Table = frappe.qb.DocType("Table")
+    TableColumn = frappe.qb.DocType("Table Column")
+    columns = (
+        frappe.qb.from_(Table)
+        .join(TableColumn)
+        .on((TableColumn.parent == Table.name) & (TableColumn.parenttype == "Table"))
+        .select(
+            Table.table,
+            Table.label.as_("table_label"),
+            TableColumn.column,
+            TableColumn.label,
+            TableColumn.type,
+        )
+        .where(Table.data_source == data_source)
+        .orderby(Table.table)
+        .orderby(TableColumn.idx)
+    ).run(as_dict=True)
+
+    catalog = {}
+    for column in columns:
+        catalog.setdefault(column.table, []).append(column)
+    return catalog
+
+
+def invalidate(data_source):
+    # other processes compare this version with their copy and reload on mismatch
+    version = frappe.generate_hash(length=10)
+    frappe.cache().hset(VERSION_KEY, data_source, version)
+    return version
+
+
+def fetch_source_columns(data_source):
+    """Reads columns of every table on the data source with a single information_schema scan"""
+    columns = data_source.execute_query(
+        """
+            select table_name, column_name, data_type
+            from information_schema.columns
+            where table_schema = database()
+            order by table_name, column_name
+        """,
+        as_dict=1,
+    )
+
+    source_columns = {}
+    for d in columns:
+        source_columns.setdefault(d.get("table_name"), []).append(
+            {
+                "column": d.get("column_name"),
+                "label": frappe.unscrub(d.get("column_name")).rstrip().lstrip(),
+                "type": d.get("data_type").title(),
+            }
+        )
+    return source_columns
+
+
+def sync_columns(data_source, source_columns=None):
+    """Updates the catalog with the columns on the data source.
+
+    Only tables whose columns changed are rewritten. Returns the number of tables updated.
+    """
+    if source_columns is None:
+        source_columns = fetch_source_columns(data_source)
+
+    tables = frappe.get_all(
+        "Table",
+        filters={"data_source": data_source.name},
+        fields=["name", "table"],
+    )
+    catalog = load_catalog(data_source.name)
+
+    changed_tables = []
+    for table in tables:
+        columns = source_columns.get(table.table, [])
+        synced_columns = [
+            {"column": d.column, "label": d.label, "type": d.type}
+            for d in catalog.get(table.table, [])
+        ]
+        if columns != synced_columns:
+            changed_tables.append((table.name, columns))
+
+    if not changed_tables:
+        return 0
+
+    frappe.db.delete(
+        "Table Column",
+        {"parenttype": "Table", "parent": ("in", [d[0] for d in changed_tables])},
+    )
+    insert_columns(changed_tables)
+    invalidate(data_source.name)
+    return len(changed_tables)
+
+
+def insert_columns(table_columns):
+    values = []
+    for parent, columns in table_columns:
+        for idx, column in enumerate(columns, start=1):
+            values.append(
+                (
+                    parent,
+                    "Table",
+                    "columns",
+                    idx,
+                    column["column"],
+                    column["label"],
+                    column["type"],
+                )
+            )
+
+    bulk_insert(
+        "Table Column",
+        fields=[
+            "parent",
+            "parenttype",
+            "parentfield",
+            "idx",
+            "column",
+            "label",
+            "type",
+        ],
+        values=values,
+    )
@@ -0,0 +1,212 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, suppress
+
+import frappe
+from pymysql.err import InterfaceError, OperationalError
+
+from insights.utils import get_config
+
+# defaults can be overridden from site config, eg. "insights_pool_size": 10
+POOL_SIZE = 5
+CHECKOUT_TIMEOUT = 10
+IDLE_TIMEOUT = 5 * 60
+MAX_LIFETIME = 60 * 60
+PING_INTERVAL = 30
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPoolExhausted(frappe.ValidationError):
+    pass
+
+
+class PooledConnection:
+    def __init__(self, db):
+        self.db = db
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+    def is_expired(self, max_lifetime):
+        return time.monotonic() - self.created_at > max_lifetime
+
+    def is_idle(self, idle_timeout):
+        return time.monotonic() - self.last_used > idle_timeout
+
+    def ping(self):
+        try:
+            self.db._conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        with suppress(Exception):
+            self.db.close()
+
+
+class ConnectionPool:
+    """Bounded pool of open connections to a single data source.
+
+    Connections are handed out LIFO so that the warmest connection is reused
+    first and the ones at the bottom of the stack are left to expire.
+    """
+
+    def __init__(self, create_db, version=None):
+        self.create_db = create_db
+        self.version = version
+        self.size = get_config("pool_size", POOL_SIZE)
+        self.checkout_timeout = get_config("checkout_timeout", CHECKOUT_TIMEOUT)
+        self.idle_timeout = get_config("idle_timeout", IDLE_TIMEOUT)
+        self.max_lifetime = get_config("max_lifetime", MAX_LIFETIME)
+        self.ping_interval = get_config("ping_interval", PING_INTERVAL)
+
+        self._idle = deque()
+        self._in_use = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def connection(self):
+        conn = self.checkout()
+        discard = False
+        try:
+            yield conn.db
+        except (InterfaceError, OperationalError):
+            # connection might be broken, don't hand it out again
+            discard = True
+            frappe.log_error(
+                title="Error connecting to database",
+                message=frappe.get_traceback(),
+            )
+            raise
+        finally:
+            self.checkin(conn, discard=discard)
+
+    def checkout(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._condition:
+            while True:
+                self._evict()
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._in_use < self.size:
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    frappe.throw(
+                        "Too many open connections to the data source, try again later",
+                        title="Connection Pool Exhausted",
+                        exc=ConnectionPoolExhausted,
+                    )
+                self._condition.wait(remaining)
+            self._in_use += 1
+
+        try:
+            if conn and not self._is_usable(conn):
+                conn.close()
+                conn = None
+            if not conn:
+                conn = self._open()
+        except Exception:
+            with self._condition:
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+        return conn
+
+    def checkin(self, conn, discard=False):
+        if not discard:
+            try:
+                # end the implicit transaction so that the next checkout
+                # doesn't read from a stale snapshot
+                conn.db._conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._condition:
+            self._in_use -= 1
+            if discard or self._closed or conn.is_expired(self.max_lifetime):
+                to_close = conn
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.append(conn)
+                to_close = None
+            self._condition.notify()
+
+        if to_close:
+            to_close.close()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            idle, self._idle = list(self._idle), deque()
+            self._condition.notify_all()
+
+        for conn in idle:
+            conn.close()
+
+    def _open(self):
+        db = self.create_db()
+        db.connect()
+        return PooledConnection(db)
+
+    def _is_usable(self, conn):
+        if conn.is_expired(self.max_lifetime):
+            return False
+        if conn.is_idle(self.ping_interval):
+            return conn.ping()
+        return True
+
+    def _evict(self):
+        # idle connections are appended to the right, so the oldest are on the left
+        while self._idle and (
+            self._idle[0].is_idle(self.idle_timeout)
+            or self._idle[0].is_expired(self.max_lifetime)
+        ):
+            self._idle.popleft().close()
+
+
+def get_pool_key(data_source_name):
+    return (getattr(frappe.local, "site", None), data_source_name)
+
+
+def get_pool(data_source):
+    """Returns the process wide pool for `data_source`, creating one if required.
+
+    The pool is versioned by the document's `modified` timestamp so that
+    a pool created with stale credentials is replaced in every worker
+    as soon as it sees the updated document.
+    """
+    key = get_pool_key(data_source.name)
+    version = str(data_source.modified)
+    stale_pool = None
+
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool and pool.version != version:
+            stale_pool, pool = pool, None
+        if not pool:
+            pool = ConnectionPool(data_source.create_db, version=version)
+            _pools[key] = pool
+
+    if stale_pool:
+        stale_pool.close()
+
+    return pool
+
+
+def close_pool(data_source_name):
+    with _pools_lock:
+        pool = _pools.pop(get_pool_key(data_source_name), None)
+
+    if pool:
+        pool.close()
@@ -7,18 +7,47 @@ frappe.ui.form.on('Data Source', {
 			frm.call('test_connection')
 		})
 		frm.add_custom_button('Import Tables', () => {
-			frappe
-				.run_serially([
-					() => frappe.dom.freeze('Importing Tables...'),
-					() => frm.call('import_tables'),
-					() => frappe.dom.unfreeze(),
-					() =>
-						frappe.show_alert({
-							message: 'Tables imported successfully',
-							indicator: 'green',
-						}),
-				])
-				.catch(() => frappe.dom.unfreeze())
+			frm.call('import_tables').then(() =>
+				frappe.show_alert({
+					message: 'Importing tables in background',
+					indicator: 'blue',
+				})
+			)
+		})
+		frm.add_custom_button('Suggest Indexes', () => {
+			frm.call('suggest_indexes').then(({ message }) => {
+				if (!message?.length) {
+					frappe.msgprint('Saved queries have the indexes they need')
+					return
+				}
+				const rows = message
+					.map(
+						(d) =>
+							`<tr><td>${d.table}</td><td>${d.columns.join(', ')}</td>` +
+							`<td>${d.queries}</td><td>${d.runs}</td><td>${d.benefit}s</td>` +
+							`<td><code>${d.sql}</code></td></tr>`
+					)
+					.join('')
+				frappe.msgprint({
+					title: 'Suggested Indexes',
+					wide: true,
+					message:
+						`<table class="table table-bordered"><tr><th>Table</th><th>Columns</th>` +
+						`<th>Queries</th><th>Runs</th><th>Time Spent</th><th>SQL</th></tr>${rows}</table>`,
+				})
+			})
+		})
+	},
+	onload: function (frm) {
+		frappe.realtime.on('insights_table_import', (data) => {
+			if (data.data_source !== frm.doc.name) {
+				return
+			}
+			const took = Object.values(data.timings).reduce((a, b) => a + b, 0)
+			frappe.show_alert({
+				message: `Tables imported in ${took.toFixed(2)} seconds`,
+				indicator: 'green',
+			})
 		})
 	},
 })
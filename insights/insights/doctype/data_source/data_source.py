@@ -1,12 +1,43 @@
 # Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
+from contextlib import contextmanager
+
 import frappe
 from frappe.database.mariadb.database import MariaDBDatabase
-from frappe.utils import cint
 from frappe.model.document import Document
-
-from contextlib import contextmanager
+from frappe.utils import cint, flt
+from pymysql.cursors import SSCursor
+from pymysql.err import OperationalError
+
+from insights.insights.doctype.data_source import (
+    column_catalog,
+    dynamic_links,
+    fulltext_indexes,
+    index_advisor,
+    table_import,
+    value_dictionary,
+)
+from insights.insights.doctype.data_source.connection_pool import close_pool, get_pool
+from insights.utils import get_config
+
+
+# defaults can be overridden from site config, eg. "insights_max_result_rows": 500000
+STREAM_BATCH_SIZE = 1000
+MAX_RESULT_ROWS = 100000
+MAX_RESULT_SIZE_MB = 100
+
+RUNNING_QUERIES_KEY = "insights_running_queries"
+# schema changes within this many seconds are synced together
+# defaults can be overridden from site config, eg. "insights_schema_sync_delay": 600
+SCHEMA_SYNC_DELAY = 300
+SCHEMA_SYNC_KEY = "insights_schema_sync_queued"
+# hosts & port of the site's database when its site config leaves them out
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+DEFAULT_PORT = 3306
+# mariadb error codes for a killed query & a query that hit max_statement_time
+ER_QUERY_INTERRUPTED = 1317
+ER_STATEMENT_TIMEOUT = 1969
 
 
 # exception class for when query is not a select query
@@ -14,6 +45,18 @@ class NotSelectQuery(frappe.ValidationError):
     pass
 
 
+class ResultTooLarge(frappe.ValidationError):
+    pass
+
+
+class QueryCancelled(frappe.ValidationError):
+    pass
+
+
+class QueryTimedOut(frappe.ValidationError):
+    pass
+
+
 class DataSource(Document):
     def before_save(self):
         if self.test_connection():
@@ -22,14 +65,21 @@ class DataSource(Document):
             self.status = "Inactive"
 
     def on_update(self):
-        self.import_tables()
+        if self.has_credentials_changed():
+            close_pool(self.name)
+            dynamic_links.clear_cache(self.name)
+            fulltext_indexes.clear_cache(self.name)
+
+        if self.status == "Active":
+            self.import_tables()
 
     def on_trash(self):
-        # TODO: optimize this
-        linked_doctypes = ["Table"]
-        for doctype in linked_doctypes:
-            for table in frappe.db.get_all(doctype, {"data_source": self.name}):
-                frappe.delete_doc(doctype, table.name)
+        close_pool(self.name)
+        dynamic_links.clear_cache(self.name)
+        fulltext_indexes.clear_cache(self.name)
+        table_import.delete_tables(
+            frappe.get_all("Table", {"data_source": self.name}, pluck="name")
+        )
 
     def create_db(self):
         if self.database_type != "MariaDB":
@@ -44,12 +94,20 @@ class DataSource(Document):
             )
 
     def get_db_instance(self):
-        if not self.get("db_instance"):
-            self.db_instance = self.create_db()
-
-        # TODO: cache into site cache with key as self.name
-
-        return self.db_instance
+        # checks out a pooled connection, returned to the pool on exit
+        return get_pool(self).connection()
+
+    def has_credentials_changed(self):
+        credential_fields = (
+            "database_type",
+            "host",
+            "port",
+            "use_ssl",
+            "database_name",
+            "username",
+            "password",
+        )
+        return any(self.has_value_changed(field) for field in credential_fields)
 
     def validate_query(self, query):
         """Check if SQL query is safe for running in restricted context.
@@ -73,19 +131,136 @@ class DataSource(Document):
             exc=NotSelectQuery,
         )
 
-    def execute_query(self, query, **kwargs):
+    def execute_query(self, query, stream=False, timeout=None, run_id=None, **kwargs):
+        """Runs a read only `query` on the data source.
+
+        `timeout` (in seconds) defaults to the data source's max execution time
+        and `run_id` registers the query so that it can be cancelled with `kill_query`.
+        """
         if not query:
             return
 
+        if stream:
+            return self.stream_query(query, timeout=timeout, run_id=run_id, **kwargs)
+
         self.validate_query(query)
+        query = self.apply_timeout(query, timeout)
 
         result = []
-        db_instance = self.get_db_instance()
-        with connect_to_db(db_instance) as db:
+        with self.get_db_instance() as db, self.track_running_query(db, run_id):
             result = db.sql(query, **kwargs)
 
         return result
 
+    def stream_query(
+        self,
+        query,
+        values=None,
+        batch_size=STREAM_BATCH_SIZE,
+        timeout=None,
+        run_id=None,
+    ):
+        """Yields the result of `query` in batches of `batch_size` rows.
+
+        Rows are read with an unbuffered cursor, so only the current batch is
+        held in memory. Raises `ResultTooLarge` once the result crosses the
+        configured row or size limit.
+        """
+        self.validate_query(query)
+        query = self.apply_timeout(query, timeout)
+
+        max_rows = get_config("max_result_rows", MAX_RESULT_ROWS)
+        max_size = get_config("max_result_size", MAX_RESULT_SIZE_MB) * 1024 * 1024
+
+        with self.get_db_instance() as db, self.track_running_query(db, run_id):
+            cursor = db._conn.cursor(SSCursor)
+            row_count = 0
+            result_size = 0
+            try:
+                cursor.execute(query, values)
+                while batch := cursor.fetchmany(batch_size):
+                    row_count += len(batch)
+                    result_size += sum(get_row_size(row) for row in batch)
+                    if row_count > max_rows or result_size > max_size:
+                        # closing the unbuffered cursor would read the rest of the result,
+                        # drop the connection instead, the pool discards it on return
+                        db._conn.close()
+                        frappe.throw(
+                            f"Query result exceeds the limit of {max_rows} rows "
+                            f"or {max_size // (1024 * 1024)} MB, add filters or lower the limit",
+                            title="Result Too Large",
+                            exc=ResultTooLarge,
+                        )
+                    yield batch
+            finally:
+                if db._conn and db._conn.open:
+                    cursor.close()
+
+    def execute_site_query(self, query, values=(), timeout=None, run_id=None):
+        """Runs a read only `query` on the site's database, like `execute_query`.
+
+        Summary tables of the data source's rollups are kept on the site's database.
+        """
+        self.validate_query(query)
+        query = self.apply_timeout(query, timeout)
+        with self.track_running_query(frappe.db, run_id, on_site=True):
+            return frappe.db.sql(query, values or ())
+
+    def apply_timeout(self, query, timeout=None):
+        timeout = flt(timeout) or flt(self.max_execution_time)
+        if not timeout:
+            return query
+
+        # applies only to this statement, so pooled sessions are left untouched
+        return f"SET STATEMENT max_statement_time={timeout} FOR {query}"
+
+    @contextmanager
+    def track_running_query(self, db, run_id=None, on_site=False):
+        if run_id:
+            frappe.cache().hset(
+                RUNNING_QUERIES_KEY,
+                run_id,
+                {
+                    "data_source": self.name,
+                    "connection_id": db._conn.thread_id(),
+                    "on_site": on_site,
+                },
+            )
+
+        try:
+            yield
+        except OperationalError as e:
+            if e.args[0] == ER_QUERY_INTERRUPTED:
+                frappe.throw(
+                    "Query was cancelled", title="Query Cancelled", exc=QueryCancelled
+                )
+            if e.args[0] == ER_STATEMENT_TIMEOUT:
+                frappe.throw(
+                    "Query took longer than the allowed execution time",
+                    title="Query Timed Out",
+                    exc=QueryTimedOut,
+                )
+            raise
+        finally:
+            if run_id:
+                frappe.cache().hdel(RUNNING_QUERIES_KEY, run_id)
+
+    def kill_query(self, run_id):
+        """Kills the query registered as `run_id`, returns False if it isn't running"""
+        running_query = frappe.cache().hget(RUNNING_QUERIES_KEY, run_id)
+        if not running_query or running_query.get("data_source") != self.name:
+            return False
+
+        kill_query = f"KILL QUERY {cint(running_query.get('connection_id'))}"
+        if running_query.get("on_site"):
+            frappe.db.sql(kill_query)
+            return True
+
+        with self.get_db_instance() as db:
+            db.sql(kill_query)
+
+        return True
+
     @frappe.whitelist()
     def test_connection(self):
         connection_status = False
@@ -122,39 +297,25 @@ class DataSource(Document):
 
     @frappe.whitelist()
     def import_tables(self):
-        tables = self.get_tables()
-        table_links = self.get_foreign_key_constraints()
-
-        for table in tables:
-            if table_docname := frappe.db.get_value(
-                "Table",
-                {
-                    "data_source": self.name,
-                    "table": table.get("table"),
-                },
-                "name",
-            ):
-                doc = frappe.get_doc("Table", table_docname)
-            else:
-                doc = frappe.get_doc(
-                    {
-                        "doctype": "Table",
-                        "data_source": self.name,
-                        "table": table.get("table"),
-                        "label": table.get("label"),
-                    }
-                )
-
-            for table_link in table_links.get(table.get("label"), []):
-                if not doc.get("table_links", table_link):
-                    doc.append("table_links", table_link)
-
-            doc.save()
+        frappe.enqueue(
+            "insights.insights.doctype.data_source.data_source.import_data_source_tables",
+            queue="long",
+            data_source=self.name,
+            enqueue_after_commit=True,
+        )
 
     def get_columns(self, table):
         if not table:
             return []
 
+        columns = column_catalog.get_columns(self.name, table.get("table"))
+        if columns is not None:
+            return columns
+
+        # table isn't synced yet
+        return self.get_columns_from_source(table)
+
+    def get_columns_from_source(self, table):
         columns = self.execute_query(
             """
                 select column_name, data_type
@@ -165,7 +326,6 @@ class DataSource(Document):
             as_dict=1,
         )
 
-        # TODO: caching
         _columns = [
             {
                 "table": table.get("table"),
@@ -179,23 +339,23 @@ class DataSource(Document):
 
         return _columns
 
-    def get_distinct_column_values(self, column, search_text, limit=50):
-        Table = frappe.qb.Table(column.get("table"))
-        Field = frappe.qb.Field(column.get("column"))
-        query = (
-            frappe.qb.from_(Table)
-            .select(Field.as_("label"))
-            .distinct()
-            .select(Field.as_("value"))
-            .where(Field.like(f"%{search_text}%"))
-            .limit(limit)
-            .get_sql()
-        )
+    @frappe.whitelist()
+    def sync_columns(self):
+        # indexes may have changed along with the columns
+        fulltext_indexes.sync_indexes(self)
+        return column_catalog.sync_columns(self)
 
-        values = self.execute_query(query, as_dict=1)
+    @frappe.whitelist()
+    def suggest_indexes(self):
+        return index_advisor.suggest_indexes(self)
 
-        # TODO: caching
-        return values
+    def get_fulltext_indexes(self, table):
+        return fulltext_indexes.get_fulltext_indexes(self, table)
+
+    def get_distinct_column_values(self, column, search_text, limit=50):
+        return value_dictionary.search_values(
+            self, column.get("table"), column.get("column"), search_text, limit
+        )
 
     def get_foreign_key_constraints(self):
         # save Link Fields & Table Fields as ForeignKeyConstraints
@@ -230,7 +390,7 @@ class DataSource(Document):
         )
         custom_links = self.execute_query(query, as_dict=1)
 
-        dynamic_links = self.get_dynamic_link_map()
+        dynamic_link_map = self.get_dynamic_link_map()
 
         links = standard_links + custom_links
 
@@ -267,11 +427,11 @@ class DataSource(Document):
                     }
                 )
 
-        for doctype in dynamic_links:
+        for doctype in dynamic_link_map:
             if not doctype:
                 continue
 
-            for link in dynamic_links.get(doctype):
+            for link in dynamic_link_map.get(doctype):
                 foreign_links.setdefault(doctype, []).append(
                     {
                         "foreign_key": link.get("fieldname"),
@@ -289,82 +449,88 @@ class DataSource(Document):
 
         return foreign_links
 
-    def get_dynamic_link_map(self):
-        # copied from frappe.model.dynamic_links
+    def get_dynamic_link_map(self, refresh=False):
+        return dynamic_links.get_dynamic_link_map(self, refresh=refresh)
 
-        DocField = frappe.qb.DocType("DocField")
-        DocType = frappe.qb.DocType("DocType")
-        CustomField = frappe.qb.DocType("Custom Field")
 
-        standard_dynamic_links_query = (
-            frappe.qb.from_(DocField)
-            .from_(DocType)
-            .select(
-                DocField.parent,
-                DocField.fieldname,
-                DocField.options,
-                DocType.issingle,
-            )
-            .where(
-                (DocField.fieldtype == "Dynamic Link")
-                & (DocType.name == DocField.parent)
-            )
-            .get_sql()
-        )
+def get_row_size(row):
+    # rough size in bytes, good enough to enforce limits without serializing rows
+    return sum(len(value) if isinstance(value, (str, bytes)) else 8 for value in row)
 
-        custom_dynamic_links_query = (
-            frappe.qb.from_(CustomField)
-            .from_(DocType)
-            .select(
-                CustomField.dt.as_("parent"),
-                CustomField.fieldname,
-                CustomField.options,
-                DocType.issingle,
-            )
-            .where(
-                (CustomField.fieldtype == "Dynamic Link")
-                & (DocType.name == CustomField.dt)
-            )
-            .get_sql()
-        )
 
-        dynamic_link_queries = [
-            standard_dynamic_links_query,
-            custom_dynamic_links_query,
-        ]
+def sync_columns_on_schema_change(doc, method=None):
+    # doctype changes alter tables of the site's own database,
+    # resync data sources that point to it
+    if frappe.flags.in_migrate or frappe.flags.in_install:
+        # migrations & installs change lots of doctypes, the hourly sync catches up
+        return
+
+    for data_source in frappe.get_all(
+        "Data Source",
+        filters={"status": "Active"},
+        fields=["name", "database_name", "username", "host", "port"],
+    ):
+        if not is_site_database(data_source):
+            continue
 
-        dynamic_link_map = {}
-        dynamic_links = []
-        for query in dynamic_link_queries:
-            dynamic_links += self.execute_query(query, as_dict=True)
-
-        for df in dynamic_links:
-            if df.issingle:
-                dynamic_link_map.setdefault(df.parent, []).append(df)
-            else:
-                try:
-                    links = self.execute_query(
-                        """select distinct {options} from `tab{parent}`""".format(**df)
-                    )
-                    links = [l[0] for l in links]
-                    for doctype in links:
-                        dynamic_link_map.setdefault(doctype, []).append(df)
-                except frappe.db.TableMissingError:  # noqa: E722
-                    pass
-
-        return dynamic_link_map
-
-
-@contextmanager
-def connect_to_db(db):
-    try:
-        db.connect()
-        yield db
-    except Exception as e:
-        frappe.log_error(
-            title="Error connecting to database",
-            message=frappe.get_traceback(),
+        data_source = data_source.name
+        # a sync is queued once for a burst of changes, eg. a bulk customization
+        key = f"{SCHEMA_SYNC_KEY}|{data_source}"
+        if frappe.cache().get_value(key):
+            continue
+
+        frappe.cache().set_value(
+            key, 1, expires_in_sec=get_config("schema_sync_delay", SCHEMA_SYNC_DELAY)
+        )
+        frappe.enqueue(
+            "insights.insights.doctype.data_source.data_source.sync_columns_after_schema_change",
+            data_source=data_source,
+            job_name=key,
+            enqueue_after_commit=True,
         )
-        raise e
-    finally:
-        db.close()
+
+
+def is_site_database(data_source):
+    """Returns whether `data_source` connects to the site's own database"""
+    # connections without a database name open the database named after their user
+    database = data_source.database_name or data_source.username
+    return (
+        database == frappe.conf.db_name
+        and get_host(data_source.host) == get_host(frappe.conf.db_host)
+        and cint(data_source.port or DEFAULT_PORT)
+        == cint(frappe.conf.db_port or DEFAULT_PORT)
+    )
+
+
+def get_host(host):
+    return "localhost" if not host or host in LOCAL_HOSTS else host
+
+
+def sync_columns_after_schema_change(data_source):
+    # changes made while syncing queue another sync
+    frappe.cache().delete_value(f"{SCHEMA_SYNC_KEY}|{data_source}")
+    sync_data_source_columns(data_source)
+
+
+def import_data_source_tables(data_source):
+    timings = table_import.import_tables(frappe.get_doc("Data Source", data_source))
+    frappe.publish_realtime(
+        "insights_table_import",
+        message={"data_source": data_source, "timings": timings},
+        user=frappe.session.user,
+        after_commit=True,
+    )
+
+
+def sync_data_source_columns(data_source):
+    frappe.get_doc("Data Source", data_source).sync_columns()
+
+
+def sync_all_columns():
+    for data_source in frappe.get_all(
+        "Data Source", filters={"status": "Active"}, pluck="name"
+    ):
+        try:
+            sync_data_source_columns(data_source)
+        except Exception:
+            frappe.log_error(title=f"Column sync failed for {data_source}")
@@ -0,0 +1,193 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import time
+
+import frappe
+
+from insights.utils import get_config, run_in_threads
+
+# defaults can be overridden from site config, eg. "insights_dynamic_link_sample_size": 50000
+SAMPLE_SIZE = 10000
+TIME_BUDGET = 60
+PROBE_TIMEOUT = 5
+MAX_WORKERS = 4
+CACHE_TTL = 24 * 60 * 60
+
+CACHE_KEY_PREFIX = "insights_dynamic_link_map"
+
+
+def get_cache_key(data_source):
+    return f"{CACHE_KEY_PREFIX}|{data_source}"
+
+
+def get_dynamic_link_map(data_source, refresh=False):
+    """Returns a map of doctype -> dynamic link fields that point to it.
+
+    The map is cached per data source, pass `refresh` to rediscover it.
+    """
+    key = get_cache_key(data_source.name)
+    if not refresh:
+        dynamic_link_map = frappe.cache().get_value(key)
+        if dynamic_link_map is not None:
+            return dynamic_link_map
+
+    dynamic_link_map = discover_dynamic_links(data_source)
+    frappe.cache().set_value(
+        key,
+        dynamic_link_map,
+        expires_in_sec=get_config("dynamic_link_cache_ttl", CACHE_TTL),
+    )
+    return dynamic_link_map
+
+
+def clear_cache(data_source):
+    frappe.cache().delete_value(get_cache_key(data_source))
+
+
+def discover_dynamic_links(data_source):
+    """Finds the doctypes each dynamic link field points to by probing its table.
+
+    Indexed link columns are read whole with `select distinct`, which the server
+    answers from the index. Other columns are probed on a sample of rows. Probes run
+    in parallel and stop once the time budget is spent, probes that timed out or
+    didn't run are left out of the map.
+    """
+    dynamic_links = get_dynamic_link_fields(data_source)
+
+    dynamic_link_map = {}
+    probes = []
+    for df in dynamic_links:
+        if df.issingle:
+            dynamic_link_map.setdefault(df.parent, []).append(df)
+        else:
+            probes.append(df)
+
+    if not probes:
+        return dynamic_link_map
+
+    indexed_columns = get_indexed_columns(
+        data_source, {f"tab{df.parent}" for df in probes}
+    )
+    sample_size = get_config("dynamic_link_sample_size", SAMPLE_SIZE)
+    probe_timeout = get_config("dynamic_link_probe_timeout", PROBE_TIMEOUT)
+    deadline = time.monotonic() + get_config("dynamic_link_time_budget", TIME_BUDGET)
+
+    def probe(df):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+
+        indexed = (f"tab{df.parent}", df.options) in indexed_columns
+        return probe_link_column(
+            data_source,
+            df,
+            sample_size=None if indexed else sample_size,
+            timeout=min(probe_timeout, remaining),
+        )
+
+    skipped = 0
+    for df, future in run_in_threads(
+        probe, probes, max_workers=get_config("dynamic_link_workers", MAX_WORKERS)
+    ):
+        doctypes = future.result()
+        if doctypes is None:
+            skipped += 1
+            continue
+        for doctype in doctypes:
+            dynamic_link_map.setdefault(doctype, []).append(df)
+
+    if skipped:
+        frappe.logger("insights").info(
+            f"Skipped {skipped} of {len(probes)} dynamic link probes on {data_source.name}"
+        )
+
+    return dynamic_link_map
+
+
+def get_dynamic_link_fields(data_source):
+    # copied from frappe.model.dynamic_links
+
+    DocField = frappe.qb.DocType("DocField")
+    DocType = frappe.qb.DocType("DocType")
+    CustomField = frappe.qb.DocType("Custom Field")
+
+    standard_dynamic_links_query = (
+        frappe.qb.from_(DocField)
+        .from_(DocType)
+        .select(
+            DocField.parent,
+            DocField.fieldname,
+            DocField.options,
+            DocType.issingle,
+        )
+        .where(
+            (DocField.fieldtype == "Dynamic Link") & (DocType.name == DocField.parent)
+        )
+        .get_sql()
+    )
+
+    custom_dynamic_links_query = (
+        frappe.qb.from_(CustomField)
+        .from_(DocType)
+        .select(
+            CustomField.dt.as_("parent"),
+            CustomField.fieldname,
+            CustomField.options,
+            DocType.issingle,
+        )
+        .where(
+            (CustomField.fieldtype == "Dynamic Link") & (DocType.name == CustomField.dt)
+        )
+        .get_sql()
+    )
+
+    dynamic_links = []
+    for query in (standard_dynamic_links_query, custom_dynamic_links_query):
+        dynamic_links += data_source.execute_query(query, as_dict=True)
+    return dynamic_links
+
+
+def get_indexed_columns(data_source, tables):
+    """Returns (table, column) pairs of columns that lead an index"""
+    if not tables:
+        return set()
+
+    columns = data_source.execute_query(
+        """
+            select table_name, column_name
+            from information_schema.statistics
+            where table_schema = database()
+                and seq_in_index = 1
+                and table_name in %(tables)s
+        """,
+        values={"tables": tuple(tables)},
+    )
+    return {(table, column) for table, column in columns}
+
+
+def probe_link_column(data_source, df, sample_size=None, timeout=None):
+    """Returns the distinct doctypes in the link column of `df`, None if the probe timed out.
+
+    With `sample_size`, only that many rows of the table are looked at.
+    """
+    from insights.insights.doctype.data_source.data_source import QueryTimedOut
+
+    if sample_size:
+        query = """
+            select distinct `{options}`
+            from (select `{options}` from `tab{parent}` limit {sample_size}) sample
+        """.format(
+            sample_size=int(sample_size), **df
+        )
+    else:
+        query = """select distinct `{options}` from `tab{parent}`""".format(**df)
+
+    try:
+        links = data_source.execute_query(query, timeout=timeout)
+    except QueryTimedOut:
+        return None
+    except frappe.db.TableMissingError:
+        return []
+
+    return [l[0] for l in links if l[0]]
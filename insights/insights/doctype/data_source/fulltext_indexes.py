@@ -0,0 +1,125 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import frappe
+
+from insights.insights.doctype.query.compiled_cache import invalidate_compiled_queries
+from insights.utils import get_config
+
+# defaults can be overridden from site config, eg. "insights_fulltext_index_cache_ttl": 3600
+CACHE_TTL = 24 * 60 * 60
+
+CACHE_KEY_PREFIX = "insights_fulltext_indexes"
+
+
+def get_cache_key(data_source, table):
+    return f"{CACHE_KEY_PREFIX}|{data_source}|{table}"
+
+
+def get_snapshot_key(data_source):
+    # the indexes of all tables as of the last sync, they're compared on the next
+    return f"{CACHE_KEY_PREFIX}_snapshot|{data_source}"
+
+
+def get_fulltext_indexes(data_source, table):
+    """Returns columns of every FULLTEXT index on `table`, cached per table"""
+    key = get_cache_key(data_source.name, table)
+    indexes = frappe.cache().get_value(key)
+    if indexes is not None:
+        return indexes
+
+    rows = data_source.execute_query(
+        """
+            select index_name, column_name
+            from information_schema.statistics
+            where table_schema = database()
+                and table_name = %(table)s
+                and index_type = 'FULLTEXT'
+            order by index_name, seq_in_index
+        """,
+        values={"table": table},
+    )
+    indexes = group_columns(rows)
+    cache_indexes(data_source.name, table, indexes)
+    return indexes
+
+
+def sync_indexes(data_source):
+    """Caches FULLTEXT indexes of every table, compared with those of the last sync.
+
+    Only queries on tables whose indexes changed are built again on their next run.
+    """
+    rows = data_source.execute_query(
+        """
+            select table_name, index_name, column_name
+            from information_schema.statistics
+            where table_schema = database()
+                and index_type = 'FULLTEXT'
+            order by table_name, index_name, seq_in_index
+        """
+    )
+    rows_by_table = {}
+    for table, index, column in rows:
+        rows_by_table.setdefault(table, []).append((index, column))
+    indexes = {table: group_columns(rows) for table, rows in rows_by_table.items()}
+
+    key = get_snapshot_key(data_source.name)
+    previous = frappe.cache().get_value(key)
+    frappe.cache().set_value(key, indexes)
+    if previous is None:
+        # not synced before, queries may have been built on any of the indexes
+        frappe.cache().delete_keys(f"{CACHE_KEY_PREFIX}|{data_source.name}|")
+        changed = set(indexes)
+    else:
+        changed = {
+            table
+            for table in set(indexes) | set(previous)
+            if indexes.get(table, []) != previous.get(table, [])
+        }
+
+    for table in changed:
+        cache_indexes(data_source.name, table, indexes.get(table, []))
+    if changed:
+        invalidate_queries(data_source.name, changed)
+
+
+def group_columns(rows):
+    columns = {}
+    for index, column in rows:
+        columns.setdefault(index, []).append(column)
+    return [tuple(index) for index in columns.values()]
+
+
+def cache_indexes(data_source, table, indexes):
+    frappe.cache().set_value(
+        get_cache_key(data_source, table),
+        indexes,
+        expires_in_sec=get_config("fulltext_index_cache_ttl", CACHE_TTL),
+    )
+
+
+def invalidate_queries(data_source, tables=None):
+    """Drops compiled queries with full-text search on `tables`, or on any table"""
+    queries = set(
+        frappe.get_all(
+            "Query",
+            filters={"data_source": data_source, "fulltext_search": 1},
+            pluck="name",
+        )
+    )
+    if tables is not None:
+        queries &= set(
+            frappe.get_all(
+                "Query Table",
+                filters={"parenttype": "Query", "table": ("in", list(tables))},
+                pluck="parent",
+            )
+        )
+    invalidate_compiled_queries(data_source, queries)
+
+
+def clear_cache(data_source):
+    frappe.cache().delete_keys(f"{CACHE_KEY_PREFIX}|{data_source}|")
+    frappe.cache().delete_value(get_snapshot_key(data_source))
+    # queries may match on indexes that are gone, they're built again on their next run
+    invalidate_queries(data_source)
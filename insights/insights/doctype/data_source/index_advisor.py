@@ -0,0 +1,196 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+from json import loads
+
+import frappe
+from frappe import _dict
+from frappe.utils import cint, flt
+
+MAX_INDEX_COLUMNS = 3
+MAX_SUGGESTIONS = 20
+# operators that an index can look up rows with, range lookups end the index
+EQUALITY_OPERATORS = ("=", "in", "is")
+RANGE_OPERATORS = ("<", ">", "<=", ">=", "between", "timespan", "starts with")
+
+
+def suggest_indexes(data_source, limit=MAX_SUGGESTIONS):
+    """Returns indexes that would help the saved queries of `data_source` the most.
+
+    Every query proposes an index per table on its filter columns, equality ones
+    first & then a range one, or on its group by & order by columns if it has no
+    filters, and one on the key of every join. Candidates are ranked by the time
+    their queries spend running, runs × last execution time, and are left out if
+    an existing index already starts with their columns.
+    """
+    candidates = {}
+    queries = frappe.get_all(
+        "Query",
+        filters={"data_source": data_source.name, "rollup": ("is", "not set")},
+        pluck="name",
+    )
+    for query in queries:
+        query = frappe.get_doc("Query", query)
+        # runs weren't counted before, a query that has a result ran at least once
+        runs = cint(query.run_count) or (1 if query.last_execution else 0)
+        if not runs:
+            continue
+
+        for candidate in get_index_candidates(query):
+            suggestion = candidates.setdefault(
+                candidate, _dict(queries=0, runs=0, benefit=0)
+            )
+            suggestion.queries += 1
+            suggestion.runs += runs
+            suggestion.benefit += runs * flt(query.execution_time)
+
+    tables = {table for table, _, _ in candidates}
+    indexes = get_indexes(data_source, tables)
+    table_rows = get_table_rows(data_source, tables)
+
+    suggestions = []
+    for (table, unordered, ordered), suggestion in candidates.items():
+        if any(covers(index, unordered, ordered) for index in indexes.get(table, [])):
+            continue
+
+        columns = list(unordered + ordered)[:MAX_INDEX_COLUMNS]
+        suggestion.update(
+            table=table,
+            columns=columns,
+            benefit=flt(suggestion.benefit, 3),
+            table_rows=table_rows.get(table),
+            sql=get_create_index_sql(table, columns),
+        )
+        suggestions.append(suggestion)
+
+    suggestions.sort(key=lambda d: (d.benefit, d.runs), reverse=True)
+    return suggestions[:limit]
+
+
+def get_index_candidates(query):
+    """Returns (table, unordered columns, ordered columns) of indexes `query` could use.
+
+    Equality & group by columns can be in any order in the index, they are sorted
+    so that queries listing them differently propose the same index.
+    """
+    filter_columns = get_filter_columns(loads(query.filters or "{}"))
+    candidates = set()
+    for table in {row.table for row in query.tables}:
+        equality, ranges = filter_columns.get(table, ([], []))
+        if equality or ranges:
+            unordered = tuple(sorted(set(equality)))
+            ordered = tuple(d for d in ranges if d not in unordered)[:1]
+        else:
+            rows = [row for row in query.columns if row.table == table]
+            unordered = tuple(
+                sorted(
+                    {
+                        row.column
+                        for row in rows
+                        if row.aggregation == "Group By" and not row.is_expression
+                    }
+                )
+            )
+            ordered = tuple(
+                row.column
+                for row in rows
+                if row.order_by and not row.aggregation and not row.is_expression
+            )[:1]
+
+        if unordered or ordered:
+            candidates.add((table, unordered, ordered))
+
+    for row in query.tables:
+        if row.join:
+            join = loads(row.join)
+            # joins are on `name` of the left table, which is the primary key
+            candidates.add((join["with"]["value"], (join["key"]["value"],), ()))
+
+    return candidates
+
+
+def get_filter_columns(filters):
+    """Returns (equality, range) columns by table, of filters every row must meet"""
+    columns = {}
+
+    def visit(group):
+        # conditions that are or-ed can't be looked up with a single index
+        if group.get("group_operator") != "&":
+            return
+
+        for condition in group.get("conditions") or []:
+            if "conditions" in condition:
+                visit(condition)
+                continue
+
+            left = condition.get("left") or {}
+            operator = (condition.get("operator") or {}).get("value")
+            if "table" not in left or "column" not in left:
+                continue
+
+            equality, ranges = columns.setdefault(left["table"], ([], []))
+            if operator in EQUALITY_OPERATORS:
+                equality.append(left["column"])
+            elif operator in RANGE_OPERATORS:
+                ranges.append(left["column"])
+
+    visit(filters)
+    return columns
+
+
+def covers(index, unordered, ordered):
+    """Returns True if `index` starts with `unordered` columns, then `ordered` ones"""
+    size = len(unordered)
+    return (
+        set(index[:size]) == set(unordered)
+        and tuple(index[size : size + len(ordered)]) == ordered
+    )
+
+
+def get_indexes(data_source, tables):
+    """Returns columns of every index by table, in the order they are indexed"""
+    if not tables:
+        return {}
+
+    rows = data_source.execute_query(
+        """
+            select table_name, index_name, column_name
+            from information_schema.statistics
+            where table_schema = database()
+                and table_name in %(tables)s
+            order by table_name, index_name, seq_in_index
+        """,
+        values={"tables": tuple(tables)},
+    )
+
+    columns = {}
+    for table, index, column in rows:
+        columns.setdefault((table, index), []).append(column)
+
+    indexes = {}
+    for (table, _), index in columns.items():
+        indexes.setdefault(table, []).append(tuple(index))
+    return indexes
+
+
+def get_table_rows(data_source, tables):
+    """Returns the estimated row count by table"""
+    if not tables:
+        return {}
+
+    rows = data_source.execute_query(
+        """
+            select table_name, table_rows
+            from information_schema.tables
+            where table_schema = database()
+                and table_name in %(tables)s
+        """,
+        values={"tables": tuple(tables)},
+    )
+    return {table: cint(count) for table, count in rows}
+
+
+def get_create_index_sql(table, columns):
+    name = "_".join(["insights"] + columns)[:64]
+    column_list = ", ".join(f"`{column}`" for column in columns)
+    return f"CREATE INDEX `{name}` ON `{table}` ({column_list})"
@@ -0,0 +1,185 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import time
+from contextlib import contextmanager
+
+import frappe
+from frappe import _dict
+from frappe.utils import flt
+
+from insights.insights.doctype.data_source import column_catalog
+from insights.utils import bulk_insert
+
+
+def import_tables(data_source):
+    """Syncs Table & Table Link records with the tables on `data_source`.
+
+    Remote tables and links are diffed against the existing records in memory
+    and only the differences are written, in bulk. Returns the time taken by each phase.
+    """
+    timings = {}
+
+    @contextmanager
+    def phase(name):
+        start = time.time()
+        yield
+        timings[name] = flt(time.time() - start, 3)
+
+    with phase("fetch_tables"):
+        source_tables = {d.get("table"): d for d in data_source.get_tables()}
+    with phase("fetch_links"):
+        source_links = data_source.get_foreign_key_constraints()
+    with phase("fetch_columns"):
+        source_columns = column_catalog.fetch_source_columns(data_source)
+
+    with phase("load_existing"):
+        existing_tables = {
+            d.table: d
+            for d in frappe.get_all(
+                "Table",
+                filters={"data_source": data_source.name},
+                fields=["name", "table", "label"],
+            )
+        }
+        existing_links = get_existing_links([d.name for d in existing_tables.values()])
+
+    with phase("diff"):
+        new_tables = [t for t in source_tables if t not in existing_tables]
+        removed_tables = [
+            d.name for t, d in existing_tables.items() if t not in source_tables
+        ]
+        relabeled_tables = [
+            (d.name, source_tables[t].get("label"))
+            for t, d in existing_tables.items()
+            if t in source_tables and d.label != source_tables[t].get("label")
+        ]
+
+        table_names = {t: d.name for t, d in existing_tables.items()}
+        table_names.update({t: frappe.generate_hash(length=10) for t in new_tables})
+
+        links_to_insert = []
+        links_to_delete = []
+        for table, table_name in table_names.items():
+            if table not in source_tables:
+                continue
+            links = {
+                link_key(d): d
+                for d in source_links.get(source_tables[table].get("label"), [])
+            }
+            current_links = existing_links.get(table_name, {})
+            links_to_insert += [
+                (table_name, links[key]) for key in links if key not in current_links
+            ]
+            links_to_delete += [
+                current_links[key] for key in current_links if key not in links
+            ]
+
+    with phase("apply"):
+        insert_tables(data_source.name, new_tables, source_tables, table_names)
+        delete_tables(removed_tables)
+        for table_name, label in relabeled_tables:
+            frappe.db.set_value("Table", table_name, "label", label)
+        insert_links(links_to_insert, existing_links)
+        if links_to_delete:
+            frappe.db.delete("Table Link", {"name": ("in", links_to_delete)})
+
+    with phase("sync_columns"):
+        column_catalog.sync_columns(data_source, source_columns)
+
+    frappe.cache().delete_value(f"query_tables_{data_source.name}")
+
+    frappe.logger("insights").info(
+        f"Imported tables of {data_source.name}: {len(new_tables)} added, "
+        f"{len(removed_tables)} removed, {len(links_to_insert)} links added, "
+        f"{len(links_to_delete)} links removed, timings: {timings}"
+    )
+    return timings
+
+
+def link_key(link):
+    return (
+        link.get("foreign_key"),
+        link.get("foreign_table"),
+        link.get("foreign_table_label"),
+    )
+
+
+def get_existing_links(table_names):
+    if not table_names:
+        return {}
+
+    links = frappe.get_all(
+        "Table Link",
+        filters={"parenttype": "Table", "parent": ("in", table_names)},
+        fields=[
+            "name",
+            "parent",
+            "foreign_key",
+            "foreign_table",
+            "foreign_table_label",
+        ],
+    )
+
+    existing_links = {}
+    for link in links:
+        existing_links.setdefault(link.parent, {})[link_key(link)] = link.name
+    return existing_links
+
+
+def insert_tables(data_source, new_tables, source_tables, table_names):
+    # names are generated upfront so that links can refer to them
+    bulk_insert(
+        "Table",
+        fields=["data_source", "table", "label"],
+        values=[
+            (data_source, table, source_tables[table].get("label"))
+            for table in new_tables
+        ],
+        names=[table_names[table] for table in new_tables],
+    )
+
+
+def insert_links(links_to_insert, existing_links):
+    next_idx = _dict()
+    values = []
+    for table_name, link in links_to_insert:
+        if table_name not in next_idx:
+            next_idx[table_name] = len(existing_links.get(table_name, {})) + 1
+        values.append(
+            (
+                table_name,
+                "Table",
+                "table_links",
+                next_idx[table_name],
+                link.get("foreign_key"),
+                link.get("foreign_table"),
+                link.get("foreign_table_label"),
+            )
+        )
+        next_idx[table_name] += 1
+
+    bulk_insert(
+        "Table Link",
+        fields=[
+            "parent",
+            "parenttype",
+            "parentfield",
+            "idx",
+            "foreign_key",
+            "foreign_table",
+            "foreign_table_label",
+        ],
+        values=values,
+    )
+
+
+def delete_tables(table_names):
+    if not table_names:
+        return
+
+    for child_doctype in ("Table Link", "Table Column"):
+        frappe.db.delete(
+            child_doctype, {"parenttype": "Table", "parent": ("in", table_names)}
+        )
+    frappe.db.delete("Table", {"name": ("in", table_names)})
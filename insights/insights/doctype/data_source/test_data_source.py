@@ -3,7 +3,175 @@
 
 # import frappe
 import unittest
+from json import dumps
+
+from frappe import _dict
+
+from insights.insights.doctype.data_source.connection_pool import (
+    ConnectionPool,
+    ConnectionPoolExhausted,
+)
+from insights.insights.doctype.data_source.index_advisor import (
+    covers,
+    get_index_candidates,
+)
+from insights.insights.doctype.data_source.value_dictionary import ValueIndex
+
+
+class FakeConnection:
+    def __init__(self):
+        self.open = True
+
+    def ping(self, reconnect=False):
+        if not self.open:
+            raise Exception("Connection closed")
+
+    def rollback(self):
+        pass
+
+
+class FakeDatabase:
+    def connect(self):
+        self._conn = FakeConnection()
+
+    def close(self):
+        self._conn.open = False
 
 
 class TestDataSource(unittest.TestCase):
     pass
+
+
+class TestConnectionPool(unittest.TestCase):
+    def make_pool(self, size=2):
+        pool = ConnectionPool(FakeDatabase)
+        pool.size = size
+        pool.checkout_timeout = 0
+        return pool
+
+    def test_connection_is_reused(self):
+        pool = self.make_pool()
+        with pool.connection() as db:
+            first = db
+        with pool.connection() as db:
+            self.assertIs(db, first)
+
+    def test_pool_is_bounded(self):
+        pool = self.make_pool(size=1)
+        conn = pool.checkout()
+        self.assertRaises(ConnectionPoolExhausted, pool.checkout)
+        pool.checkin(conn)
+        pool.checkin(pool.checkout())
+
+    def test_expired_connection_is_recycled(self):
+        pool = self.make_pool()
+        conn = pool.checkout()
+        pool.checkin(conn)
+        pool.max_lifetime = 0
+        with pool.connection() as db:
+            self.assertIsNot(db, conn.db)
+        self.assertFalse(conn.db._conn.open)
+
+    def test_close_pool(self):
+        pool = self.make_pool()
+        conn = pool.checkout()
+        pool.close()
+        pool.checkin(conn)
+        self.assertFalse(conn.db._conn.open)
+
+
+class TestValueIndex(unittest.TestCase):
+    def test_prefix_matches_rank_first(self):
+        index = ValueIndex(["Sales Invoice", "Purchase Invoice", "Invoice Item"])
+        self.assertEqual(
+            index.search("inv"), ["Invoice Item", "Purchase Invoice", "Sales Invoice"]
+        )
+
+    def test_search_is_case_insensitive(self):
+        index = ValueIndex(["Customer", "Supplier"])
+        self.assertEqual(index.search("PLI"), ["Supplier"])
+        self.assertEqual(index.search("cu"), ["Customer"])
+
+    def test_search_respects_limit(self):
+        index = ValueIndex([f"Item {i}" for i in range(100)])
+        self.assertEqual(len(index.search("item", limit=10)), 10)
+
+
+def make_condition(column, operator, value=None):
+    return {
+        "left": {"table": "tabSales Invoice", "column": column},
+        "operator": {"value": operator},
+        "right": {"value": value},
+    }
+
+
+class TestIndexAdvisor(unittest.TestCase):
+    def test_filter_candidates(self):
+        query = _dict(
+            tables=[_dict(table="tabSales Invoice", join=None)],
+            columns=[],
+            filters=dumps(
+                {
+                    "group_operator": "&",
+                    "conditions": [
+                        make_condition(
+                            "posting_date", "between", "2022-01-01,2022-01-31"
+                        ),
+                        make_condition("status", "=", "Paid"),
+                        make_condition("company", "in", ["Acme"]),
+                        # or-ed conditions can't be looked up together
+                        {
+                            "group_operator": "|",
+                            "conditions": [make_condition("customer", "=", "A")],
+                        },
+                    ],
+                }
+            ),
+        )
+        self.assertEqual(
+            get_index_candidates(query),
+            {("tabSales Invoice", ("company", "status"), ("posting_date",))},
+        )
+
+    def test_join_and_group_by_candidates(self):
+        query = _dict(
+            tables=[
+                _dict(
+                    table="tabSales Invoice",
+                    join=dumps(
+                        {
+                            "with": {"value": "tabSales Invoice Item"},
+                            "key": {"value": "parent"},
+                            "type": {"value": "left"},
+                        }
+                    ),
+                ),
+            ],
+            columns=[
+                _dict(
+                    table="tabSales Invoice", column="customer", aggregation="Group By"
+                )
+            ],
+            filters=dumps({"group_operator": "&", "conditions": []}),
+        )
+        self.assertEqual(
+            get_index_candidates(query),
+            {
+                ("tabSales Invoice", ("customer",), ()),
+                ("tabSales Invoice Item", ("parent",), ()),
+            },
+        )
+
+    def test_covers(self):
+        self.assertTrue(
+            covers(
+                ("status", "company", "posting_date"),
+                ("company", "status"),
+                ("posting_date",),
+            )
+        )
+        self.assertTrue(covers(("parent", "idx"), ("parent",), ()))
+        self.assertFalse(covers(("company",), ("company", "status"), ()))
+        self.assertFalse(
+            covers(("posting_date", "status"), ("status",), ("posting_date",))
+        )
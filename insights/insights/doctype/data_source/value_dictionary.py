@@ -0,0 +1,233 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import time
+from bisect import bisect_left
+
+import frappe
+from frappe.query_builder.functions import Max
+from frappe.utils import cstr
+
+from insights.utils import get_config
+
+# defaults can be overridden from site config, eg. "insights_value_dictionary_size": 20000
+MAX_CARDINALITY = 10000
+REFRESH_INTERVAL = 10 * 60
+BUILD_TIMEOUT = 30
+FULL_BUILD_INTERVAL = 24 * 60 * 60
+
+CACHE_KEY_PREFIX = "insights_value_dictionary"
+# kept apart from the values, so that searches read the values only when they changed
+META_FIELDS = ("version", "built_at", "high_cardinality")
+
+# per process search index of each dictionary, keyed by (site, cache key)
+_indexes = {}
+
+
+class ValueIndex:
+    """In memory index of a column's distinct values for prefix & trigram search"""
+
+    def __init__(self, values):
+        self.values = sorted({cstr(v) for v in values if v not in (None, "")})
+        self.keys = sorted((v.lower(), i) for i, v in enumerate(self.values))
+        self.trigrams = {}
+        for i, value in enumerate(self.values):
+            for trigram in get_trigrams(value.lower()):
+                self.trigrams.setdefault(trigram, set()).add(i)
+
+    def search(self, text, limit=50):
+        text = cstr(text).lower()
+        if not text:
+            return self.values[:limit]
+
+        # values that start with the text rank above ones that only contain it
+        matches = []
+        pos = bisect_left(self.keys, (text,))
+        while pos < len(self.keys) and len(matches) < limit:
+            key, i = self.keys[pos]
+            if not key.startswith(text):
+                break
+            matches.append(i)
+            pos += 1
+
+        if len(matches) < limit:
+            seen = set(matches)
+            matches += [
+                i
+                for i in sorted(self.get_candidates(text))
+                if i not in seen and text in self.values[i].lower()
+            ][: limit - len(matches)]
+
+        return [self.values[i] for i in matches]
+
+    def get_candidates(self, text):
+        trigrams = get_trigrams(text)
+        if not trigrams:
+            # too short for trigrams, check every value
+            return range(len(self.values))
+
+        postings = sorted((self.trigrams.get(t, set()) for t in trigrams), key=len)
+        return set.intersection(*postings)
+
+
+def get_trigrams(text):
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def get_cache_key(data_source, table, column):
+    return f"{CACHE_KEY_PREFIX}|{data_source}|{table}|{column}"
+
+
+def get_meta_key(key):
+    return f"{key}|meta"
+
+
+def search_values(data_source, table, column, search_text, limit=50):
+    """Returns values of `column` that match `search_text`, as label/value dicts.
+
+    Values are looked up in the column's dictionary. Columns without a dictionary yet
+    or with too many distinct values are searched on the data source by prefix.
+    """
+    key = get_cache_key(data_source.name, table, column)
+    meta = frappe.cache().get_value(get_meta_key(key))
+
+    if not meta or is_stale(meta):
+        enqueue_build(data_source.name, table, column)
+
+    index = None
+    if meta and not meta.get("high_cardinality"):
+        index = get_index(key, meta["version"])
+
+    if index:
+        values = index.search(search_text, limit)
+    else:
+        values = search_source(data_source, table, column, search_text, limit)
+
+    return [{"label": value, "value": value} for value in values]
+
+
+def get_index(key, version):
+    """Returns the search index of the dictionary, read from the cache if it changed"""
+    index_key = (getattr(frappe.local, "site", None), key)
+    cached = _indexes.get(index_key)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    dictionary = frappe.cache().get_value(key)
+    if not dictionary:
+        return
+
+    index = ValueIndex(dictionary["values"])
+    _indexes[index_key] = (dictionary["version"], index)
+    return index
+
+
+def search_source(data_source, table, column, search_text, limit=50):
+    # a prefix match can be answered from an index on the column, unlike '%text%'
+    search_text = cstr(search_text).replace("\\", "\\\\")
+    search_text = search_text.replace("%", "\\%").replace("_", "\\_")
+    Table = frappe.qb.Table(table)
+    Field = frappe.qb.Field(column)
+    query = (
+        frappe.qb.from_(Table)
+        .select(Field)
+        .distinct()
+        .where(Field.like(f"{search_text}%"))
+        .orderby(Field)
+        .limit(limit)
+        .get_sql()
+    )
+    return [d[0] for d in data_source.execute_query(query) if d[0] not in (None, "")]
+
+
+def is_stale(dictionary):
+    refresh_interval = get_config("value_dictionary_refresh_interval", REFRESH_INTERVAL)
+    return time.time() - dictionary["built_at"] > refresh_interval
+
+
+def enqueue_build(data_source, table, column):
+    key = get_cache_key(data_source, table, column)
+    # one build at a time per column, the flag expires in case the job dies
+    lock = frappe.cache().make_key(f"{key}|building")
+    if not frappe.cache().set(lock, 1, nx=True, ex=BUILD_TIMEOUT * 2):
+        return
+
+    frappe.enqueue(
+        "insights.insights.doctype.data_source.value_dictionary.build_dictionary",
+        data_source=data_source,
+        table=table,
+        column=column,
+        enqueue_after_commit=True,
+    )
+
+
+def build_dictionary(data_source, table, column):
+    """Builds or refreshes the value dictionary of `column`.
+
+    Tables with a `modified` column are refreshed incrementally by reading only
+    the values of rows modified since the last build, values of deleted rows are
+    dropped at the next full build. Columns with more distinct values than the
+    configured size are marked as high cardinality and aren't stored.
+    """
+    doc = frappe.get_cached_doc("Data Source", data_source)
+    key = get_cache_key(data_source, table, column)
+    try:
+        dictionary = build_values(
+            doc, table, column, frappe.cache().get_value(key) or {}
+        )
+        # values are written first, a search never finds a version without its values
+        frappe.cache().set_value(key, dictionary)
+        frappe.cache().set_value(
+            get_meta_key(key), {field: dictionary[field] for field in META_FIELDS}
+        )
+    finally:
+        frappe.cache().delete_value(f"{key}|building")
+
+
+def build_values(data_source, table, column, dictionary):
+    max_cardinality = get_config("value_dictionary_size", MAX_CARDINALITY)
+    now = time.time()
+
+    Table = frappe.qb.Table(table)
+    Field = frappe.qb.Field(column)
+    query = frappe.qb.from_(Table).select(Field).distinct().limit(max_cardinality + 1)
+
+    watermark = None
+    if has_modified_column(data_source, table):
+        # read before the values, rows modified in between are picked up next time
+        watermark = data_source.execute_query(
+            frappe.qb.from_(Table).select(Max(Table.modified)).get_sql()
+        )[0][0]
+
+    full_build_at = now
+    values = set()
+    if (
+        watermark
+        and dictionary.get("watermark")
+        and not dictionary.get("high_cardinality")
+        and now - dictionary["full_build_at"] < FULL_BUILD_INTERVAL
+    ):
+        full_build_at = dictionary["full_build_at"]
+        values.update(dictionary["values"])
+        query = query.where(Table.modified > dictionary["watermark"])
+
+    values.update(
+        cstr(d[0])
+        for d in data_source.execute_query(query.get_sql(), timeout=BUILD_TIMEOUT)
+        if d[0] not in (None, "")
+    )
+
+    high_cardinality = len(values) > max_cardinality
+    return {
+        "values": [] if high_cardinality else sorted(values),
+        "high_cardinality": high_cardinality,
+        "watermark": watermark,
+        "built_at": now,
+        "full_build_at": full_build_at,
+        "version": frappe.generate_hash(length=10),
+    }
+
+
+def has_modified_column(data_source, table):
+    columns = data_source.get_columns({"table": table}) or []
+    return any(d.get("column") == "modified" for d in columns)
@@ -1,13 +1,33 @@
 # Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
+import random
+import threading
 from json import dumps
 
 import frappe
+from frappe import _dict
 from frappe.model.document import Document
+from frappe.utils import add_to_date, cint, now_datetime
+
+from insights.insights.doctype.query.result_store import get_result
+from insights.utils import get_config, run_in_threads
+
+# rows of each item sent to the dashboard, same as the rows shown in the query builder
+MAX_ROWS = 1000
+# queries run at a time on each data source,
+# can be overridden from site config with "insights_dashboard_workers"
+WORKERS_PER_DATA_SOURCE = 4
+# scheduled refreshes are delayed by up to this fraction of the interval, capped in seconds
+REFRESH_JITTER = 0.1
+MAX_REFRESH_JITTER = 15 * 60
 
 
 class InsightsDashboard(Document):
+    def validate(self):
+        if self.has_value_changed("refresh_interval"):
+            self.schedule_next_refresh()
+
     @frappe.whitelist()
     def get_visualizations(self):
         visualizations = [row.visualization for row in self.visualizations]
@@ -37,3 +57,143 @@ class InsightsDashboard(Document):
             return
         row[0].layout = dumps(layout, indent=2)
         self.save()
+
+    @frappe.whitelist()
+    def load_items(self):
+        """Returns the result of every item's query, publishing each one as it is ready.
+
+        Items whose queries compile to the same SQL share a single result. Queries
+        without a stored result are run in parallel, a few at a time per data source.
+        """
+        results = {}
+
+        def publish(group, result=None, error=None):
+            for row in group.rows:
+                results[row.visualization] = {
+                    "query": row.query,
+                    "result": result,
+                    "error": error,
+                    # results are refreshed on schedule, show how old they are
+                    "last_execution": group.query.last_execution,
+                }
+                frappe.publish_realtime(
+                    "insights_dashboard_item",
+                    message={
+                        "dashboard": self.name,
+                        "visualization": row.visualization,
+                        **results[row.visualization],
+                    },
+                    user=frappe.session.user,
+                )
+
+        pending = []
+        for group in self.get_query_groups():
+            if has_result(group.query):
+                publish(group, get_result(group.query.result_key, 0, MAX_ROWS))
+            else:
+                pending.append(group)
+
+        workers = get_config("dashboard_workers", WORKERS_PER_DATA_SOURCE)
+        semaphores = {
+            group.data_source: threading.BoundedSemaphore(workers) for group in pending
+        }
+
+        def run(group):
+            with semaphores[group.data_source]:
+                query = frappe.get_doc("Query", group.query.name)
+                query.run(background=False)
+                frappe.db.commit()
+                group.query.last_execution = query.last_execution
+                return get_result(query.result_key, 0, MAX_ROWS)
+
+        for group, future in run_in_threads(
+            run, pending, max_workers=workers * len(semaphores) or 1
+        ):
+            try:
+                publish(group, future.result())
+            except Exception as e:
+                publish(group, error=str(e))
+
+        return results
+
+    def get_query_groups(self):
+        """Returns the queries behind the items, grouped by their compiled SQL"""
+        queries = {
+            d.name: d
+            for d in frappe.get_list(
+                "Query",
+                filters={"name": ("in", [row.query for row in self.visualizations])},
+                fields=[
+                    "name",
+                    "data_source",
+                    "sql",
+                    "sql_params",
+                    "status",
+                    "result_key",
+                    "last_execution",
+                ],
+            )
+        }
+
+        groups = {}
+        for row in self.visualizations:
+            query = queries.get(row.query)
+            if not query or not query.sql:
+                continue
+            group = groups.setdefault(
+                (query.data_source, query.sql, query.sql_params),
+                _dict(data_source=query.data_source, query=query, rows=[]),
+            )
+            group.rows.append(row)
+            # prefer a query that already has a result
+            if not has_result(group.query) and has_result(query):
+                group.query = query
+
+        return list(groups.values())
+
+    def schedule_next_refresh(self):
+        if not cint(self.refresh_interval):
+            self.next_refresh = None
+            return
+
+        # dashboards with the same interval drift apart instead of refreshing together
+        interval = cint(self.refresh_interval) * 60
+        jitter = random.uniform(0, min(interval * REFRESH_JITTER, MAX_REFRESH_JITTER))
+        self.next_refresh = add_to_date(now_datetime(), seconds=interval + jitter)
+
+
+def has_result(query):
+    return query.status == "Execution Successful" and query.result_key
+
+
+def refresh_due_dashboards():
+    """Enqueues a refresh of every dashboard whose next refresh is due"""
+    for dashboard in frappe.get_all(
+        "Insights Dashboard",
+        filters={"refresh_interval": (">", 0), "next_refresh": ("<=", now_datetime())},
+        pluck="name",
+    ):
+        doc = frappe.get_doc("Insights Dashboard", dashboard)
+        # schedule the next refresh upfront so that the dashboard isn't picked up again
+        doc.schedule_next_refresh()
+        doc.db_set("next_refresh", doc.next_refresh, update_modified=False)
+        frappe.enqueue(
+            "insights.insights.doctype.insights_dashboard.insights_dashboard.refresh_dashboard",
+            queue="long",
+            dashboard=dashboard,
+            enqueue_after_commit=True,
+        )
+
+
+def refresh_dashboard(dashboard):
+    """Runs every query behind the dashboard, so that opening it reads stored results"""
+    doc = frappe.get_doc("Insights Dashboard", dashboard)
+    for group in doc.get_query_groups():
+        try:
+            frappe.get_doc("Query", group.query.name).run(background=False)
+            frappe.db.commit()
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(title=f"Error refreshing query {group.query.name}")
+
+    doc.db_set("last_refresh", now_datetime(), update_modified=False)
@@ -6,4 +6,11 @@ from frappe.model.document import Document
 
 
 class InsightsSettings(Document):
-    pass
+    def on_update(self):
+        if self.has_value_changed("fiscal_year_start"):
+            # periods of the calendar are of the fiscal year it was built with
+            frappe.enqueue(
+                "insights.insights.doctype.query.calendar_table.rebuild_calendar",
+                queue="long",
+                enqueue_after_commit=True,
+            )
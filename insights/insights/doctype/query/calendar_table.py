@@ -0,0 +1,269 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+from datetime import date, timedelta
+
+import frappe
+from frappe.utils import add_to_date, cint, getdate, nowdate
+from frappe.utils.data import get_first_day_of_week
+
+from insights.utils import get_config
+
+# one row per day on the site's database, with keys of the periods the day is in
+CALENDAR_TABLE = "_insights_calendar"
+# years kept around today, days of rollup buckets are added as they're needed
+# defaults can be overridden from site config, eg. "insights_calendar_years_ahead": 10
+CALENDAR_YEARS_BEHIND = 10
+CALENDAR_YEARS_AHEAD = 5
+INSERT_BATCH_SIZE = 1000
+
+# timespans resolved from the calendar, for the day they're resolved on
+CALENDAR_RANGES_KEY = "insights_calendar_range"
+CALENDAR_RANGE_TTL = 24 * 60 * 60
+
+MONTHS = (
+    "January",
+    "February",
+    "March",
+    "April",
+    "May",
+    "June",
+    "July",
+    "August",
+    "September",
+    "October",
+    "November",
+    "December",
+)
+EPOCH = date(1970, 1, 1)
+
+CALENDAR_COLUMNS = {
+    "date": "date not null primary key",
+    # consecutive numbers of periods, the period n periods back is `key - n`
+    "day_key": "int not null",
+    "week_key": "int not null",
+    "month_key": "int not null",
+    "quarter_key": "int not null",
+    "year_key": "int not null",
+    "fiscal_year_key": "int not null",
+    "week_start": "date not null",
+    "month_start": "date not null",
+    "quarter_start": "date not null",
+    "year_start": "date not null",
+    "fiscal_year_start": "date not null",
+    "day_of_week": "tinyint not null",
+    "day_of_month": "tinyint not null",
+    "day_of_year": "smallint not null",
+    "month_of_year": "tinyint not null",
+    "quarter_of_year": "tinyint not null",
+}
+# keys of the periods timespans are of, eg. `last 2 months`
+PERIOD_KEYS = {
+    "day": "day_key",
+    "week": "week_key",
+    "month": "month_key",
+    "quarter": "quarter_key",
+    "year": "year_key",
+    "fiscal year": "fiscal_year_key",
+}
+# columns holding the bucket of a date format, alike `ColumnFormat.truncate_date`
+FORMAT_COLUMNS = {
+    "Day": "date",
+    "Month": "month_start",
+    "Quarter": "quarter_start",
+    "Year": "year_start",
+    "Day of Week": "day_of_week",
+    "Day of Month": "day_of_month",
+    "Day of Year": "day_of_year",
+    "Month of Year": "month_of_year",
+    "Quarter of Year": "quarter_of_year",
+}
+
+
+def get_calendar_range(timespan):
+    """Returns the first & last day of `timespan` looked up on the calendar.
+
+    Returns None if the calendar isn't built or doesn't hold the whole timespan,
+    the range is then computed by `get_timespan_range`.
+    """
+    periods_back, period = parse_timespan(timespan)
+    if period not in PERIOD_KEYS or not calendar_exists():
+        return
+
+    cache_key = f"{CALENDAR_RANGES_KEY}:{nowdate()}:{periods_back}:{period}"
+    date_range = frappe.cache().get_value(cache_key)
+    if date_range is None:
+        key = PERIOD_KEYS[period]
+        start, end, first_day, last_day = frappe.db.sql(
+            f"""
+                select min(`date`), max(`date`),
+                    (select min(`date`) from `{CALENDAR_TABLE}`),
+                    (select max(`date`) from `{CALENDAR_TABLE}`)
+                from `{CALENDAR_TABLE}`
+                where `{key}` = (
+                    select `{key}` from `{CALENDAR_TABLE}` where `date` = %s
+                ) - %s
+            """,
+            (nowdate(), periods_back),
+        )[0]
+        # periods at the edges of the calendar may be partly out of it
+        date_range = (
+            [start, end] if start and first_day < start <= end < last_day else []
+        )
+        frappe.cache().set_value(
+            cache_key, date_range, expires_in_sec=CALENDAR_RANGE_TTL
+        )
+
+    return date_range or None
+
+
+def parse_timespan(timespan):
+    """Returns periods back & the period, eg. (2, "month") for `last 2 months`"""
+    timespan = timespan.lower().strip()
+    if timespan.startswith("current "):
+        return 0, timespan.split(" ", 1)[1]
+
+    if timespan.startswith("last "):
+        _, interval, period = timespan.split(" ", 2)
+        return cint(interval), period[:-1] if period.endswith("s") else period
+
+    return 0, None
+
+
+def get_calendar_column(date_format):
+    """Returns the calendar column holding buckets of `date_format`, if there's one"""
+    return FORMAT_COLUMNS.get(date_format)
+
+
+def calendar_exists():
+    return bool(frappe.db.sql("show tables like %s", CALENDAR_TABLE))
+
+
+def update_calendar(start=None, end=None):
+    """Adds the days from `start` to `end` missing from the calendar, creating it first.
+
+    Years around today are always kept. Whole years are added, and the year before
+    them for fiscal years, so that every period of the calendar is complete.
+    """
+    first_day, last_day = get_calendar_days(start, end)
+    create_calendar_table(CALENDAR_TABLE)
+    existing_first, existing_last = frappe.db.sql(
+        f"select min(`date`), max(`date`) from `{CALENDAR_TABLE}`"
+    )[0]
+    if not existing_first:
+        insert_days(CALENDAR_TABLE, first_day, last_day)
+        return
+
+    if first_day < existing_first:
+        insert_days(CALENDAR_TABLE, first_day, existing_first - timedelta(days=1))
+    if last_day > existing_last:
+        insert_days(CALENDAR_TABLE, existing_last + timedelta(days=1), last_day)
+
+
+def rebuild_calendar():
+    """Builds the calendar again, eg. once the start of the fiscal year has changed"""
+    start = end = None
+    if calendar_exists():
+        start, end = frappe.db.sql(
+            f"select min(`date`), max(`date`) from `{CALENDAR_TABLE}`"
+        )[0]
+
+    build_table = f"{CALENDAR_TABLE}_build"
+    old_table = f"{CALENDAR_TABLE}_old"
+    frappe.db.sql_ddl(f"drop table if exists `{build_table}`")
+    create_calendar_table(build_table)
+    insert_days(build_table, *get_calendar_days(start, end))
+
+    create_calendar_table(CALENDAR_TABLE)
+    # renamed at once, lookups read either the old or the new calendar
+    frappe.db.sql_ddl(
+        f"rename table `{CALENDAR_TABLE}` to `{old_table}`, "
+        f"`{build_table}` to `{CALENDAR_TABLE}`"
+    )
+    frappe.db.sql_ddl(f"drop table `{old_table}`")
+    frappe.cache().delete_keys(CALENDAR_RANGES_KEY)
+
+
+def get_calendar_days(start=None, end=None):
+    today = getdate(nowdate())
+    years_behind = get_config("calendar_years_behind", CALENDAR_YEARS_BEHIND)
+    years_ahead = get_config("calendar_years_ahead", CALENDAR_YEARS_AHEAD)
+    start = min(
+        getdate(start or today), getdate(add_to_date(today, years=-years_behind))
+    )
+    end = max(getdate(end or today), getdate(add_to_date(today, years=years_ahead)))
+    return date(start.year - 1, 1, 1), date(end.year, 12, 31)
+
+
+def create_calendar_table(table_name):
+    definitions = [
+        f"`{column}` {sql_type}" for column, sql_type in CALENDAR_COLUMNS.items()
+    ]
+    # periods are looked up by their keys
+    indexes = [f"index `{key}` (`{key}`)" for key in PERIOD_KEYS.values()]
+    frappe.db.sql_ddl(
+        f"create table if not exists `{table_name}` "
+        f"({', '.join(definitions + indexes)}) engine=InnoDB"
+    )
+
+
+def insert_days(table_name, first_day, last_day):
+    fiscal_year_start_month = get_fiscal_year_start_month()
+    columns = ", ".join(f"`{column}`" for column in CALENDAR_COLUMNS)
+    placeholders = f"({', '.join(['%s'] * len(CALENDAR_COLUMNS))})"
+
+    day = first_day
+    while day <= last_day:
+        rows = []
+        while day <= last_day and len(rows) < INSERT_BATCH_SIZE:
+            rows.append(get_calendar_row(day, fiscal_year_start_month))
+            day += timedelta(days=1)
+
+        frappe.db.sql(
+            f"insert ignore into `{table_name}` ({columns}) "
+            f"values {', '.join([placeholders] * len(rows))}",
+            [value for row in rows for value in row],
+        )
+
+
+def get_calendar_row(day, fiscal_year_start_month):
+    """Returns the values of `CALENDAR_COLUMNS` for `day`"""
+    week_start = getdate(get_first_day_of_week(day))
+    quarter = (day.month - 1) // 3 + 1
+    fiscal_year_start = get_fiscal_year_start(day, fiscal_year_start_month)
+    return (
+        day,
+        (day - EPOCH).days,
+        (week_start - EPOCH).days // 7,
+        day.year * 12 + day.month - 1,
+        day.year * 4 + quarter - 1,
+        day.year,
+        fiscal_year_start.year,
+        week_start,
+        day.replace(day=1),
+        date(day.year, quarter * 3 - 2, 1),
+        date(day.year, 1, 1),
+        fiscal_year_start,
+        # counted from 1 on sunday, like DAYOFWEEK
+        day.isoweekday() % 7 + 1,
+        day.day,
+        day.timetuple().tm_yday,
+        day.month,
+        quarter,
+    )
+
+
+def get_fiscal_year_start_month():
+    fiscal_year_start = frappe.get_cached_doc("Insights Settings").fiscal_year_start
+    return MONTHS.index(fiscal_year_start) + 1 if fiscal_year_start in MONTHS else 1
+
+
+def get_fiscal_year_start(day, fiscal_year_start_month):
+    year = day.year if day.month >= fiscal_year_start_month else day.year - 1
+    return date(year, fiscal_year_start_month, 1)
+
+
+def get_fiscal_year_range(day):
+    """Returns the first & last day of the fiscal year `day` is in"""
+    start = get_fiscal_year_start(getdate(day), get_fiscal_year_start_month())
+    return start, getdate(add_to_date(start, years=1, days=-1))
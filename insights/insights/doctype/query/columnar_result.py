@@ -0,0 +1,159 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import re
+import struct
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from json import dumps
+
+from frappe.utils import cstr
+
+# results encoded column by column, decoded by the frontend with a DataView
+# little endian throughout, a header of `MAGIC`, the row count (uint32) & the column
+# count (uint16) is followed by each column: its encoding (uint8), a bitmap of its
+# non null values for typed encodings, then its values
+MAGIC = b"IQR1"
+
+# encodings of a column, by the values it holds
+NULL = 0
+INT32 = 1  # int32 each
+FLOAT64 = 2  # float64 each, integers up to 2^53 too
+DATE = 3  # int32 days since epoch each
+DATETIME = 4  # float64 microseconds since epoch each
+DICTIONARY = 5  # distinct strings, then an uint32 index each
+STRING = 6  # uint32 byte length & utf-8 bytes each
+JSON = 7  # uint32 byte length & a JSON array of the values, for anything else
+
+TYPED_ENCODINGS = (INT32, FLOAT64, DATE, DATETIME, STRING)
+INT32_RANGE = (-(2**31), 2**31 - 1)
+MAX_SAFE_INTEGER = 2**53
+# repeated strings are sent once, if at most this share of values is distinct
+MAX_DICTIONARY_RATIO = 0.5
+NULL_INDEX = 2**32 - 1
+
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+DATETIME_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}(\.\d{6})?$")
+EPOCH = datetime(1970, 1, 1)
+
+
+def encode_columnar(rows, compress=True):
+    """Returns `rows` encoded column by column, zlib compressed if `compress` is set"""
+    rows = list(rows)
+    column_count = max((len(row) for row in rows), default=0)
+    parts = [MAGIC, struct.pack("<IH", len(rows), column_count)]
+    for idx in range(column_count):
+        values = [row[idx] if idx < len(row) else None for row in rows]
+        parts.append(encode_column(values))
+
+    data = b"".join(parts)
+    return zlib.compress(data) if compress else data
+
+
+def encode_column(values):
+    encoding = get_column_encoding(values)
+    parts = [struct.pack("<B", encoding)]
+    if encoding in TYPED_ENCODINGS:
+        parts.append(get_validity_bitmap(values))
+
+    if encoding == INT32:
+        parts.append(pack_values("i", [value or 0 for value in values]))
+    elif encoding == FLOAT64:
+        parts.append(pack_values("d", [float(value or 0) for value in values]))
+    elif encoding == DATE:
+        parts.append(pack_values("i", [get_epoch_days(value) for value in values]))
+    elif encoding == DATETIME:
+        parts.append(pack_values("d", [get_epoch_micros(value) for value in values]))
+    elif encoding == DICTIONARY:
+        distinct = list(dict.fromkeys(value for value in values if value is not None))
+        indexes = {value: idx for idx, value in enumerate(distinct)}
+        parts.append(struct.pack("<I", len(distinct)))
+        parts += [pack_string(value) for value in distinct]
+        parts.append(
+            pack_values(
+                "I",
+                [NULL_INDEX if value is None else indexes[value] for value in values],
+            )
+        )
+    elif encoding == STRING:
+        parts += [pack_string(value or "") for value in values]
+    elif encoding == JSON:
+        parts.append(pack_string(dumps(values, default=cstr)))
+
+    return b"".join(parts)
+
+
+def get_column_encoding(values):
+    """Returns the most compact encoding that holds every value of the column as is"""
+    present = [value for value in values if value is not None]
+    if not present:
+        return NULL
+
+    if all(type(value) is int for value in present):
+        if all(INT32_RANGE[0] <= value <= INT32_RANGE[1] for value in present):
+            return INT32
+        if all(abs(value) <= MAX_SAFE_INTEGER for value in present):
+            return FLOAT64
+        return JSON
+
+    if all(type(value) in (int, float, Decimal) for value in present):
+        if all(
+            abs(value) <= MAX_SAFE_INTEGER for value in present if type(value) is int
+        ):
+            return FLOAT64
+        return JSON
+
+    if all(isinstance(value, str) for value in present):
+        if all(is_date(value, DATE_PATTERN, date) for value in present):
+            return DATE
+        if all(is_date(value, DATETIME_PATTERN, datetime) for value in present):
+            return DATETIME
+        if len(set(present)) <= len(values) * MAX_DICTIONARY_RATIO:
+            return DICTIONARY
+        return STRING
+
+    return JSON
+
+
+def is_date(value, pattern, date_type):
+    if not pattern.match(value):
+        return False
+    try:
+        # zero dates of the database look alike but aren't dates
+        date_type.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+def get_validity_bitmap(values):
+    bitmap = bytearray((len(values) + 7) // 8)
+    for idx, value in enumerate(values):
+        if value is not None:
+            bitmap[idx // 8] |= 1 << (idx % 8)
+    return bytes(bitmap)
+
+
+def pack_values(format, values):
+    return struct.pack(f"<{len(values)}{format}", *values)
+
+
+def pack_string(value):
+    data = value.encode()
+    return struct.pack("<I", len(data)) + data
+
+
+def get_epoch_days(value):
+    if value is None:
+        return 0
+    return (date.fromisoformat(value) - EPOCH.date()).days
+
+
+def get_epoch_micros(value):
+    if value is None:
+        return 0
+    delta = datetime.fromisoformat(value) - EPOCH
+    return float(
+        (delta.days * 24 * 60 * 60 + delta.seconds) * 1000000 + delta.microseconds
+    )
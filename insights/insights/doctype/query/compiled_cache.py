@@ -0,0 +1,98 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+from hashlib import sha256
+from json import dumps, loads
+
+import frappe
+from frappe import _dict
+from frappe.utils import cstr
+
+from insights.utils import get_config
+
+# defaults can be overridden from site config, eg. "insights_compiled_query_ttl": 3600
+COMPILED_QUERY_TTL = 24 * 60 * 60
+
+CACHE_KEY_PREFIX = "insights_compiled_query"
+# fields of a column that the compiled query depends on
+COLUMN_FIELDS = (
+    "table",
+    "column",
+    "label",
+    "type",
+    "aggregation",
+    "format_option",
+    "order_by",
+    "is_expression",
+    "expression",
+)
+
+
+def get_fingerprint(query):
+    """Returns a hash of the query's definition, alike for definitions that compile alike.
+
+    JSON fields are parsed & dumped with sorted keys, so that formatting & key order
+    don't change the hash. The order of tables & columns does, it's that of the SQL.
+    """
+    definition = {
+        "data_source": query.data_source,
+        "tables": [
+            {"table": row.table, "join": parse_json(row.join)} for row in query.tables
+        ],
+        "columns": [
+            {field: parse_json(row.get(field)) for field in COLUMN_FIELDS}
+            for row in query.columns
+        ],
+        "filters": parse_json(query.filters),
+        "limit": query.limit,
+        # queries with incremental refresh aren't answered from rollups
+        "incremental_refresh": query.incremental_refresh,
+        "fulltext_search": query.fulltext_search,
+    }
+    return sha256(dumps(definition, sort_keys=True, default=cstr).encode()).hexdigest()
+
+
+def parse_json(value):
+    if isinstance(value, str) and value.lstrip().startswith(("{", "[")):
+        return loads(value)
+    return value
+
+
+def get_cache_key(data_source, fingerprint):
+    return f"{CACHE_KEY_PREFIX}|{data_source}|{fingerprint}"
+
+
+def get_compiled_query(query, fingerprint):
+    compiled = frappe.cache().get_value(get_cache_key(query.data_source, fingerprint))
+    return _dict(compiled) if compiled else None
+
+
+def cache_compiled_query(query, fingerprint, compiled):
+    frappe.cache().set_value(
+        get_cache_key(query.data_source, fingerprint),
+        compiled,
+        expires_in_sec=get_config("compiled_query_ttl", COMPILED_QUERY_TTL),
+    )
+
+
+def invalidate_compiled_queries(data_source, queries):
+    """Drops compiled `queries` of `data_source`, they're built again on their next run"""
+    if not queries:
+        return
+
+    fingerprints = frappe.get_all(
+        "Query",
+        filters={"name": ("in", list(queries)), "fingerprint": ("is", "set")},
+        pluck="fingerprint",
+    )
+    # queries of the same definition share the compiled query, it's dropped for all
+    for fingerprint in set(fingerprints):
+        frappe.cache().delete_value(get_cache_key(data_source, fingerprint))
+
+    frappe.db.set_value(
+        "Query",
+        {"name": ("in", list(queries))},
+        "fingerprint",
+        None,
+        update_modified=False,
+    )
@@ -0,0 +1,67 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.utils import cint
+
+from insights.utils import get_config
+
+# defaults can be overridden from site config, eg. "insights_full_scan_rows": 1000000
+FULL_SCAN_ROWS = 100000
+JOIN_ROWS = 10000000
+# plans are read when the query is saved, they shouldn't hold it up
+EXPLAIN_TIMEOUT = 5
+
+
+def explain(query):
+    """Returns the steps of the query's plan, None if it can't be explained"""
+    sql = f"EXPLAIN {query.sql}"
+    values = query.get_sql_values() or None
+    try:
+        if query.rollup:
+            plan = frappe.db.sql(sql, values, as_dict=1)
+        else:
+            data_source = frappe.get_cached_doc("Data Source", query.data_source)
+            plan = data_source.execute_query(
+                sql, values=values, timeout=EXPLAIN_TIMEOUT, as_dict=1
+            )
+    except Exception:
+        # plans are only advisory, the query can still be run
+        frappe.log_error(title="Insights Query Plan")
+        return
+
+    return [{key.lower(): value for key, value in step.items()} for step in plan]
+
+
+def get_plan_warnings(plan):
+    """Returns warnings of full table scans, filesorts, temporary tables & large joins"""
+    full_scan_rows = get_config("full_scan_rows", FULL_SCAN_ROWS)
+    join_rows = get_config("join_rows", JOIN_ROWS)
+
+    warnings = []
+    # steps with the same id are joined, their row estimates multiply
+    selects = {}
+    for step in plan:
+        table = step.get("table")
+        rows = cint(step.get("rows"))
+        extra = step.get("extra") or ""
+
+        if step.get("type") == "ALL" and rows >= full_scan_rows:
+            warnings.append(
+                f"Reads all of ~{rows:,} rows in {table}, filter on an indexed column"
+            )
+        if "Using filesort" in extra:
+            warnings.append(f"Sorts rows of {table} without an index")
+        if "Using temporary" in extra:
+            warnings.append(f"Groups or sorts rows of {table} in a temporary table")
+        if "Using join buffer" in extra:
+            warnings.append(f"Joins {table} without an index on the join key")
+
+        tables, estimate = selects.get(step.get("id"), (0, 1))
+        selects[step.get("id")] = (tables + 1, estimate * max(rows, 1))
+
+    for tables, estimate in selects.values():
+        if tables > 1 and estimate >= join_rows:
+            warnings.append(f"Joins ~{estimate:,} combinations of rows")
+
+    return warnings
@@ -0,0 +1,87 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import re
+
+import frappe
+
+from insights.utils import get_config
+
+# shorter words aren't indexed, as per innodb_ft_min_token_size of the data source
+# defaults can be overridden from site config, eg. "insights_fulltext_min_word_length": 4
+FULLTEXT_MIN_WORD_LENGTH = 3
+# innodb's default stopwords, they aren't indexed either
+FULLTEXT_STOPWORDS = frozenset(
+    {
+        "a",
+        "about",
+        "an",
+        "are",
+        "as",
+        "at",
+        "be",
+        "by",
+        "com",
+        "de",
+        "en",
+        "for",
+        "from",
+        "how",
+        "i",
+        "in",
+        "is",
+        "it",
+        "la",
+        "of",
+        "on",
+        "or",
+        "that",
+        "the",
+        "this",
+        "to",
+        "was",
+        "what",
+        "when",
+        "where",
+        "who",
+        "will",
+        "with",
+        "und",
+        "www",
+    }
+)
+WORD_PATTERN = re.compile(r"^\w+$")
+# mariadb error code for a MATCH on columns without a FULLTEXT index
+ER_FT_MATCHING_KEY_NOT_FOUND = 1191
+
+
+def get_contains_strategy(query, table, column, text, operator="contains"):
+    """Returns how a (not) contains filter is matched, `fulltext` or `like`, and why.
+
+    Full-text search is opted into per query. Words are matched from their start on
+    the index, so rows that contain the text only within a word aren't found.
+    """
+    if not query.fulltext_search:
+        return "like", "Full-text search is off for the query"
+
+    if operator == "not contains":
+        return "like", "Rows without the text can't be looked up on a FULLTEXT index"
+
+    if query._rollup:
+        return "like", "Summary tables of rollups have no FULLTEXT indexes"
+
+    words = text.split()
+    if not words or not all(WORD_PATTERN.match(word) for word in words):
+        return "like", "Only words can be searched for on a FULLTEXT index"
+
+    min_length = get_config("fulltext_min_word_length", FULLTEXT_MIN_WORD_LENGTH)
+    if any(
+        len(word) < min_length or word.lower() in FULLTEXT_STOPWORDS for word in words
+    ):
+        return "like", f"Stopwords & words under {min_length} characters aren't indexed"
+
+    data_source = frappe.get_cached_doc("Data Source", query.data_source)
+    if (column,) not in data_source.get_fulltext_indexes(table):
+        return "like", "The column has no FULLTEXT index of its own"
+
+    return "fulltext", "Looked up on the FULLTEXT index, LIKE keeps matches exact"
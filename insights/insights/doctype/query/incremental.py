@@ -0,0 +1,230 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import time
+from json import dumps, loads
+
+import frappe
+from frappe import _dict
+from frappe.query_builder.functions import Max
+from frappe.utils import cstr, flt, get_datetime, now_datetime, time_diff_in_seconds
+
+from insights.insights.doctype.query.result_store import (
+    decode_chunk,
+    delete_result,
+    encode_chunk,
+    get_result,
+    store_result,
+)
+from insights.insights.doctype.query.utils import bind_parameters, resolve_parameters
+from insights.utils import get_config
+
+# aggregations whose value over a group can be computed from values over parts of it
+INCREMENTAL_AGGREGATIONS = ("sum", "count", "min", "max")
+
+# defaults can be overridden from site config, eg. "insights_full_refresh_interval": 3600
+FULL_REFRESH_INTERVAL = 24 * 60 * 60
+MAX_STATE_ROWS = 100000
+
+
+def get_incremental_plan(query):
+    """Returns how the rows of `query` are aggregated, None if it can't be refreshed incrementally.
+
+    Queries on a single table with a `modified` & `creation` column qualify if every
+    column is either grouped by or aggregated with a decomposable aggregation.
+    """
+    if len(query.tables) != 1 or query.tables[0].join:
+        return
+
+    plan = _dict(table=query.tables[0].table, group_by=[], aggregations=[], order_by=[])
+    result_formats = loads(query.result_formats or "{}")
+    for idx, row in enumerate(query.columns):
+        aggregation = (row.aggregation or "").lower()
+        if row.is_expression:
+            return
+        if aggregation == "group by":
+            plan.group_by.append(idx)
+        elif aggregation in INCREMENTAL_AGGREGATIONS:
+            plan.aggregations.append((idx, aggregation))
+        else:
+            return
+
+        if row.order_by:
+            # formatted dates are sorted as their buckets, unless they're formatted
+            # on the database by a query built before dates were bucketed
+            if (
+                row.type in ("Date", "Datetime")
+                and row.format_option
+                and str(idx) not in result_formats
+            ):
+                return
+            plan.order_by.append((idx, row.order_by))
+
+    if not plan.aggregations:
+        return
+
+    data_source = frappe.get_cached_doc("Data Source", query.data_source)
+    columns = data_source.get_columns({"table": plan.table}) or []
+    if not {"modified", "creation"} <= {d.get("column") for d in columns}:
+        return
+
+    return plan
+
+
+def execute_incrementally(query):
+    """Sets the result of `query` from per group aggregates, returns False if it doesn't qualify.
+
+    Aggregates of every group are kept in the result store. Runs after the first read
+    only rows modified since the previous run and merge them into the kept aggregates.
+    Rows that existed before the previous run and were modified since, filter values
+    that changed since, eg. timespans that moved on to another day, and the periodic
+    full refresh that catches deleted rows, cause a full recompute.
+    """
+    plan = get_incremental_plan(query)
+    if not plan:
+        return False
+
+    query.process()
+    data_source = frappe.get_cached_doc("Data Source", query.data_source)
+    Table = frappe.qb.Table(plan.table)
+    # resolved once, so that every statement of the run filters on the same values
+    values = resolve_parameters(query._params)
+    aggregate_values = dumps(values, default=cstr)
+
+    start = time.time()
+    # read before the aggregates, rows modified in between are picked up next time
+    watermark = execute(
+        query, data_source, frappe.qb.from_(Table).select(Max(Table.modified)), values
+    )[0][0]
+
+    if can_merge(query, data_source, Table, aggregate_values):
+        state = get_result(query.aggregate_state_key)
+        changes = execute(
+            query,
+            data_source,
+            query.build_aggregate_query(query.aggregate_watermark, watermark),
+            values,
+        )
+        state = merge(state, normalize(changes), plan)
+    else:
+        state = normalize(
+            execute(
+                query,
+                data_source,
+                query.build_aggregate_query(None, watermark),
+                values,
+            )
+        )
+        query.last_full_refresh = now_datetime()
+
+    query._result = sort_and_limit(state, plan.order_by, query._limit)
+    query.execution_time = flt(time.time() - start, 3)
+    query.last_execution = frappe.utils.now()
+    query.from_cache = 0
+    query.cache_lookup_time = 0
+
+    delete_result(query.aggregate_state_key)
+    query.aggregate_state_key = None
+    query.aggregate_watermark = None
+    query.aggregate_values = None
+    if watermark and len(state) <= get_config("max_state_rows", MAX_STATE_ROWS):
+        query.aggregate_state_key = store_result(query.name, state).result_key
+        query.aggregate_watermark = watermark
+        query.aggregate_values = aggregate_values
+
+    return True
+
+
+def can_merge(query, data_source, Table, aggregate_values):
+    if not query.aggregate_state_key or not query.aggregate_watermark:
+        return False
+
+    # kept aggregates are of rows filtered on other values, eg. of yesterday's timespan
+    if query.aggregate_values != aggregate_values:
+        return False
+
+    full_refresh_interval = get_config("full_refresh_interval", FULL_REFRESH_INTERVAL)
+    if (
+        not query.last_full_refresh
+        or time_diff_in_seconds(now_datetime(), query.last_full_refresh)
+        > full_refresh_interval
+    ):
+        return False
+
+    # updated rows were counted with their old values, their old values can't be taken out
+    watermark = get_datetime(query.aggregate_watermark)
+    updated = execute(
+        query,
+        data_source,
+        frappe.qb.from_(Table)
+        .select(Table.name)
+        .where((Table.modified > watermark) & (Table.creation <= watermark))
+        .limit(1),
+        [],
+    )
+    return not updated
+
+
+def execute(query, data_source, sql, values):
+    sql, values = bind_parameters(str(sql), values)
+    return data_source.execute_query(
+        sql,
+        values=values or None,
+        timeout=query.max_execution_time,
+        run_id=query.name,
+    )
+
+
+def normalize(rows):
+    # aggregates are kept as they're stored, so that fresh and kept rows compare alike
+    return decode_chunk(encode_chunk(list(rows)))
+
+
+def merge(state, changes, plan):
+    groups = {tuple(row[i] for i in plan.group_by): row for row in state}
+    for row in changes:
+        key = tuple(row[i] for i in plan.group_by)
+        if key not in groups:
+            groups[key] = row
+            continue
+
+        merged = groups[key]
+        for idx, aggregation in plan.aggregations:
+            merged[idx] = combine(aggregation, merged[idx], row[idx])
+
+    return list(groups.values())
+
+
+def combine(aggregation, value, other):
+    if value is None or other is None:
+        return other if value is None else value
+
+    if aggregation in ("sum", "count"):
+        return flt(value) + flt(other)
+
+    pick = min if aggregation == "min" else max
+    return pick(value, other, key=sort_key)
+
+
+def sort_and_limit(rows, order_by, limit):
+    rows = list(rows)
+    # sorted by the last column first, python's sort is stable
+    for idx, order in reversed(order_by):
+        # nulls come first in ascending order, like on the database
+        rows.sort(
+            key=lambda row: (row[idx] is not None, sort_key(row[idx])),
+            reverse=order.lower() == "desc",
+        )
+    return rows[:limit]
+
+
+def sort_key(value):
+    # numbers may be stored as strings, eg. decimals
+    if isinstance(value, str):
+        try:
+            return (0, float(value), "")
+        except ValueError:
+            return (1, 0, value)
+    if value is None:
+        return (0, 0, "")
+    return (0, value, "")
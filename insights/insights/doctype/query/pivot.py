@@ -0,0 +1,198 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import numpy as np
+
+import frappe
+
+AGGREGATIONS = ("sum", "min", "max", "avg", "count")
+# aggregates of these can be aggregated again, counts add up as sums
+COMBINED_AGGREGATIONS = ("sum", "min", "max")
+
+# pivots with fewer filled cells than this are returned as a list of cells
+SPARSE_FILL_RATIO = 0.25
+
+
+def pivot(rows, columns, index_columns, pivot_column, value_columns, aggregated=False):
+    """Pivots `rows` on `pivot_column`, aggregating each of `value_columns` per cell.
+
+    `columns` are the labels of the values in each row and `value_columns` are dicts
+    with a label & an aggregation. Several rows that are `aggregated` already only
+    make up a cell if they're aggregated again the same way, averages can't be.
+    Returns the structure built by `make_pivot_result`.
+    """
+    positions = {label: i for i, label in enumerate(columns)}
+    data = list(zip(*rows)) if rows else [()] * len(columns)
+
+    if index_columns:
+        index_keys = list(zip(*(data[positions[label]] for label in index_columns)))
+    else:
+        index_keys = [()] * len(rows)
+    index, row_ids = factorize(index_keys)
+    pivot_values, column_ids = factorize(data[positions[pivot_column]])
+
+    filled, cell_ids, cell_sizes = np.unique(
+        row_ids * len(pivot_values) + column_ids,
+        return_inverse=True,
+        return_counts=True,
+    )
+    if aggregated and (cell_sizes > 1).any():
+        for d in value_columns:
+            if d["aggregation"] not in COMBINED_AGGREGATIONS:
+                frappe.throw(
+                    f"Column {d['label']} is aggregated with {d['aggregation']}, "
+                    "add the other columns it's grouped by to the pivot index"
+                )
+    values = [
+        aggregate(
+            to_float_array(data[positions[d["label"]]], d["label"]),
+            cell_ids,
+            len(filled),
+            d["aggregation"],
+        )
+        for d in value_columns
+    ]
+
+    return make_pivot_result(
+        index_columns,
+        pivot_column,
+        value_columns,
+        [list(key) for key in index],
+        pivot_values,
+        filled,
+        values,
+    )
+
+
+def from_pivoted_rows(rows, index_columns, pivot_column, pivot_values, value_columns):
+    """Builds the pivot structure from rows the database already pivoted.
+
+    Each row holds the index values followed by a value per pivot value & value column,
+    in that order.
+    """
+    index = [list(row[: len(index_columns)]) for row in rows]
+    # values of a row are ordered by pivot value, then by value column
+    flat = [value for row in rows for value in row[len(index_columns) :]]
+    cells = np.column_stack(
+        [
+            to_float_array(flat[i :: len(value_columns)], d["label"])
+            for i, d in enumerate(value_columns)
+        ]
+    ).reshape(len(rows), len(pivot_values), len(value_columns))
+
+    filled = np.flatnonzero(~np.isnan(cells).all(axis=2))
+    cells = cells.reshape(-1, len(value_columns))[filled]
+    values = [cells[:, i] for i in range(len(value_columns))]
+
+    return make_pivot_result(
+        index_columns,
+        pivot_column,
+        value_columns,
+        index,
+        pivot_values,
+        filled,
+        values,
+    )
+
+
+def make_pivot_result(
+    index_columns, pivot_column, value_columns, index, pivot_values, filled, values
+):
+    """Returns the pivot as a columnar structure.
+
+    Cells are numbered row by row, `filled` are the numbers of cells with a value and
+    `values` hold the aggregated values of those cells, per value column. Dense pivots
+    have a `rows x pivot values` matrix per value column, sparse ones list the
+    row & column of each filled cell instead. Empty cells are None.
+    """
+    result = {
+        "index_columns": index_columns,
+        "pivot_column": pivot_column,
+        "value_columns": value_columns,
+        "index": index,
+        "pivot_values": list(pivot_values),
+    }
+
+    total_cells = len(index) * len(pivot_values)
+    if total_cells and len(filled) / total_cells < SPARSE_FILL_RATIO:
+        result["layout"] = "sparse"
+        result["cells"] = {
+            "row": (filled // len(pivot_values)).tolist(),
+            "column": (filled % len(pivot_values)).tolist(),
+        }
+        result["values"] = [to_list(v) for v in values]
+        return result
+
+    result["layout"] = "dense"
+    result["values"] = []
+    for cell_values in values:
+        matrix = np.full(total_cells, np.nan)
+        matrix[filled] = cell_values
+        matrix = matrix.reshape(len(index), len(pivot_values))
+        result["values"].append(to_list(matrix))
+    return result
+
+
+def factorize(keys):
+    """Returns the sorted distinct keys and the position of each key among them"""
+    codes = {}
+    ids = np.fromiter(
+        (codes.setdefault(key, len(codes)) for key in keys),
+        dtype=np.int64,
+        count=len(keys),
+    )
+    uniques = list(codes)
+    order = sorted(range(len(uniques)), key=lambda i: sort_key(uniques[i]))
+    positions = np.empty(len(order), dtype=np.int64)
+    positions[order] = np.arange(len(order))
+    return [uniques[i] for i in order], positions[ids]
+
+
+def sort_key(value):
+    if isinstance(value, tuple):
+        return tuple(sort_key(v) for v in value)
+    # nulls sort last
+    return (value is None, value if value is not None else 0)
+
+
+def to_float_array(values, label):
+    try:
+        return np.array([np.nan if v is None else v for v in values], dtype=float)
+    except (TypeError, ValueError):
+        frappe.throw(f"Column {label} must be numeric to be used as a pivot value")
+
+
+def aggregate(values, cell_ids, cell_count, aggregation):
+    if aggregation not in AGGREGATIONS:
+        frappe.throw(f"Invalid aggregation function: {aggregation}")
+
+    present = ~np.isnan(values)
+    counts = np.bincount(cell_ids, weights=present, minlength=cell_count)
+    if aggregation == "count":
+        return counts
+
+    sums = np.bincount(
+        cell_ids, weights=np.where(present, values, 0), minlength=cell_count
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        if aggregation == "sum":
+            result = sums
+        elif aggregation == "avg":
+            result = sums / counts
+        else:
+            ufunc, fill = (np.minimum, np.inf)
+            if aggregation == "max":
+                ufunc, fill = (np.maximum, -np.inf)
+            result = np.full(cell_count, fill)
+            ufunc.at(result, cell_ids, np.where(present, values, fill))
+
+    # cells without a single value stay empty
+    result[counts == 0] = np.nan
+    return result
+
+
+def to_list(array):
+    # NaN isn't valid JSON
+    array = np.asarray(array, dtype=object)
+    array[array != array] = None
+    return array.tolist()
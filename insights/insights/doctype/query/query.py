@@ -2,12 +2,13 @@
 # For license information, please see license.txt
 
 import time
+from contextlib import contextmanager
 from json import dumps, loads
 
 import frappe
 from frappe import _dict
-from frappe.query_builder import Criterion, Table
-from frappe.utils import cstr, flt
+from frappe.query_builder import Case, Criterion, Table
+from frappe.utils import cint, cstr, flt
 from sqlparse import format as format_sql
 
 from pypika import Order
@@ -16,16 +17,67 @@ from pypika.enums import JoinType
 from insights.insights.doctype.query.utils import (
     parse_query_expression,
     make_query_field,
-    get_date_range,
+    make_parameter,
+    bind_parameters,
+    resolve_parameters,
+    get_fulltext_search,
+    get_timespan_range,
     Aggregations,
     ColumnFormat,
+    FulltextMatch,
     Operations,
 )
 
+from insights.insights.doctype.data_source.data_source import (
+    QueryCancelled,
+    get_row_size,
+)
+from insights.insights.doctype.query.calendar_table import (
+    CALENDAR_TABLE,
+    calendar_exists,
+    get_calendar_column,
+)
+from insights.insights.doctype.query.compiled_cache import (
+    cache_compiled_query,
+    get_compiled_query,
+    get_fingerprint,
+)
+from insights.insights.doctype.query.explain import explain, get_plan_warnings
+from insights.insights.doctype.query.fulltext import get_contains_strategy
+from insights.insights.doctype.query.incremental import execute_incrementally
 from insights.insights.doctype.query.query_client import QueryClient
+from insights.insights.doctype.query.result_cache import (
+    get_cached_result,
+    get_max_entry_size,
+    cache_result,
+    invalidate,
+)
+from insights.insights.doctype.query.result_store import (
+    store_result,
+    delete_result,
+    delete_query_results,
+)
+from insights.insights.doctype.table_rollup.table_rollup import (
+    find_rollup,
+    get_query_shape,
+)
+from insights.utils import get_config
+
+# queries that took longer than this (in seconds) on their last run are run in background,
+# can be overridden from site config with "insights_background_query_threshold"
+BACKGROUND_QUERY_THRESHOLD = 5
+# pivots on columns with more distinct values are done on the stored result instead,
+# can be overridden from site config with "insights_max_pivot_values"
+MAX_PIVOT_VALUES = 50
+PIVOT_AGGREGATIONS = ("sum", "min", "max", "avg", "count")
+# aggregations whose value is a date bucket, formatted for display once it's fetched
+BUCKET_AGGREGATIONS = ("", "group by", "min", "max", "distinct")
 
 
 class Query(QueryClient):
+    # rollup whose summary table the query is built on
+    _rollup = None
+
     def validate(self):
         # TODO: validate if a column is an expression and aggregation is "group by"
         pass
@@ -46,6 +98,7 @@ class Query(QueryClient):
         visualizations = self.get_visualizations()
         for visualization in visualizations:
             frappe.delete_doc("Query Visualization", visualization)
+        delete_query_results(self.name)
 
     def before_save(self):
         if self.get("skip_before_save"):
@@ -55,11 +108,88 @@ class Query(QueryClient):
         if not self.columns or not self.filters:
             return
 
+        # pivots read the values to pivot on from the data source, they're always built
+        fingerprint = None if self.transform_type else get_fingerprint(self)
+        if fingerprint and fingerprint == self.fingerprint and not self.flags.rebuild:
+            # the definition is unchanged, so is the compiled query
+            return
+
+        self._timings = {}
+        compiled = (
+            fingerprint
+            and not self.flags.rebuild
+            and get_compiled_query(self, fingerprint)
+        )
+        if compiled:
+            # compiled before from an identical definition, maybe of another query
+            with self.timed("compiled_cache"):
+                self.apply_compiled_query(compiled)
+        else:
+            with self.timed("process"):
+                self.process()
+            with self.timed("build"):
+                self.build()
+            with self.timed("rollup"):
+                self.apply_rollup()
+            self.update_query()
+            if fingerprint:
+                cache_compiled_query(
+                    self,
+                    fingerprint,
+                    {
+                        "sql": self.sql,
+                        "sql_params": self.sql_params,
+                        "result_formats": self.result_formats,
+                        "filter_strategies": self.filter_strategies,
+                        "rollup": self.rollup,
+                        "query_plan": self.query_plan,
+                        "plan_warnings": self.plan_warnings,
+                    },
+                )
+
+        self.fingerprint = fingerprint
+        # logged with every run, until the query is built again
+        self.build_timings = dumps(self._timings, indent=2)
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._timings[stage] = flt(time.time() - start, 3)
+
+    def apply_compiled_query(self, compiled):
+        self.rollup = compiled.rollup
+        self.result_formats = compiled.result_formats
+        self.filter_strategies = compiled.filter_strategies
+        self.transform_sql = None
+        self.transform_sql_params = None
+        self.update_sql(
+            compiled.sql,
+            compiled.sql_params,
+            plan=(compiled.query_plan, compiled.plan_warnings),
+        )
+
+    def apply_rollup(self):
+        """Builds the query on a rollup's summary table if one can answer it.
+
+        Rollups are created daily for shapes shared by enough saved queries.
+        """
+        self._rollup = None
+        shape = get_query_shape(self)
+        rollup = shape and find_rollup(shape)
+        self.rollup = rollup and rollup.name
+        if not rollup:
+            return
+
+        self._rollup = rollup
         self.process()
         self.build()
-        self.update_query()
 
     def process(self):
+        # literal values of filters, bound to the SQL when it's run
+        self._params = []
         self.process_tables()
         self.process_joins()
         self.process_columns()
@@ -67,6 +197,26 @@ class Query(QueryClient):
         self.process_limit()
 
     def build(self):
+        query = self.build_from()
+
+        for column in self._columns:
+            query = query.select(column)
+
+        if self._group_by_columns:
+            query = query.groupby(*self._group_by_columns)
+
+        if self._order_by_columns:
+            for column, order in self._order_by_columns:
+                query = query.orderby(column, order=Order[order])
+
+        query = query.limit(self._limit)
+
+        self._query = query
+        self._transform_query = None
+        if self.transform_type == "Pivot" and self.transform_data:
+            self._transform_query = self.build_pivot(_dict(loads(self.transform_data)))
+
+    def build_from(self):
         query = frappe.qb
 
         for table in self._tables:
@@ -76,49 +226,360 @@ class Query(QueryClient):
                 for join in joins:
                     query = query.join(join.right, join.type).on(join.condition)
 
+        return query.where(*self._filters)
+
+    def build_pivot(self, transform_data):
+        """Compiles the pivot into conditional aggregation.
+
+        Distinct values of the pivot column are read first, every value column is
+        then aggregated once per pivot value with `agg(case when pivot = value ...)`,
+        grouped by the index columns. The database returns the pivoted result.
+
+        Value columns & pivot values are recorded in `transform_data`. Returns None
+        if the pivot can't be compiled, it is then done on the stored result.
+        """
+        pivot_label = (transform_data.pivot_columns or [None])[0]
+        index_labels = transform_data.index_columns or []
+        if pivot_label not in [row.label for row in self.columns]:
+            frappe.throw(f"Invalid pivot column: {pivot_label}")
+
+        value_rows = [
+            row
+            for row in self.columns
+            if row.label != pivot_label and row.label not in index_labels
+        ]
+        # columns that aren't aggregated hold a single value per group
+        transform_data.value_columns = [
+            {"label": row.label, "aggregation": (row.aggregation or "max").lower()}
+            for row in value_rows
+        ]
+        transform_data.pivot_values = None
+        self.transform_data = dumps(transform_data, indent=2, default=cstr)
+
+        # expressions can't be split by pivot value, only columns can
+        if any(
+            label not in self._unaggregated_columns
+            for label in [pivot_label] + index_labels
+        ) or any(
+            row.is_expression or d["aggregation"] not in PIVOT_AGGREGATIONS
+            for row, d in zip(value_rows, transform_data.value_columns)
+        ):
+            return
+
+        pivot_column = self._unaggregated_columns[pivot_label]
+        pivot_values = self.get_pivot_values(pivot_column)
+        if pivot_values is None:
+            return
+
+        query = self.build_from()
+        index_columns = [self._unaggregated_columns[label] for label in index_labels]
+        for label, column in zip(index_labels, index_columns):
+            query = query.select(column.as_(label))
+
+        for value in pivot_values:
+            condition = (
+                pivot_column.isnull() if value is None else pivot_column == value
+            )
+            value_label = "Not Set" if value is None else cstr(value)
+            for d in transform_data.value_columns:
+                column = Case().when(condition, self._unaggregated_columns[d["label"]])
+                column = Aggregations.apply(d["aggregation"], column)
+                query = query.select(column.as_(f"{d['label']} - {value_label}"))
+
+        if index_columns:
+            query = query.groupby(*index_columns).orderby(*index_columns)
+
+        transform_data.pivot_values = pivot_values
+        self.transform_data = dumps(transform_data, indent=2, default=cstr)
+        return query.limit(self._limit)
+
+    def build_aggregate_query(self, modified_after=None, modified_before=None):
+        """Returns the query for aggregates of every group, without sorting or limit.
+
+        Only rows created & modified within the given bounds are aggregated.
+        """
+        query = self.build_from()
         for column in self._columns:
             query = query.select(column)
-
         if self._group_by_columns:
             query = query.groupby(*self._group_by_columns)
 
-        if self._order_by_columns:
-            for column, order in self._order_by_columns:
-                query = query.orderby(column, order=Order[order])
+        table = self._tables[0]
+        if modified_after:
+            query = query.where(
+                (table.modified > modified_after) & (table.creation > modified_after)
+            )
+        if modified_before:
+            query = query.where(table.modified <= modified_before)
+
+        return query
+
+    def get_pivot_values(self, pivot_column):
+        """Returns distinct values of the pivot column, None if there are too many"""
+        max_pivot_values = get_config("max_pivot_values", MAX_PIVOT_VALUES)
+        query = (
+            self.build_from()
+            .select(pivot_column)
+            .distinct()
+            .orderby(pivot_column)
+            .limit(max_pivot_values + 1)
+        )
 
-        query = query.where(*self._filters)
+        sql, values = bind_parameters(str(query), self._params)
+        data_source = frappe.get_cached_doc("Data Source", self.data_source)
+        values = [
+            d[0]
+            for d in data_source.execute_query(
+                sql,
+                values=resolve_parameters(values) or None,
+                timeout=self.max_execution_time,
+            )
+        ]
+        if len(values) > max_pivot_values:
+            return None
+        return values
 
-        query = query.limit(self._limit)
+    def update_query(self):
+        with self.timed("format"):
+            self.transform_sql, self.transform_sql_params = None, None
+            if self._transform_query:
+                self.transform_sql, params = bind_parameters(
+                    format_sql(
+                        str(self._transform_query),
+                        keyword_case="upper",
+                        reindent_aligned=True,
+                    ),
+                    self._params,
+                )
+                self.transform_sql_params = dumps(params, default=cstr)
 
-        self._query = query
+            self.result_formats = (
+                dumps(self._result_formats) if self._result_formats else None
+            )
+            self.filter_strategies = (
+                dumps(self._filter_strategies, indent=2)
+                if self._filter_strategies
+                else None
+            )
+            sql, params = bind_parameters(
+                format_sql(
+                    str(self._query), keyword_case="upper", reindent_aligned=True
+                ),
+                self._params,
+            )
 
-    def update_query(self):
-        updated_query = format_sql(
-            str(self._query), keyword_case="upper", reindent_aligned=True
-        )
-        if self.sql == updated_query:
+        self.update_sql(sql, dumps(params, default=cstr))
+
+    def update_sql(self, sql, sql_params, plan=None):
+        # filter values are bound to the SQL, changing them doesn't change the SQL
+        if self.sql == sql and self.sql_params == sql_params:
             return
 
-        self.sql = updated_query
+        invalidate(self.data_source, self.sql, self.get_sql_values())
+        self.sql = sql
+        self.sql_params = sql_params
         self.status = "Pending Execution"
+        # aggregates kept for incremental refresh are of the old query
+        delete_result(self.aggregate_state_key)
+        self.aggregate_state_key = None
+        self.aggregate_watermark = None
+        self.aggregate_values = None
+        if plan:
+            self.query_plan, self.plan_warnings = plan
+        else:
+            self.update_plan()
+
+    def update_plan(self):
+        # shown before the query is run, so that slow queries can be fixed upfront
+        with self.timed("explain"):
+            plan = explain(self)
+        self.query_plan = plan and dumps(plan, indent=2, default=cstr)
+        self.plan_warnings = plan and dumps(get_plan_warnings(plan), indent=2)
+
+    def get_sql_values(self):
+        """Returns the values to bind to the SQL, with timespans resolved as of today"""
+        return resolve_parameters(loads(self.sql_params or "[]"))
+
+    def get_transform_sql_values(self):
+        return resolve_parameters(loads(self.transform_sql_params or "[]"))
 
     def execute(self):
+        if self.cache_duration and self.execute_from_cache():
+            return
+
+        if self.incremental_refresh and execute_incrementally(self):
+            return
+
+        # rows are streamed from the data source into the result store by `update_result`
+        self._result = self.stream_from_data_source()
+
+    def stream_from_data_source(self):
+        values = self.get_sql_values()
         data_source = frappe.get_cached_doc("Data Source", self.data_source)
-        start = time.time()
-        result = data_source.execute_query(self.sql, debug=True)
-        end = time.time()
-        self._result = list(result)
-        self.execution_time = flt(end - start, 3)
+        if self.rollup:
+            # summary tables are on the site's database, a few rows per bucket
+            batches = iter(
+                [
+                    data_source.execute_site_query(
+                        self.sql,
+                        values=values,
+                        timeout=self.max_execution_time,
+                        run_id=self.name,
+                    )
+                ]
+            )
+        else:
+            batches = data_source.execute_query(
+                self.sql,
+                values=values or None,
+                stream=True,
+                timeout=self.max_execution_time,
+                run_id=self.name,
+            )
+
+        # rows are kept for the result cache only while they fit in a cache entry
+        cacheable_rows = [] if self.cache_duration else None
+        cacheable_size = 0
+        max_cacheable_size = get_max_entry_size()
+
+        execution_time = 0
+        row_count = 0
+        last_published = time.time()
+        while True:
+            # only the time spent waiting on the database counts as execution time
+            start = time.time()
+            batch = next(batches, None)
+            execution_time += time.time() - start
+            if batch is None:
+                break
+
+            row_count += len(batch)
+            if self.flags.publish_progress and time.time() - last_published > 1:
+                publish_query_status(self.name, "Running", rows=row_count)
+                last_published = time.time()
+
+            if cacheable_rows is not None:
+                cacheable_rows.extend(batch)
+                cacheable_size += sum(get_row_size(row) for row in batch)
+                if cacheable_size > max_cacheable_size:
+                    cacheable_rows = None
+
+            yield from batch
+
+        self.execution_time = flt(execution_time, 3)
         self.last_execution = frappe.utils.now()
+        self.from_cache = 0
+        self.cache_lookup_time = 0
+
+        if cacheable_rows is not None:
+            cache_result(
+                self.data_source,
+                self.sql,
+                values,
+                cacheable_rows,
+                execution_time=self.execution_time,
+                last_execution=self.last_execution,
+                ttl=self.cache_duration,
+            )
+
+    def execute_from_cache(self):
+        start = time.time()
+        cached = get_cached_result(self.data_source, self.sql, self.get_sql_values())
+        if not cached:
+            return False
+
+        self._result = cached.result
+        # execution time & last execution are of the run that populated the cache
+        self.execution_time = cached.execution_time
+        self.last_execution = cached.last_execution
+        self.from_cache = 1
+        self.cache_lookup_time = flt(time.time() - start, 3)
+        return True
+
+    def should_run_in_background(self, background=None):
+        if background is not None:
+            return cint(background)
+
+        # route by how long the query took the last time it was run
+        threshold = (
+            flt(frappe.conf.get("insights_background_query_threshold"))
+            or BACKGROUND_QUERY_THRESHOLD
+        )
+        return flt(self.execution_time) >= threshold
+
+    def enqueue_run(self):
+        self.db_set("status", "Queued", update_modified=False)
+        job = frappe.enqueue(
+            "insights.insights.doctype.query.query.run_query_in_background",
+            queue="long",
+            query=self.name,
+        )
+        publish_query_status(self.name, "Queued", job_id=job.id)
+        return {"job_id": job.id, "status": "Queued"}
 
     def update_result(self):
-        self.result = dumps(self._result, default=cstr)
+        stored_result = store_result(self.name, self.format_result(self._result))
+        delete_result(self.result_key)
+        self.result_key = stored_result.result_key
+        self.result_rows = stored_result.row_count
+        self.result_size = stored_result.result_size
         self.status = "Execution Successful"
+        self.run_count = cint(self.run_count) + 1
+
+        # rows are read from the database as they're stored, each is timed separately
+        fetch_time = self.cache_lookup_time if self.from_cache else self.execution_time
+        self._timings["fetch"] = flt(fetch_time, 3)
+        self._timings["encode"] = flt(stored_result.encode_time, 3)
+        self._timings["write"] = flt(stored_result.write_time, 3)
+
+    def format_result(self, rows):
+        """Returns the rows with their date buckets formatted for display"""
+        formats = {
+            cint(idx): date_format
+            for idx, date_format in loads(self.result_formats or "{}").items()
+        }
+        if not formats:
+            # queries built before dates were bucketed format them on the database
+            return rows
+
+        def format_row(row):
+            row = list(row)
+            for idx, date_format in formats.items():
+                row[idx] = ColumnFormat.format_value(date_format, row[idx])
+            return row
+
+        return (format_row(row) for row in rows)
+
+    def log_execution(self):
+        """Logs the time taken by each stage of the last build & this run.
+
+        Returns the logged stages, along with the rows & size of the result.
+        """
+        timings = {**loads(self.build_timings or "{}"), **self._timings}
+        log = frappe.get_doc(
+            {
+                "doctype": "Query Execution Log",
+                "query": self.name,
+                "data_source": self.data_source,
+                "from_cache": self.from_cache,
+                "total_time": flt(sum(self._timings.values()), 3),
+                "result_rows": self.result_rows,
+                "result_size": self.result_size,
+                "timings": dumps(timings, indent=2),
+            }
+        ).insert(ignore_permissions=True)
+
+        return {
+            "timings": timings,
+            "total_time": log.total_time,
+            "result_rows": log.result_rows,
+            "result_size": log.result_size,
+        }
 
     def process_tables(self):
         self._tables = []
         for row in self.tables:
-            table = Table(row.table)
+            table = Table(self._rollup.summary_table if self._rollup else row.table)
             if table not in self._tables:
                 self._tables.append(table)
 
@@ -148,6 +609,9 @@ class Query(QueryClient):
 
     def process_columns(self):
         self._columns = []
+        self._unaggregated_columns = {}
+        # formats of date buckets by their position in the result rows
+        self._result_formats = {}
         self._group_by_columns = []
         self._order_by_columns = []
 
@@ -163,18 +627,58 @@ class Query(QueryClient):
             self._columns.append(_column)
 
     def process_dimension_or_metric(self, row):
-        _column = make_query_field(row.table, row.column)
-        # dates should be formatted before aggregagtions
-        _column = self.process_column_format(row, _column)
+        _column = self.make_query_field(row.table, row.column)
+        # pivots aggregate the column themselves, pivot values are labels of columns
+        self._unaggregated_columns[row.label] = self.process_column_format(row, _column)
+        # dates should be bucketed before aggregations
+        _column = self.process_date_bucket(row, _column)
         _column = self.process_aggregation(row, _column)
         return _column
 
-    def process_column_format(self, row, column):
+    def get_date_format(self, row):
         if row.format_option and row.type in ("Date", "Datetime"):
-            format_option = _dict(loads(row.format_option))
-            return ColumnFormat.format_date(format_option.date_format, column)
+            return _dict(loads(row.format_option)).date_format
+
+    def process_column_format(self, row, column):
+        date_format = self.get_date_format(row)
+        if date_format:
+            return ColumnFormat.format_date(date_format, column)
         return column
 
+    def process_date_bucket(self, row, column):
+        """Returns the bucket of a date column, grouped & sorted as a native value.
+
+        Buckets are formatted as the column's format by `format_result` once fetched,
+        the database formats only the rows of the result.
+        """
+        date_format = self.get_date_format(row)
+        if not date_format:
+            return column
+
+        if (row.aggregation or "").lower() in BUCKET_AGGREGATIONS:
+            self._result_formats[len(self._columns)] = date_format
+
+        calendar_column = get_calendar_column(date_format)
+        if self._rollup and calendar_column and calendar_exists():
+            # the calendar is on the site's database too, buckets are looked up on it
+            return self.make_calendar_field(column, calendar_column)
+        return ColumnFormat.truncate_date(date_format, column)
+
+    def make_calendar_field(self, date_column, calendar_column):
+        Calendar = Table(CALENDAR_TABLE)
+        if not any(join.right == Calendar for join in self._joins):
+            self._joins.append(
+                _dict(
+                    {
+                        "left": self._tables[0],
+                        "right": Calendar,
+                        "type": JoinType.left,
+                        "condition": date_column == Calendar.date,
+                    }
+                )
+            )
+        return Calendar[calendar_column]
+
     def process_aggregation(self, row, column):
         if not row.aggregation:
             return column
@@ -186,23 +690,32 @@ class Query(QueryClient):
             frappe.throw("Invalid aggregation function: {}".format(row.aggregation))
 
         else:
-            column = Aggregations.apply(row.aggregation.lower(), column)
+            aggregation = row.aggregation.lower()
+            if self._rollup:
+                # buckets hold every aggregation, aggregated again across buckets
+                column, aggregation = self._rollup.get_summary_aggregate(
+                    row.column, aggregation
+                )
+            column = Aggregations.apply(aggregation, column)
 
         return column
 
+    def make_query_field(self, table, column):
+        if self._rollup:
+            return self._rollup.get_summary_field(column)
+        return make_query_field(table, column)
+
     def process_sorting(self, row, column):
         if not row.order_by:
             return column
 
-        if row.type in ("Date", "Datetime") and row.format_option:
-            format_option = _dict(loads(row.format_option))
-            date = ColumnFormat.parse_date(format_option.date_format, column)
-            self._order_by_columns.append((date, row.order_by))
-        else:
-            self._order_by_columns.append((column, row.order_by))
+        # date buckets are sorted as dates or numbers, before they're formatted
+        self._order_by_columns.append((column, row.order_by))
 
     def process_filters(self):
         filters = _dict(loads(self.filters))
+        # how each contains filter is matched, recorded with the compiled query
+        self._filter_strategies = []
 
         def process_filter_group(filter_group):
             _filters = []
@@ -246,10 +759,23 @@ class Query(QueryClient):
                 return self.process_expression(term)
 
             if is_query_field(term):
-                return make_query_field(term.table, term.column)
+                return self.make_query_field(term.table, term.column)
 
             if is_literal_value(term):
-                return self.process_literal_value(term, condition.operator)
+                value = self.process_literal_value(term, condition.operator)
+                # `is` compares with null, the value is part of the operation
+                if condition.operator.value == "is":
+                    return value
+                return self.process_parameter(value)
+
+        if (
+            condition.operator.value in ("contains", "not contains")
+            and is_query_field(condition.left)
+            and is_literal_value(condition.right)
+        ):
+            return self.process_contains(
+                condition.left, condition.right, condition.operator.value
+            )
 
         operation = Operations.get_operation(condition.operator.value)
         condition_left = process_term(condition.left)
@@ -257,6 +783,37 @@ class Query(QueryClient):
 
         return operation(condition_left, condition_right)
 
+    def process_contains(self, column, literal, operator="contains"):
+        """Returns the condition of a (not) contains filter, on a FULLTEXT index if possible.
+
+        The index narrows the rows down, `LIKE` keeps the matches exact.
+        """
+        field = self.make_query_field(column.table, column.column)
+        value = self.process_parameter(
+            self.process_literal_value(literal, _dict(value="contains"))
+        )
+        if operator == "not contains":
+            condition = field.not_like(value)
+        else:
+            condition = field.like(value)
+
+        strategy, reason = get_contains_strategy(
+            self, column.table, column.column, literal.value, operator
+        )
+        self._filter_strategies.append(
+            {
+                "table": column.table,
+                "column": column.column,
+                "operator": operator,
+                "strategy": strategy,
+                "reason": reason,
+            }
+        )
+        if strategy == "fulltext":
+            search = self.process_parameter(get_fulltext_search(literal.value))
+            condition = FulltextMatch(field, search) & condition
+        return condition
+
     def process_literal_value(self, literal, operator):
         if type(literal.value) == str:
             literal.value = literal.value.replace('"', "")
@@ -276,17 +833,66 @@ class Query(QueryClient):
         if operator.value == "between":
             return [d.lstrip().rstrip() for d in literal.value.split(",")]
 
-        if operator.value == "timespan":
-            timespan_value = literal.value.lower().strip()
-            if "current" in timespan_value:
-                return get_date_range(timespan=timespan_value)
-
-            elif "last" in timespan_value:
-                [span, interval, interval_type] = timespan_value.split(" ")
-                timespan = span + " n " + interval_type
-                return get_date_range(timespan=timespan, n=int(interval))
+        if operator.value == "timespan" and get_timespan_range(literal.value):
+            # resolved when the query is run, so that the SQL is the same every day
+            return [
+                {"timespan": literal.value, "bound": 0},
+                {"timespan": literal.value, "bound": 1, "exclusive": 1},
+            ]
 
         return literal.value
 
+    def process_parameter(self, value):
+        if isinstance(value, list):
+            return [self.process_parameter(d) for d in value]
+
+        self._params.append(value)
+        return make_parameter(len(self._params) - 1)
+
     def process_limit(self):
         self._limit: int = self.limit or 10
+
+
+def run_query_in_background(query):
+    doc = frappe.get_doc("Query", query)
+    if doc.status == "Execution Cancelled":
+        # cancelled before the job was picked up
+        return
+
+    publish_query_status(query, "Running")
+    doc.flags.publish_progress = True
+
+    try:
+        profile = doc.run(background=False)
+    except QueryCancelled:
+        # status is updated by the request that cancelled the query
+        frappe.db.rollback()
+        publish_query_status(query, "Execution Cancelled")
+        return
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.db.set_value(
+            "Query", query, "status", "Execution Failed", update_modified=False
+        )
+        frappe.db.commit()
+        publish_query_status(query, "Execution Failed", error=str(e))
+        raise
+
+    # notify after the job commits, so that the result can be read right away
+    publish_query_status(
+        query,
+        "Execution Successful",
+        after_commit=True,
+        rows=doc.result_rows,
+        execution_time=doc.execution_time,
+        timings=profile["timings"],
+    )
+
+
+def publish_query_status(query, status, after_commit=False, **kwargs):
+    frappe.publish_realtime(
+        "insights_query_status",
+        message={"query": query, "status": status, **kwargs},
+        user=frappe.session.user,
+        after_commit=after_commit,
+    )
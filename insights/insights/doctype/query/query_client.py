@@ -1,13 +1,26 @@
 # Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
+import csv
+from io import StringIO
 from json import dumps, loads
 from copy import deepcopy
-from pandas import DataFrame
 
 import frappe
-from frappe.utils import cstr, cint
+from frappe.utils import cstr, cint, flt
 from frappe.model.document import Document
+from pymysql.err import OperationalError
+
+from insights.insights.doctype.data_source import fulltext_indexes
+from insights.insights.doctype.query.columnar_result import encode_columnar
+from insights.insights.doctype.query.fulltext import ER_FT_MATCHING_KEY_NOT_FOUND
+from insights.insights.doctype.query.pivot import from_pivoted_rows, pivot
+from insights.insights.doctype.query.result_cache import invalidate
+from insights.insights.doctype.query.result_store import (
+    iter_result,
+    get_result,
+    delete_result,
+)
 
 
 class QueryClient(Document):
@@ -134,26 +147,50 @@ class QueryClient(Document):
     def apply_transform(self, type, data):
         self.transform_type = type
         self.transform_data = dumps(data, indent=2, default=cstr)
-        if type == "Pivot":
-            self.pivot(data)
-
+        # compiles the transform into `transform_sql`
         self.save()
 
-    def pivot(self, transform_data):
-
-        # TODO: validate if two columns doesn't have same label
+        self.run_transform()
+        self.skip_before_save = True
+        self.save()
 
-        result = loads(self.result)
-        columns = [d.get("label") for d in self.get("columns")]
+    def run_transform(self):
+        transform_data = frappe._dict(loads(self.transform_data or "{}"))
+        if self.transform_type != "Pivot" or not transform_data.value_columns:
+            self.transform_result = None
+            return
 
-        dataframe = DataFrame(columns=columns, data=result)
-        pivoted = dataframe.pivot(
-            index=transform_data.get("index_columns"),
-            columns=transform_data.get("pivot_columns"),
-        )
+        if self.transform_sql:
+            data_source = frappe.get_cached_doc("Data Source", self.data_source)
+            rows = data_source.execute_query(
+                self.transform_sql,
+                values=self.get_transform_sql_values() or None,
+                timeout=self.max_execution_time,
+            )
+            result = from_pivoted_rows(
+                rows,
+                transform_data.index_columns,
+                transform_data.pivot_columns[0],
+                transform_data.pivot_values,
+                transform_data.value_columns,
+            )
+        else:
+            # couldn't be compiled to sql, pivot the stored result instead
+            # rows of the result are already aggregated, counts add up
+            value_columns = deepcopy(transform_data.value_columns)
+            for d in value_columns:
+                if d["aggregation"] == "count":
+                    d["aggregation"] = "sum"
+            result = pivot(
+                get_result(self.result_key),
+                [d.get("label") for d in self.get("columns")],
+                transform_data.index_columns,
+                transform_data.pivot_columns[0],
+                value_columns,
+                aggregated=True,
+            )
 
-        self.transform_result = pivoted.to_html()
-        self.transform_result = self.transform_result.replace("NaN", "-")
+        self.transform_result = dumps(result, default=cstr)
 
     @frappe.whitelist()
     def fetch_tables(self):
@@ -292,16 +329,114 @@ class QueryClient(Document):
         ]
 
     @frappe.whitelist()
-    def run(self):
-        self.execute()
-        self.update_result()
+    def get_execution_history(self, limit=20):
+        """Returns the last runs with the time taken by each stage, and its average"""
+        executions = frappe.get_all(
+            "Query Execution Log",
+            filters={"query": self.name},
+            fields=[
+                "creation",
+                "from_cache",
+                "total_time",
+                "result_rows",
+                "result_size",
+                "timings",
+            ],
+            order_by="creation desc",
+            limit=cint(limit),
+        )
+
+        stages = {}
+        for execution in executions:
+            execution.timings = loads(execution.timings or "{}")
+            for stage, seconds in execution.timings.items():
+                stages.setdefault(stage, []).append(flt(seconds))
+
+        return {
+            "executions": executions,
+            "average": {
+                stage: flt(sum(seconds) / len(seconds), 3)
+                for stage, seconds in stages.items()
+            },
+        }
+
+    @frappe.whitelist()
+    def fetch_result(self, start=0, end=None):
+        return get_result(self.result_key, start, end)
+
+    @frappe.whitelist()
+    def fetch_columnar_result(self, start=0, end=None, compress=1):
+        """Sends the result encoded column by column, it's decoded faster than JSON"""
+        frappe.response["type"] = "binary"
+        frappe.response["filename"] = f"{self.name}.bin"
+        frappe.response["filecontent"] = encode_columnar(
+            iter_result(self.result_key, start, end), compress=cint(compress)
+        )
+
+    @frappe.whitelist()
+    def download_result(self):
+        # rows are read from the result store chunk by chunk
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow([d.get("label") for d in self.get("columns")])
+        for row in iter_result(self.result_key):
+            writer.writerow(row)
+
+        frappe.response["result"] = output.getvalue()
+        frappe.response["type"] = "csv"
+        frappe.response["doctype"] = self.title
+
+    @frappe.whitelist()
+    def run(self, background=None):
+        if self.should_run_in_background(background):
+            return self.enqueue_run()
+
+        self._timings = {}
+        if not self.fingerprint and not self.transform_type:
+            # compiled queries were invalidated, eg. by a rollup that changed
+            self.rebuild()
+
+        try:
+            self.execute()
+            self.update_result()
+        except OperationalError as e:
+            if e.args[0] != ER_FT_MATCHING_KEY_NOT_FOUND:
+                raise
+            # a FULLTEXT index the query matched on was dropped, match with LIKE instead
+            fulltext_indexes.sync_indexes(
+                frappe.get_cached_doc("Data Source", self.data_source)
+            )
+            self.rebuild()
+            self.execute()
+            self.update_result()
+
+        with self.timed("transform"):
+            self.run_transform()
 
         # skip processing and updating query since it's already done
         self.skip_before_save = True
-        self.save()
+        with self.timed("save"):
+            self.save()
+
+        return self.log_execution()
+
+    def rebuild(self):
+        """Builds the query again, on the data source's rollups & indexes as they're now"""
+        self.flags.rebuild = True
+        self.before_save()
+        self.flags.rebuild = False
+
+    @frappe.whitelist()
+    def cancel_run(self):
+        data_source = frappe.get_cached_doc("Data Source", self.data_source)
+        if not data_source.kill_query(self.name) and self.status != "Queued":
+            frappe.throw("Query is not running")
+
+        self.db_set("status", "Execution Cancelled", update_modified=False)
 
     @frappe.whitelist()
     def reset(self):
+        invalidate(self.data_source, self.sql, self.get_sql_values())
         self.tables = []
         self.columns = []
         self.filters = dumps(
@@ -314,13 +449,32 @@ class QueryClient(Document):
             indent=2,
         )
         self.sql = None
-        self.result = None
+        self.sql_params = None
+        self.result_formats = None
+        self.filter_strategies = None
+        self.fingerprint = None
+        self.query_plan = None
+        self.plan_warnings = None
+        delete_result(self.result_key)
+        self.result_key = None
+        self.result_rows = 0
+        self.result_size = 0
         self.status = "Pending Execution"
         self.limit = 10
         self.execution_time = 0
         self.last_execution = None
+        self.from_cache = 0
+        self.cache_lookup_time = 0
+        delete_result(self.aggregate_state_key)
+        self.aggregate_state_key = None
+        self.aggregate_watermark = None
+        self.aggregate_values = None
+        self.last_full_refresh = None
+        self.rollup = None
         self.transform_type = None
         self.transform_data = None
+        self.transform_sql = None
+        self.transform_sql_params = None
         self.transform_result = None
         self.skip_before_save = True
 
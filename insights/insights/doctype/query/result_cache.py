@@ -0,0 +1,117 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import pickle
+import time
+from hashlib import sha256
+from json import dumps
+
+import frappe
+from frappe import _dict
+from frappe.utils import cint, cstr
+
+from insights.utils import get_config
+
+# defaults can be overridden from site config, eg. "insights_result_cache_size": 128
+CACHE_SIZE_MB = 64
+MAX_ENTRY_SIZE_MB = 8
+
+CACHE_KEY_PREFIX = "insights_query_result"
+LRU_KEY = "insights_query_result_lru"
+SIZE_KEY = "insights_query_result_size"
+
+
+def get_cache_key(data_source, sql, values=None):
+    """Returns the key of the result of `sql` run with `values` bound to it.
+
+    `sql` is the compiled SQL of a query, queries alike compile to the same SQL.
+    """
+    sql_hash = sha256(sql.encode()).hexdigest()
+    key = f"{CACHE_KEY_PREFIX}|{data_source}|{sql_hash}"
+    if values:
+        values_hash = sha256(dumps(list(values), default=cstr).encode()).hexdigest()
+        key += f"|{values_hash}"
+    return key
+
+
+def get_cached_result(data_source, sql, values=None):
+    if not sql:
+        return
+
+    key = get_cache_key(data_source, sql, values)
+    payload = frappe.cache().get_value(key)
+    if not payload:
+        forget(key)
+        return
+
+    touch(key)
+    return _dict(pickle.loads(payload))
+
+
+def cache_result(data_source, sql, values, result, execution_time, last_execution, ttl):
+    if not sql or not ttl:
+        return
+
+    payload = pickle.dumps(
+        {
+            "result": result,
+            "execution_time": execution_time,
+            "last_execution": last_execution,
+        },
+        protocol=pickle.HIGHEST_PROTOCOL,
+    )
+    size = len(payload)
+    if size > get_max_entry_size():
+        return
+
+    key = get_cache_key(data_source, sql, values)
+    frappe.cache().set_value(key, payload, expires_in_sec=cint(ttl))
+    frappe.cache().hset(SIZE_KEY, key, size)
+    touch(key)
+    evict(max_size=get_config("result_cache_size", CACHE_SIZE_MB) * 1024 * 1024)
+
+
+def invalidate(data_source, sql, values=None):
+    if not sql:
+        return
+
+    key = get_cache_key(data_source, sql, values)
+    frappe.cache().delete_value(key)
+    forget(key)
+
+
+def touch(key):
+    cache = frappe.cache()
+    cache.zadd(cache.make_key(LRU_KEY), {key: time.time()})
+
+
+def forget(key):
+    cache = frappe.cache()
+    cache.zrem(cache.make_key(LRU_KEY), key)
+    cache.hdel(SIZE_KEY, key)
+
+
+def evict(max_size):
+    """Drops the least recently used results until the cache fits in `max_size` bytes.
+
+    Entries that already expired in redis are still accounted for here until
+    they become the least recently used and get dropped.
+    """
+    cache = frappe.cache()
+    sizes = {frappe.safe_decode(k): v for k, v in cache.hgetall(SIZE_KEY).items()}
+    total_size = sum(cint(size) for size in sizes.values())
+    if total_size <= max_size:
+        return
+
+    lru_key = cache.make_key(LRU_KEY)
+    for key in cache.zrange(lru_key, 0, -1):
+        key = frappe.safe_decode(key)
+        total_size -= cint(sizes.get(key))
+        cache.delete_value(key)
+        forget(key)
+        if total_size <= max_size:
+            break
+
+
+def get_max_entry_size():
+    return get_config("max_entry_size", MAX_ENTRY_SIZE_MB) * 1024 * 1024
@@ -0,0 +1,127 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import time
+import zlib
+from base64 import b64decode, b64encode
+from decimal import Decimal
+from json import dumps, loads
+
+import frappe
+from frappe import _dict
+from frappe.utils import cint, cstr
+
+from insights.utils import bulk_insert
+
+CHUNK_SIZE = 1000
+
+
+def encode_chunk(rows):
+    data = dumps(rows, default=to_json).encode()
+    return b64encode(zlib.compress(data)).decode()
+
+
+def to_json(value):
+    # decimals, eg. of sums & currency columns, are kept as numbers, dates as text
+    if isinstance(value, Decimal):
+        return float(value)
+    return cstr(value)
+
+
+def decode_chunk(data):
+    return loads(zlib.decompress(b64decode(data)))
+
+
+def store_result(query, rows, chunk_size=CHUNK_SIZE):
+    """Writes `rows` as compressed chunks of `chunk_size` rows each.
+
+    `rows` can be any iterable, it is consumed one chunk at a time.
+    Returns the key to read the result back with, along with row count,
+    the size of the result in bytes and the time spent encoding & writing it.
+    """
+    result_key = frappe.generate_hash(length=16)
+    row_count = 0
+    result_size = 0
+    chunk_index = 0
+    chunk = []
+    encode_time = 0
+    write_time = 0
+
+    def flush():
+        nonlocal result_size, chunk_index, encode_time, write_time
+        start = time.time()
+        data = encode_chunk(chunk)
+        encode_time += time.time() - start
+        result_size += len(data)
+        start = time.time()
+        insert_chunk(
+            query, result_key, chunk_index, row_count - len(chunk), chunk, data
+        )
+        write_time += time.time() - start
+        chunk_index += 1
+        chunk.clear()
+
+    for row_count, row in enumerate(rows, 1):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            flush()
+
+    if chunk or not chunk_index:
+        flush()
+
+    return _dict(
+        result_key=result_key,
+        row_count=row_count,
+        result_size=result_size,
+        encode_time=encode_time,
+        write_time=write_time,
+    )
+
+
+def insert_chunk(query, result_key, chunk_index, row_start, rows, data):
+    bulk_insert(
+        "Query Result Chunk",
+        fields=["query", "result_key", "chunk_index", "row_start", "row_count", "data"],
+        values=[(query, result_key, chunk_index, row_start, len(rows), data)],
+    )
+
+
+def iter_result(result_key, start=0, end=None):
+    """Yields rows from `start` up to `end`, reading only the chunks that overlap the range"""
+    if not result_key:
+        return
+
+    start = cint(start)
+    ResultChunk = frappe.qb.DocType("Query Result Chunk")
+    query = (
+        frappe.qb.from_(ResultChunk)
+        .select(ResultChunk.row_start, ResultChunk.data)
+        .where(
+            (ResultChunk.result_key == result_key)
+            & (ResultChunk.row_start + ResultChunk.row_count > start)
+        )
+        .orderby(ResultChunk.chunk_index)
+    )
+    if end is not None:
+        query = query.where(ResultChunk.row_start < cint(end))
+
+    for chunk in query.run(as_dict=True):
+        rows = decode_chunk(chunk.data)
+        offset = max(start - chunk.row_start, 0)
+        stop = len(rows) if end is None else cint(end) - chunk.row_start
+        yield from rows[offset:stop]
+
+
+def get_result(result_key, start=0, end=None):
+    return list(iter_result(result_key, start, end))
+
+
+def delete_result(result_key):
+    if not result_key:
+        return
+
+    frappe.db.delete("Query Result Chunk", {"result_key": result_key})
+
+
+def delete_query_results(query):
+    frappe.db.delete("Query Result Chunk", {"query": query})
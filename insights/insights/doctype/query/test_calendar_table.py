@@ -0,0 +1,43 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import unittest
+from datetime import date
+
+from insights.insights.doctype.query.calendar_table import (
+    CALENDAR_COLUMNS,
+    get_calendar_row,
+    get_fiscal_year_start,
+    parse_timespan,
+)
+
+
+class TestCalendarTable(unittest.TestCase):
+    def test_parse_timespan(self):
+        self.assertEqual(parse_timespan("Current Month"), (0, "month"))
+        self.assertEqual(parse_timespan("Last 2 Days"), (2, "day"))
+        self.assertEqual(parse_timespan("Last 1 Fiscal Years"), (1, "fiscal year"))
+        self.assertEqual(parse_timespan("Current Fiscal Year"), (0, "fiscal year"))
+
+    def test_fiscal_year_start(self):
+        self.assertEqual(get_fiscal_year_start(date(2022, 3, 31), 4), date(2021, 4, 1))
+        self.assertEqual(get_fiscal_year_start(date(2022, 4, 1), 4), date(2022, 4, 1))
+        self.assertEqual(get_fiscal_year_start(date(2022, 12, 1), 1), date(2022, 1, 1))
+
+    def test_calendar_row(self):
+        row = dict(zip(CALENDAR_COLUMNS, get_calendar_row(date(2022, 9, 4), 4)))
+        self.assertEqual(row["month_start"], date(2022, 9, 1))
+        self.assertEqual(row["quarter_start"], date(2022, 7, 1))
+        self.assertEqual(row["year_start"], date(2022, 1, 1))
+        self.assertEqual(row["fiscal_year_start"], date(2022, 4, 1))
+        self.assertEqual(row["fiscal_year_key"], 2022)
+        # 4th september 2022 is a sunday, counted as 1 like DAYOFWEEK
+        self.assertEqual(row["day_of_week"], 1)
+        self.assertEqual(row["day_of_year"], 247)
+        self.assertEqual(row["quarter_of_year"], 3)
+
+    def test_consecutive_keys(self):
+        december = dict(zip(CALENDAR_COLUMNS, get_calendar_row(date(2021, 12, 31), 1)))
+        january = dict(zip(CALENDAR_COLUMNS, get_calendar_row(date(2022, 1, 1), 1)))
+        for key in ("day_key", "month_key", "quarter_key", "year_key"):
+            self.assertEqual(january[key] - december[key], 1)
@@ -0,0 +1,70 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import struct
+import unittest
+import zlib
+from decimal import Decimal
+from json import dumps
+
+from insights.insights.doctype.query.columnar_result import (
+    DATE,
+    DATETIME,
+    DICTIONARY,
+    FLOAT64,
+    INT32,
+    JSON,
+    MAGIC,
+    NULL,
+    STRING,
+    encode_columnar,
+    get_column_encoding,
+    get_validity_bitmap,
+)
+from insights.insights.doctype.query.result_store import decode_chunk, encode_chunk
+
+
+class TestColumnarResult(unittest.TestCase):
+    def test_column_encoding(self):
+        self.assertEqual(get_column_encoding([1, None, -3]), INT32)
+        self.assertEqual(get_column_encoding([1, 2**40]), FLOAT64)
+        self.assertEqual(get_column_encoding([1, 2.5]), FLOAT64)
+        self.assertEqual(get_column_encoding([2**60]), JSON)
+        self.assertEqual(get_column_encoding(["2022-09-01", None]), DATE)
+        self.assertEqual(
+            get_column_encoding(["2022-09-01 10:30:00", "2022-09-01 10:30:00.250000"]),
+            DATETIME,
+        )
+        self.assertEqual(get_column_encoding(["a", "b", "a", "a"]), DICTIONARY)
+        self.assertEqual(get_column_encoding(["a", "b"]), STRING)
+        self.assertEqual(get_column_encoding([None, None]), NULL)
+        self.assertEqual(get_column_encoding([1, "a"]), JSON)
+        # zero dates aren't dates
+        self.assertEqual(get_column_encoding(["0000-00-00", "2022-09-01"]), STRING)
+
+    def test_decimal_column(self):
+        values = [Decimal("10.50"), None, Decimal("2.25")]
+        self.assertEqual(get_column_encoding(values), FLOAT64)
+        # decimals of stored results, eg. of sums, are read back as numbers
+        stored = [row[0] for row in decode_chunk(encode_chunk([[v] for v in values]))]
+        self.assertEqual(stored, [10.5, None, 2.25])
+        self.assertEqual(get_column_encoding(stored), FLOAT64)
+
+    def test_validity_bitmap(self):
+        values = [1, None] + [1] * 7
+        self.assertEqual(get_validity_bitmap(values), bytes((0b11111101, 0b1)))
+
+    def test_header(self):
+        data = encode_columnar([[1, "a"], [2, "b"], [3, None]], compress=False)
+        self.assertEqual(data[:4], MAGIC)
+        self.assertEqual(struct.unpack_from("<IH", data, 4), (3, 2))
+        # the first column follows the header, 1 byte of bitmap then its values
+        self.assertEqual(data[10], INT32)
+        self.assertEqual(data[11], 0b111)
+        self.assertEqual(struct.unpack_from("<3i", data, 12), (1, 2, 3))
+
+    def test_compressed_size(self):
+        rows = [[idx, "Open" if idx % 3 else "Closed", 10.5] for idx in range(1000)]
+        data = encode_columnar(rows)
+        self.assertEqual(zlib.decompress(data), encode_columnar(rows, compress=False))
+        self.assertLess(len(data), len(dumps(rows)) / 10)
@@ -0,0 +1,47 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import unittest
+from json import dumps
+
+from frappe import _dict
+
+from insights.insights.doctype.query.compiled_cache import get_fingerprint
+
+
+def make_query(filters, **column):
+    return _dict(
+        data_source="Site DB",
+        tables=[_dict(table="tabSales Invoice", join=None)],
+        columns=[
+            _dict(
+                table="tabSales Invoice",
+                column="grand_total",
+                label="Total",
+                aggregation="Sum",
+                **column,
+            )
+        ],
+        filters=filters,
+        limit=10,
+    )
+
+
+FILTERS = {"group_operator": "&", "level": 1, "position": 1, "conditions": []}
+
+
+class TestCompiledCache(unittest.TestCase):
+    def test_formatting_is_ignored(self):
+        compact = make_query(dumps(FILTERS))
+        indented = make_query(dumps(dict(reversed(FILTERS.items())), indent=2))
+        self.assertEqual(get_fingerprint(compact), get_fingerprint(indented))
+
+    def test_definition_changes(self):
+        query = make_query(dumps(FILTERS))
+        self.assertNotEqual(
+            get_fingerprint(query),
+            get_fingerprint(make_query(dumps(FILTERS), order_by="desc")),
+        )
+        self.assertNotEqual(
+            get_fingerprint(query), get_fingerprint(_dict(query, limit=100))
+        )
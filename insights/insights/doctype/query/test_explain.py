@@ -0,0 +1,51 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import unittest
+
+from insights.insights.doctype.query.explain import get_plan_warnings
+
+
+class TestExplain(unittest.TestCase):
+    def test_full_scan(self):
+        plan = [
+            {
+                "id": 1,
+                "table": "tabSales Invoice",
+                "type": "ALL",
+                "rows": 5000000,
+                "extra": "Using where; Using temporary; Using filesort",
+            }
+        ]
+        self.assertEqual(
+            get_plan_warnings(plan),
+            [
+                "Reads all of ~5,000,000 rows in tabSales Invoice, "
+                "filter on an indexed column",
+                "Sorts rows of tabSales Invoice without an index",
+                "Groups or sorts rows of tabSales Invoice in a temporary table",
+            ],
+        )
+
+    def test_indexed_lookup(self):
+        plan = [{"id": 1, "table": "tabItem", "type": "ref", "rows": 10}]
+        self.assertEqual(get_plan_warnings(plan), [])
+
+    def test_large_join(self):
+        plan = [
+            {"id": 1, "table": "tabSales Invoice", "type": "range", "rows": 50000},
+            {
+                "id": 1,
+                "table": "tabSales Invoice Item",
+                "type": "ALL",
+                "rows": 80000,
+                "extra": "Using where; Using join buffer (flat, BNL join)",
+            },
+        ]
+        self.assertEqual(
+            get_plan_warnings(plan),
+            [
+                "Joins tabSales Invoice Item without an index on the join key",
+                "Joins ~4,000,000,000 combinations of rows",
+            ],
+        )
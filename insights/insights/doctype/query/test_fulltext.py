@@ -0,0 +1,28 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import unittest
+
+from frappe import _dict
+
+from insights.insights.doctype.query.fulltext import get_contains_strategy
+
+
+class TestFulltext(unittest.TestCase):
+    def get_strategy(self, text, operator="contains", **query):
+        query = _dict({"fulltext_search": 1, "_rollup": None, **query})
+        return get_contains_strategy(
+            query, "tabCommunication", "content", text, operator
+        )[0]
+
+    def test_opt_in(self):
+        self.assertEqual(self.get_strategy("invoice", fulltext_search=0), "like")
+
+    def test_not_contains(self):
+        self.assertEqual(self.get_strategy("invoice", "not contains"), "like")
+
+    def test_only_indexed_words(self):
+        self.assertEqual(self.get_strategy("inv-123"), "like")
+        self.assertEqual(self.get_strategy("50%"), "like")
+        self.assertEqual(self.get_strategy("an invoice"), "like")
+        self.assertEqual(self.get_strategy("ab"), "like")
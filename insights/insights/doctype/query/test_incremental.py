@@ -0,0 +1,45 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import unittest
+
+from frappe import _dict
+
+from insights.insights.doctype.query.incremental import can_merge, merge, sort_and_limit
+
+PLAN = _dict(group_by=[0], aggregations=[(1, "sum"), (2, "count"), (3, "max")])
+
+
+class TestIncrementalRefresh(unittest.TestCase):
+    def test_merge_updates_existing_groups(self):
+        state = [["East", "10.50", 2, "2022-08-01"], ["West", 5, 1, "2022-07-01"]]
+        changes = [["East", "4.50", 1, "2022-08-02"]]
+        self.assertEqual(
+            merge(state, changes, PLAN),
+            [["East", 15.0, 3.0, "2022-08-02"], ["West", 5, 1, "2022-07-01"]],
+        )
+
+    def test_merge_adds_new_groups(self):
+        state = [["East", 10, 2, None]]
+        changes = [["North", 1, 1, "2022-08-02"]]
+        self.assertEqual(
+            merge(state, changes, PLAN),
+            [["East", 10, 2, None], ["North", 1, 1, "2022-08-02"]],
+        )
+
+    def test_sort_and_limit(self):
+        rows = [["East", "10.5"], ["West", "9"], ["North", None], ["South", "100"]]
+        self.assertEqual(
+            sort_and_limit(rows, [(1, "desc")], 3),
+            [["South", "100"], ["East", "10.5"], ["West", "9"]],
+        )
+        self.assertEqual(sort_and_limit(rows, [(1, "asc")], 1), [["North", None]])
+
+    def test_no_merge_into_another_window(self):
+        # aggregates kept for yesterday's timespan aren't merged into today's
+        query = _dict(
+            aggregate_state_key="state",
+            aggregate_watermark="2022-09-14 23:00:00",
+            aggregate_values='["2022-08-15", "2022-09-15"]',
+        )
+        self.assertFalse(can_merge(query, None, None, '["2022-08-16", "2022-09-16"]'))
@@ -0,0 +1,103 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import unittest
+
+import frappe
+
+from insights.insights.doctype.query.pivot import from_pivoted_rows, pivot
+
+COLUMNS = ["Region", "Month", "Amount"]
+ROWS = [
+    ["East", "Jan", 10],
+    ["East", "Feb", 20],
+    ["East", "Jan", 5],
+    ["West", "Feb", None],
+    ["West", "Jan", 7],
+]
+
+
+class TestPivot(unittest.TestCase):
+    def test_dense_pivot(self):
+        result = pivot(
+            ROWS,
+            COLUMNS,
+            ["Region"],
+            "Month",
+            [{"label": "Amount", "aggregation": "sum"}],
+        )
+        self.assertEqual(result["layout"], "dense")
+        self.assertEqual(result["index"], [["East"], ["West"]])
+        self.assertEqual(result["pivot_values"], ["Feb", "Jan"])
+        self.assertEqual(result["values"], [[[20.0, 15.0], [None, 7.0]]])
+
+    def test_multiple_aggregations(self):
+        result = pivot(
+            ROWS,
+            COLUMNS,
+            ["Region"],
+            "Month",
+            [
+                {"label": "Amount", "aggregation": "count"},
+                {"label": "Amount", "aggregation": "max"},
+            ],
+        )
+        self.assertEqual(result["values"][0], [[1.0, 2.0], [0.0, 1.0]])
+        self.assertEqual(result["values"][1], [[20.0, 10.0], [None, 7.0]])
+
+    def test_sparse_pivot(self):
+        rows = [[f"Item {i}", f"Warehouse {i}", i] for i in range(10)]
+        result = pivot(
+            rows,
+            ["Item", "Warehouse", "Qty"],
+            ["Item"],
+            "Warehouse",
+            [{"label": "Qty", "aggregation": "sum"}],
+        )
+        self.assertEqual(result["layout"], "sparse")
+        self.assertEqual(result["cells"]["row"], list(range(10)))
+        self.assertEqual(result["cells"]["column"], list(range(10)))
+        self.assertEqual(result["values"], [[float(i) for i in range(10)]])
+
+    def test_from_pivoted_rows(self):
+        result = from_pivoted_rows(
+            [["East", 20, 15], ["West", None, 7]],
+            ["Region"],
+            "Month",
+            ["Feb", "Jan"],
+            [{"label": "Amount", "aggregation": "sum"}],
+        )
+        self.assertEqual(result["layout"], "dense")
+        self.assertEqual(result["values"], [[[20.0, 15.0], [None, 7.0]]])
+
+    def test_from_pivoted_rows_of_multiple_columns(self):
+        result = from_pivoted_rows(
+            [["East", 20, 1, 15, 2]],
+            ["Region"],
+            "Month",
+            ["Feb", "Jan"],
+            [
+                {"label": "Amount", "aggregation": "sum"},
+                {"label": "Amount", "aggregation": "count"},
+            ],
+        )
+        self.assertEqual(result["values"], [[[20.0, 15.0]], [[1.0, 2.0]]])
+
+    def test_non_numeric_pivoted_rows(self):
+        with self.assertRaises(frappe.ValidationError):
+            from_pivoted_rows(
+                [["East", "Open", None]],
+                ["Region"],
+                "Month",
+                ["Feb", "Jan"],
+                [{"label": "Status", "aggregation": "max"}],
+            )
+
+    def test_aggregated_rows(self):
+        value_columns = [{"label": "Amount", "aggregation": "avg"}]
+        # each cell holds a single row, its average stays as is
+        result = pivot(ROWS[1:], COLUMNS, ["Region"], "Month", value_columns, True)
+        self.assertEqual(result["values"], [[[20.0, 5.0], [None, 7.0]]])
+        # averages of several rows can't be averaged again
+        with self.assertRaises(frappe.ValidationError):
+            pivot(ROWS, COLUMNS, ["Region"], "Month", value_columns, True)
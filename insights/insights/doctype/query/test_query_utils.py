@@ -3,8 +3,20 @@
 
 import frappe
 import unittest
-from pypika import Table, Case
-from insights.insights.doctype.query.utils import parse_query_expression
+from datetime import datetime
+from frappe.utils import add_to_date, getdate
+from pypika import Query, Table, Case
+from insights.insights.doctype.query.utils import (
+    parse_query_expression,
+    bind_parameters,
+    get_timespan_range,
+    make_parameter,
+    resolve_parameters,
+    ColumnFormat,
+    FulltextMatch,
+    Operations,
+    get_fulltext_search,
+)
 
 
 class TestQueryUtils(unittest.TestCase):
@@ -296,3 +308,106 @@ class TestParseExpression(unittest.TestCase):
             expression.get_sql().lower().replace('"', ""),
             "case when price<300000 then 'low price' when price>500000 then 'high price' else 'usual price' end",
         )
+
+
+class TestBindParameters(unittest.TestCase):
+    def test_bind_parameters(self):
+        Invoice = Table("tabSales Invoice")
+        query = (
+            Query.from_(Invoice)
+            .select(ColumnFormat.format_date("Month", Invoice.posting_date))
+            .where(Invoice.status.isin([make_parameter(0), make_parameter(1)]))
+            .where(Invoice.customer.like(make_parameter(2)))
+        )
+        sql, values = bind_parameters(str(query), ["Paid", "Unpaid", "%Acme%"])
+        self.assertEqual(values, ["Paid", "Unpaid", "%Acme%"])
+        self.assertIn("DATE_FORMAT(\"posting_date\",'%%M, %%Y')", sql)
+        self.assertIn("IN (%s,%s)", sql)
+        self.assertIn("LIKE %s", sql)
+
+    def test_sql_without_parameters(self):
+        sql = "SELECT DATE_FORMAT(`posting_date`, '%Y') FROM `tabSales Invoice`"
+        self.assertEqual(bind_parameters(sql, []), (sql, []))
+
+    def test_resolve_parameters(self):
+        start, end = get_timespan_range("last 7 days")
+        values = resolve_parameters(
+            [
+                "Paid",
+                {"timespan": "last 7 days", "bound": 0},
+                {"timespan": "last 7 days", "bound": 1},
+            ]
+        )
+        self.assertEqual(values, ["Paid", getdate(start), getdate(end)])
+
+    def test_resolve_exclusive_bound(self):
+        start, end = get_timespan_range("current month")
+        values = resolve_parameters(
+            [
+                {"timespan": "current month", "bound": 0},
+                {"timespan": "current month", "bound": 1, "exclusive": 1},
+            ]
+        )
+        self.assertEqual(values[0], getdate(start))
+        self.assertEqual(values[1], add_to_date(getdate(end), days=1))
+
+
+class TestColumnFormat(unittest.TestCase):
+    def test_truncate_date(self):
+        Invoice = Table("tabSales Invoice")
+        bucket = ColumnFormat.truncate_date("Month", Invoice.posting_date)
+        sql = Query.from_(Invoice).select(bucket).groupby(bucket).get_sql()
+        self.assertNotIn("DATE_FORMAT", sql)
+        self.assertIn(
+            'GROUP BY DATE_ADD(MAKEDATE(YEAR("posting_date"),1),'
+            'INTERVAL (MONTH("posting_date")-1) MONTH)',
+            sql,
+        )
+        self.assertEqual(
+            ColumnFormat.truncate_date("Day of Week", Invoice.posting_date).get_sql(),
+            'DAYOFWEEK("posting_date")',
+        )
+
+    def test_format_value(self):
+        date = datetime(2022, 9, 1, 15, 5)
+        self.assertEqual(
+            ColumnFormat.format_value("Minute", date), "1st September, 2022, 3:05 PM"
+        )
+        self.assertEqual(
+            ColumnFormat.format_value("Day", "2022-09-22"), "22nd September, 2022"
+        )
+        self.assertEqual(ColumnFormat.format_value("Month", date), "September, 2022")
+        self.assertEqual(ColumnFormat.format_value("Quarter", date), "Q3, 2022")
+        self.assertEqual(ColumnFormat.format_value("Year", date), "2022")
+        self.assertEqual(ColumnFormat.format_value("Hour of Day", 0), "12:00 AM")
+        self.assertEqual(ColumnFormat.format_value("Day of Week", 1), "Sunday")
+        self.assertEqual(ColumnFormat.format_value("Day of Month", 11), "11th")
+        self.assertEqual(ColumnFormat.format_value("Month of Year", 9), "September")
+        self.assertIsNone(ColumnFormat.format_value("Month", None))
+
+    def test_timespan_is_half_open(self):
+        Invoice = Table("tabSales Invoice")
+        operation = Operations.get_operation("timespan")
+        condition = operation(Invoice.posting_date, ["2022-09-01", "2022-10-01"])
+        self.assertEqual(
+            condition.get_sql(),
+            "\"posting_date\">='2022-09-01' AND \"posting_date\"<'2022-10-01'",
+        )
+
+
+class TestFulltextMatch(unittest.TestCase):
+    def test_fulltext_match(self):
+        Communication = Table("tabCommunication")
+        search = get_fulltext_search("overdue  invoice")
+        self.assertEqual(search, "+overdue* +invoice*")
+
+        condition = FulltextMatch(Communication.content, make_parameter(0))
+        condition &= Communication.content.like(make_parameter(1))
+        sql, values = bind_parameters(
+            Query.from_(Communication).select("name").where(condition).get_sql(),
+            [search, "%overdue invoice%"],
+        )
+        self.assertIn(
+            'MATCH ("content") AGAINST (%s IN BOOLEAN MODE) AND "content" LIKE %s', sql
+        )
+        self.assertEqual(values, [search, "%overdue invoice%"])
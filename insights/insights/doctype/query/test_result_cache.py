@@ -0,0 +1,26 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+import unittest
+
+from insights.insights.doctype.query.result_cache import get_cache_key
+
+
+class TestResultCache(unittest.TestCase):
+    def test_cache_key_of_sql(self):
+        sql = "SELECT `name` FROM `tabUser` LIMIT 10"
+        self.assertEqual(get_cache_key("DS", sql), get_cache_key("DS", sql))
+        self.assertNotEqual(
+            get_cache_key("DS", sql), get_cache_key("DS", sql.replace("10", "20"))
+        )
+
+    def test_cache_key_includes_values(self):
+        sql = "SELECT `name` FROM `tabUser` WHERE `enabled` = %s"
+        self.assertNotEqual(
+            get_cache_key("DS", sql, [1]), get_cache_key("DS", sql, [0])
+        )
+        self.assertEqual(get_cache_key("DS", sql, [1]), get_cache_key("DS", sql, [1]))
+
+    def test_cache_key_includes_data_source(self):
+        sql = "SELECT `name` FROM `tabUser`"
+        self.assertNotEqual(get_cache_key("DS1", sql), get_cache_key("DS2", sql))
@@ -1,16 +1,22 @@
 # Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
 # For license information, please see license.txt
 
+import calendar
 import datetime
 import operator
+import re
 
 from typing import Tuple
 
 import frappe
 from frappe import _dict
 from pypika import functions as fn
+from pypika.terms import Criterion, Parameter, Term
 from frappe.query_builder import CustomFunction, functions, Case, Field, Table
 from frappe.utils.data import (
+    cint,
+    get_datetime,
+    getdate,
     nowdate,
     add_to_date,
     get_first_day_of_week,
@@ -23,6 +29,11 @@ from frappe.utils.data import (
     get_year_ending,
 )
 
+from insights.insights.doctype.query.calendar_table import (
+    get_calendar_range,
+    get_fiscal_year_range,
+)
+
 
 class Aggregations:
     @classmethod
@@ -80,8 +91,22 @@ class ColumnFormat:
     }
 
     FormatDate = CustomFunction("DATE_FORMAT", ["date", "format"])
-    ParseDate = CustomFunction("STR_TO_DATE", ["str", "format"])
     Quarter = CustomFunction("QUARTER", ["date"])
+    Date = CustomFunction("DATE", ["date"])
+    Year = CustomFunction("YEAR", ["date"])
+    MakeDate = CustomFunction("MAKEDATE", ["year", "dayofyear"])
+    DateAdd = CustomFunction("DATE_ADD", ["date", "interval"])
+
+    # parts of a date, grouped & sorted as numbers
+    date_parts = {
+        "Minute of Hour": CustomFunction("MINUTE", ["date"]),
+        "Hour of Day": CustomFunction("HOUR", ["date"]),
+        "Day of Week": CustomFunction("DAYOFWEEK", ["date"]),
+        "Day of Month": CustomFunction("DAYOFMONTH", ["date"]),
+        "Day of Year": CustomFunction("DAYOFYEAR", ["date"]),
+        "Month of Year": CustomFunction("MONTH", ["date"]),
+        "Quarter of Year": Quarter,
+    }
 
     @classmethod
     def format_date(cls, format, column):
@@ -98,13 +123,122 @@ class ColumnFormat:
         return column
 
     @classmethod
-    def parse_date(cls, format, column):
-        if format in cls.date_formats:
-            _format = cls.date_formats[format]
-            return cls.ParseDate(column, _format)
+    def truncate_date(cls, format, column):
+        """Returns the bucket of `column` for `format`, a date or a number.
+
+        Buckets are native values, they're grouped & sorted as dates or numbers
+        and formatted for display by `format_value` once the rows are aggregated.
+        """
+        if format in cls.date_parts:
+            return cls.date_parts[format](column)
+
+        year_start = cls.MakeDate(cls.Year(column), 1)
+        truncations = {
+            "Minute": lambda: cls.DateAdd(
+                cls.Date(column),
+                DateInterval(
+                    cls.date_parts["Hour of Day"](column) * 60
+                    + cls.date_parts["Minute of Hour"](column),
+                    "MINUTE",
+                ),
+            ),
+            "Hour": lambda: cls.DateAdd(
+                cls.Date(column),
+                DateInterval(cls.date_parts["Hour of Day"](column), "HOUR"),
+            ),
+            "Day": lambda: cls.Date(column),
+            "Month": lambda: cls.DateAdd(
+                year_start,
+                DateInterval(cls.date_parts["Month of Year"](column) - 1, "MONTH"),
+            ),
+            "Quarter": lambda: cls.DateAdd(
+                year_start, DateInterval(cls.Quarter(column) - 1, "QUARTER")
+            ),
+            "Year": lambda: year_start,
+        }
+        if format in truncations:
+            return truncations[format]()
 
         return column
 
+    @classmethod
+    def format_value(cls, format, value):
+        """Formats a bucket of `truncate_date` as `format_date` formats the date"""
+        if value is None or value == "":
+            return value
+
+        if format in cls.date_parts:
+            value = cint(value)
+            part_formats = {
+                "Minute of Hour": lambda: f"{value:02d}",
+                "Hour of Day": lambda: format_time(value, 0),
+                # DAYOFWEEK counts from 1 on sunday, day names start on monday
+                "Day of Week": lambda: calendar.day_name[(value + 5) % 7],
+                "Day of Month": lambda: ordinal(value),
+                "Day of Year": lambda: f"{value:03d}",
+                "Month of Year": lambda: calendar.month_name[value],
+                "Quarter of Year": lambda: value,
+            }
+            return part_formats[format]()
+
+        date = get_datetime(value)
+        day = f"{ordinal(date.day)} {calendar.month_name[date.month]}, {date.year}"
+        date_formats = {
+            "Minute": lambda: f"{day}, {format_time(date.hour, date.minute)}",
+            "Hour": lambda: f"{day}, {format_time(date.hour, 0)}",
+            "Day": lambda: day,
+            "Month": lambda: f"{calendar.month_name[date.month]}, {date.year}",
+            "Quarter": lambda: f"Q{(date.month - 1) // 3 + 1}, {date.year}",
+            "Year": lambda: f"{date.year}",
+        }
+        if format in date_formats:
+            return date_formats[format]()
+
+        return value
+
+
+class DateInterval(Term):
+    """`INTERVAL <expr> <unit>`, pypika's Interval only takes constants"""
+
+    def __init__(self, quantity, unit, alias=None):
+        super().__init__(alias=alias)
+        self.quantity = quantity
+        self.unit = unit
+
+    def get_sql(self, **kwargs):
+        return f"INTERVAL ({self.quantity.get_sql(**kwargs)}) {self.unit}"
+
+
+class FulltextMatch(Criterion):
+    """`MATCH (<column>) AGAINST (<search> IN BOOLEAN MODE)`, on a FULLTEXT index"""
+
+    def __init__(self, column, search, alias=None):
+        super().__init__(alias=alias)
+        self.column = column
+        self.search = search
+
+    def get_sql(self, **kwargs):
+        return (
+            f"MATCH ({self.column.get_sql(**kwargs)}) "
+            f"AGAINST ({self.search.get_sql(**kwargs)} IN BOOLEAN MODE)"
+        )
+
+
+def get_fulltext_search(text):
+    """Returns a boolean mode search for words starting with each word of `text`"""
+    return " ".join(f"+{word}*" for word in text.split())
+
+
+def ordinal(number):
+    suffix = "th"
+    if not 11 <= number % 100 <= 13:
+        suffix = {1: "st", 2: "nd", 3: "rd"}.get(number % 10, "th")
+    return f"{number}{suffix}"
+
+
+def format_time(hour, minute):
+    return f"{hour % 12 or 12}:{minute:02d} {'AM' if hour < 12 else 'PM'}"
+
 
 class Operations:
 
@@ -136,7 +270,6 @@ class Operations:
     }
     RANGE_OPERATORS = {
         "between": "between",
-        "timespan": "between",
     }
 
     @classmethod
@@ -157,6 +290,10 @@ class Operations:
             function_name = cls.COMPARE_FUNCTIONS[operator]
             return lambda field, value: getattr(field, function_name)(value)
 
+        if operator == "timespan":
+            # half open, datetimes of the last day are before the day after it
+            return lambda field, value: (field >= value[0]) & (field < value[1])
+
         if operator in cls.RANGE_OPERATORS:
             function_name = cls.RANGE_OPERATORS[operator]
             return lambda field, value: getattr(field, function_name)(
@@ -198,6 +335,7 @@ def get_date_range(
             get_year_start(today),
             get_year_ending(today),
         ),
+        "current fiscal year": lambda: get_fiscal_year_range(today),
         "last n days": lambda n: (
             add_to_date(today, days=-1 * n),
             add_to_date(today, days=-1 * n),
@@ -218,6 +356,9 @@ def get_date_range(
             get_year_start(add_to_date(today, years=-1 * n)),
             get_year_ending(add_to_date(today, years=-1 * n)),
         ),
+        "last n fiscal years": lambda n: get_fiscal_year_range(
+            add_to_date(today, years=-1 * n)
+        ),
     }
 
     if timespan in date_range_map:
@@ -228,6 +369,56 @@ def get_date_range(
         )
 
 
+def get_timespan_range(timespan):
+    """Returns the date range of a timespan, eg. `current month` or `last 7 days`"""
+    timespan = timespan.lower().strip()
+    if "current" in timespan:
+        return get_date_range(timespan=timespan)
+
+    if "last" in timespan:
+        [span, interval, interval_type] = timespan.split(" ", 2)
+        return get_date_range(timespan=f"{span} n {interval_type}", n=int(interval))
+
+
+# placeholders of values in the SQL built by pypika, until they're bound with `%s`
+PARAMETER_PATTERN = re.compile(r"__insights_param_(\d+)__")
+
+
+def make_parameter(index):
+    return Parameter(f"__insights_param_{index}__")
+
+
+def bind_parameters(sql, parameters):
+    """Returns `sql` with `%s` for every parameter, and their values in the same order.
+
+    Percent signs of the SQL, eg. of date formats, are escaped if values are bound.
+    """
+    indexes = [int(index) for index in PARAMETER_PATTERN.findall(sql)]
+    if not indexes:
+        return sql, []
+
+    sql = PARAMETER_PATTERN.sub("%s", sql.replace("%", "%%"))
+    return sql, [parameters[index] for index in indexes]
+
+
+def resolve_parameters(values):
+    """Returns values to bind, with timespans resolved to dates as of today"""
+    return [
+        resolve_timespan(value) if isinstance(value, dict) else value
+        for value in values or []
+    ]
+
+
+def resolve_timespan(value):
+    # periods are looked up on the calendar by their keys, computed if it isn't built
+    date_range = get_calendar_range(value["timespan"]) or get_timespan_range(
+        value["timespan"]
+    )
+    date = getdate(date_range[value["bound"]])
+    # exclusive bounds are the day after the last day of the timespan
+    return add_to_date(date, days=1) if value.get("exclusive") else date
+
+
 class Functions:
     @classmethod
     def get_functions(cls):
@@ -0,0 +1,16 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.query_builder import Interval
+from frappe.query_builder.functions import Now
+
+
+class QueryExecutionLog(Document):
+    @staticmethod
+    def clear_old_logs(days=30):
+        table = frappe.qb.DocType("Query Execution Log")
+        frappe.db.delete(
+            table, filters=(table.modified < (Now() - Interval(days=days)))
+        )
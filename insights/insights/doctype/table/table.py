@@ -8,4 +8,4 @@ from frappe.model.document import Document
 class Table(Document):
     def on_update(self):
         # clear cache
-        frappe.cache().delete_key(f"query_table_{self.data_source}")
+        frappe.cache().delete_key(f"query_tables_{self.data_source}")
@@ -0,0 +1,609 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import hashlib
+from json import dumps, loads
+
+import frappe
+from frappe import _dict
+from frappe.model.document import Document
+from frappe.query_builder import Table
+from frappe.query_builder.functions import Count, Max, Min, Sum
+from frappe.utils import cstr, get_datetime, now_datetime, time_diff_in_seconds
+
+from insights.insights.doctype.query.calendar_table import update_calendar
+from insights.insights.doctype.query.compiled_cache import invalidate_compiled_queries
+from insights.insights.doctype.query.utils import ColumnFormat
+from insights.utils import get_config
+
+# saved queries of the same shape needed before a rollup is created for them
+# defaults can be overridden from site config, eg. "insights_rollup_min_queries": 5
+ROLLUP_MIN_QUERIES = 3
+MAX_ROLLUP_DIMENSIONS = 4
+ROLLUP_FULL_REFRESH_INTERVAL = 24 * 60 * 60
+
+ROLLUP_AGGREGATIONS = ("sum", "count", "min", "max")
+GRANULARITIES = ("Day", "Month", "Year")
+# coarsest granularity each date format can be computed from
+FORMAT_GRANULARITY = {
+    "Day": "Day",
+    "Day of Week": "Day",
+    "Day of Month": "Day",
+    "Day of Year": "Day",
+    "Month": "Month",
+    "Month of Year": "Month",
+    "Quarter": "Month",
+    "Quarter of Year": "Month",
+    "Year": "Year",
+}
+SQL_TYPES = {
+    "Tinyint": "bigint",
+    "Smallint": "bigint",
+    "Mediumint": "bigint",
+    "Int": "bigint",
+    "Bigint": "bigint",
+    "Decimal": "decimal(21,9)",
+    "Float": "double",
+    "Double": "double",
+    "Date": "date",
+    "Datetime": "datetime(6)",
+    "Timestamp": "datetime(6)",
+    "Time": "time(6)",
+}
+
+
+class TableRollup(Document):
+    def validate(self):
+        self.summary_table = f"_insights_rollup_{self.name}"
+        self.validate_columns()
+
+        # the summary table is created again with the new columns on the next refresh
+        if (
+            self.status == "Failed"
+            or self.has_value_changed("date_column")
+            or self.has_value_changed("granularity")
+            or self.has_value_changed("dimensions")
+            or self.has_value_changed("measures")
+        ):
+            self.status = "Pending"
+            self.watermark = None
+
+    def validate_columns(self):
+        column_types = self.get_column_types()
+        if self.date_column not in column_types:
+            frappe.throw(f"Column {self.date_column} not found in {self.table}")
+        if column_types[self.date_column] not in ("Date", "Datetime", "Timestamp"):
+            frappe.throw(f"Column {self.date_column} is not a date")
+        self.date_column_type = column_types[self.date_column]
+
+        for column in self.get_dimensions() + self.get_measures():
+            if column not in column_types:
+                frappe.throw(f"Column {column} not found in {self.table}")
+            if column == self.date_column:
+                frappe.throw(f"Column {column} is already the date column")
+
+    def on_update(self):
+        if self.status == "Pending":
+            frappe.enqueue(
+                "insights.insights.doctype.table_rollup.table_rollup.refresh_rollup",
+                queue="long",
+                rollup=self.name,
+                enqueue_after_commit=True,
+            )
+
+    def on_trash(self):
+        # queries reading the summary table are built on the table again
+        self.db_set("status", "Pending", update_modified=False)
+        self.update_queries()
+        frappe.db.sql_ddl(f"drop table if exists `{self.summary_table}`")
+
+    def get_dimensions(self):
+        return split_lines(self.dimensions)
+
+    def get_measures(self):
+        return split_lines(self.measures)
+
+    def get_column_types(self):
+        data_source = frappe.get_cached_doc("Data Source", self.data_source)
+        columns = data_source.get_columns({"table": self.table}) or []
+        return {d.get("column"): d.get("type") for d in columns}
+
+    def covers(self, shape):
+        """Returns True if a query of `shape` can be answered from the summary table"""
+        if GRANULARITIES.index(self.granularity) > GRANULARITIES.index(
+            shape.granularity
+        ):
+            return False
+
+        # buckets can be filtered on only if they hold whole dates
+        if shape.date_filter and (
+            self.granularity != "Day" or self.date_column_type != "Date"
+        ):
+            return False
+
+        return set(shape.dimensions) <= set(self.get_dimensions()) and set(
+            shape.measures
+        ) <= set(self.get_measures())
+
+    def get_summary_field(self, column):
+        Summary = Table(self.summary_table)
+        return Summary.bucket if column == self.date_column else Summary[column]
+
+    def get_summary_aggregate(self, column, aggregation):
+        """Returns the summary column & the aggregation combining it across buckets"""
+        Summary = Table(self.summary_table)
+        return Summary[f"{aggregation}_{column}"], (
+            "sum" if aggregation == "count" else aggregation
+        )
+
+    def refresh(self):
+        """Aggregates rows modified since the last refresh into the summary table.
+
+        The summary is rebuilt in a new table & swapped in on the first refresh,
+        periodically to drop deleted rows, when rows that were already aggregated
+        have been modified since, and always for tables without a `modified` column.
+        """
+        data_source = frappe.get_doc("Data Source", self.data_source)
+        column_types = self.get_column_types()
+        Source = Table(self.table)
+
+        watermark = None
+        if {"modified", "creation"} <= set(column_types):
+            # read before the rows, rows modified in between are picked up next time
+            watermark = self.execute(
+                data_source, frappe.qb.from_(Source).select(Max(Source.modified))
+            )[0][0]
+
+        full_refresh = not watermark or not self.can_merge(data_source, Source)
+        summary_table = self.summary_table
+        if full_refresh:
+            summary_table = f"{self.summary_table}_build"
+            self.create_summary_table(summary_table, column_types)
+
+        query = self.build_source_query(
+            Source, None if full_refresh else self.watermark, watermark
+        )
+        for batch in data_source.execute_query(
+            str(query), stream=True, timeout=data_source.max_execution_time
+        ):
+            self.upsert(summary_table, batch)
+
+        if full_refresh:
+            self.swap_summary_table(summary_table)
+
+        # queries on the summary group its buckets by the calendar's periods
+        update_calendar(
+            *frappe.db.sql(
+                f"select min(`bucket`), max(`bucket`) from {quote(self.summary_table)}"
+            )[0]
+        )
+
+        activated = self.status != "Active"
+        now = now_datetime()
+        self.db_set(
+            {
+                "status": "Active",
+                "watermark": watermark,
+                "last_refresh": now,
+                "last_full_refresh": now if full_refresh else self.last_full_refresh,
+            },
+            update_modified=False,
+        )
+        frappe.db.commit()
+
+        if activated:
+            self.update_queries()
+
+    def can_merge(self, data_source, Source):
+        if self.status != "Active" or not self.watermark:
+            return False
+
+        full_refresh_interval = get_config(
+            "rollup_full_refresh_interval", ROLLUP_FULL_REFRESH_INTERVAL
+        )
+        if (
+            not self.last_full_refresh
+            or time_diff_in_seconds(now_datetime(), self.last_full_refresh)
+            > full_refresh_interval
+        ):
+            return False
+
+        # updated rows were aggregated with their old values, which can't be taken out
+        watermark = get_datetime(self.watermark)
+        updated = self.execute(
+            data_source,
+            frappe.qb.from_(Source)
+            .select(Source.name)
+            .where((Source.modified > watermark) & (Source.creation <= watermark))
+            .limit(1),
+        )
+        return not updated
+
+    def execute(self, data_source, query):
+        return data_source.execute_query(
+            str(query), timeout=data_source.max_execution_time
+        )
+
+    def build_source_query(self, Source, modified_after=None, modified_before=None):
+        # dates are bucketed to the first day of their granularity
+        bucket = ColumnFormat.truncate_date(self.granularity, Source[self.date_column])
+        dimensions = [Source[column] for column in self.get_dimensions()]
+
+        query = frappe.qb.from_(Source).select(bucket.as_("bucket"), *dimensions)
+        for column in self.get_measures():
+            # in the same order as ROLLUP_AGGREGATIONS
+            query = query.select(
+                Sum(Source[column]),
+                Count(Source[column]),
+                Min(Source[column]),
+                Max(Source[column]),
+            )
+        query = query.groupby(bucket, *dimensions)
+
+        if modified_after:
+            query = query.where(
+                (Source.modified > modified_after) & (Source.creation > modified_after)
+            )
+        if modified_before:
+            query = query.where(Source.modified <= modified_before)
+
+        return query
+
+    def get_summary_columns(self):
+        columns = ["bucket"] + self.get_dimensions()
+        for column in self.get_measures():
+            columns += [
+                f"{aggregation}_{column}" for aggregation in ROLLUP_AGGREGATIONS
+            ]
+        return columns
+
+    def create_summary_table(self, table_name, column_types):
+        definitions = ["`_key` char(32) not null primary key", "`bucket` date"]
+        for column in self.get_dimensions():
+            definitions.append(f"{quote(column)} {get_sql_type(column_types[column])}")
+        for column in self.get_measures():
+            sql_type = get_sql_type(column_types[column])
+            definitions += [
+                f"{quote('sum_' + column)} decimal(21,9)",
+                f"{quote('count_' + column)} bigint",
+                f"{quote('min_' + column)} {sql_type}",
+                f"{quote('max_' + column)} {sql_type}",
+            ]
+
+        frappe.db.sql_ddl(f"drop table if exists {quote(table_name)}")
+        frappe.db.sql_ddl(
+            f"create table {quote(table_name)} ({', '.join(definitions)}, "
+            "index `bucket` (`bucket`)) engine=InnoDB"
+        )
+
+    def swap_summary_table(self, build_table):
+        summary_table = quote(self.summary_table)
+        old_table = quote(f"{self.summary_table}_old")
+        frappe.db.sql_ddl(
+            f"create table if not exists {summary_table} like {quote(build_table)}"
+        )
+        # renamed at once, queries read either the old or the new summary
+        frappe.db.sql_ddl(
+            f"rename table {summary_table} to {old_table}, "
+            f"{quote(build_table)} to {summary_table}"
+        )
+        frappe.db.sql_ddl(f"drop table {old_table}")
+
+    def upsert(self, table_name, rows):
+        """Inserts aggregates of new buckets & combines them with existing ones"""
+        if not rows:
+            return
+
+        columns = self.get_summary_columns()
+        key_length = 1 + len(self.get_dimensions())
+        values = []
+        for row in rows:
+            values += [get_bucket_key(row[:key_length]), *row]
+
+        updates = []
+        for column in columns[key_length:]:
+            aggregation = column.split("_", 1)[0]
+            current, new = quote(column), f"values({quote(column)})"
+            combined = {
+                "sum": f"{current} + {new}",
+                "count": f"{current} + {new}",
+                "min": f"least({current}, {new})",
+                "max": f"greatest({current}, {new})",
+            }[aggregation]
+            # aggregates of only nulls are null, the other one is kept
+            updates.append(f"{current} = coalesce({combined}, {current}, {new})")
+
+        column_names = ", ".join(map(quote, ["_key"] + columns))
+        placeholders = f"({', '.join(['%s'] * (len(columns) + 1))})"
+        frappe.db.sql(
+            f"""
+                insert into {quote(table_name)} ({column_names})
+                values {', '.join([placeholders] * len(rows))}
+                on duplicate key update {', '.join(updates)}
+            """,
+            values,
+        )
+
+    def update_queries(self):
+        """Builds queries that read the summary table or could again, on their next run"""
+        queries = set(
+            frappe.get_all("Query", filters={"rollup": self.name}, pluck="name")
+        )
+        shapes = get_query_shapes(self.data_source, self.table, self.date_column)
+        queries.update(shapes.get(get_shape_key(self), {}))
+
+        # the definitions are unchanged, the rollup they can be answered from isn't
+        invalidate_compiled_queries(self.data_source, queries)
+        frappe.db.commit()
+
+
+def get_query_shape(query):
+    """Returns how `query` aggregates rows by date, None if a rollup can't answer it.
+
+    Queries on a single table qualify if they group by a date formatted to a day or
+    coarser, and by other columns, aggregate only with Sum, Count, Min & Max and
+    filter only on columns.
+    """
+    if (
+        len(query.tables) != 1
+        or query.tables[0].join
+        or query.transform_type
+        or query.incremental_refresh
+    ):
+        return
+
+    table = query.tables[0].table
+    shape = _dict(
+        data_source=query.data_source,
+        table=table,
+        date_column=None,
+        granularity=None,
+        dimensions=set(),
+        measures=set(),
+        date_filter=False,
+    )
+    for row in query.columns:
+        aggregation = (row.aggregation or "").lower()
+        if row.is_expression or row.table != table:
+            return
+        if aggregation in ROLLUP_AGGREGATIONS:
+            shape.measures.add(row.column)
+            continue
+        if aggregation != "group by":
+            return
+
+        date_format = None
+        if row.type in ("Date", "Datetime") and row.format_option:
+            date_format = loads(row.format_option).get("date_format")
+        if not date_format:
+            shape.dimensions.add(row.column)
+            continue
+
+        if date_format not in FORMAT_GRANULARITY or shape.date_column not in (
+            None,
+            row.column,
+        ):
+            return
+        shape.date_column = row.column
+        shape.granularity = get_finest_granularity(
+            shape.granularity, FORMAT_GRANULARITY[date_format]
+        )
+
+    if not shape.date_column or not shape.measures:
+        return
+
+    filter_columns = get_filter_columns(loads(query.filters))
+    if filter_columns is None:
+        return
+    for filter_table, column in filter_columns:
+        if filter_table != table:
+            return
+        if column == shape.date_column:
+            shape.date_filter = True
+        else:
+            shape.dimensions.add(column)
+
+    # the date column is only kept bucketed
+    if shape.date_column in shape.dimensions | shape.measures:
+        return
+
+    return shape
+
+
+def get_filter_columns(filters):
+    """Returns (table, column) of columns in `filters`, None if a term is neither"""
+    columns = []
+
+    def visit(term):
+        term = _dict(term)
+        if "conditions" in term:
+            return all(visit(condition) for condition in term.conditions)
+        if "left" in term and "right" in term and "operator" in term:
+            return visit(term.left) and visit(term.right)
+        if "table" in term and "column" in term:
+            columns.append((term.table, term.column))
+            return True
+        return "value" in term
+
+    return columns if visit(filters) else None
+
+
+def get_finest_granularity(*granularities):
+    return min(
+        (d for d in granularities if d),
+        key=GRANULARITIES.index,
+        default=None,
+    )
+
+
+def get_shape_key(shape):
+    return dumps([shape.data_source, shape.table, shape.date_column])
+
+
+def get_query_shapes(data_source=None, table=None, date_column=None):
+    """Returns shapes of saved queries a rollup could answer, by their shape key.
+
+    Queries are narrowed down on the database to those on a single table that group
+    by a formatted date, only those are loaded to get their shape.
+    """
+    filters = {"incremental_refresh": 0, "transform_type": ("is", "not set")}
+    if data_source:
+        filters["data_source"] = data_source
+    queries = set(frappe.get_all("Query", filters=filters, pluck="name"))
+
+    queries &= {
+        d.parent
+        for d in frappe.get_all(
+            "Query Table",
+            filters={"parenttype": "Query"},
+            fields=["parent", "max(`table`) as `table`", "count(name) as tables"],
+            group_by="parent",
+        )
+        if d.tables == 1 and (not table or d.table == table)
+    }
+
+    column_filters = {
+        "parenttype": "Query",
+        "aggregation": "Group By",
+        "type": ("in", ("Date", "Datetime")),
+        "format_option": ("is", "set"),
+        "is_expression": 0,
+    }
+    if date_column:
+        column_filters["column"] = date_column
+    queries &= set(
+        frappe.get_all("Query Column", filters=column_filters, pluck="parent")
+    )
+
+    shapes = {}
+    for query in queries:
+        shape = get_query_shape(frappe.get_doc("Query", query))
+        if shape:
+            shapes.setdefault(get_shape_key(shape), {})[query] = shape
+    return shapes
+
+
+def find_rollup(shape):
+    """Returns an active rollup that can answer queries of `shape`"""
+    rollups = frappe.get_all(
+        "Table Rollup",
+        filters={
+            "data_source": shape.data_source,
+            "table": shape.table,
+            "date_column": shape.date_column,
+            "status": "Active",
+        },
+        pluck="name",
+    )
+    for rollup in rollups:
+        rollup = frappe.get_doc("Table Rollup", rollup)
+        if rollup.covers(shape):
+            return rollup
+
+
+def create_rollups():
+    """Creates or widens a rollup for each date column enough saved queries group by"""
+    min_queries = get_config("rollup_min_queries", ROLLUP_MIN_QUERIES)
+    for shapes in get_query_shapes().values():
+        shapes = list(shapes.values())
+        if len(shapes) < min_queries:
+            continue
+
+        shape = merge_shapes(shapes)
+        rollup = frappe.db.get_value(
+            "Table Rollup",
+            {
+                "data_source": shape.data_source,
+                "table": shape.table,
+                "date_column": shape.date_column,
+            },
+        )
+        rollup = frappe.get_doc("Table Rollup", rollup) if rollup else None
+        if rollup and rollup.covers(shape):
+            continue
+
+        if not rollup:
+            rollup = frappe.new_doc("Table Rollup")
+            rollup.update(
+                {
+                    "data_source": shape.data_source,
+                    "table": shape.table,
+                    "date_column": shape.date_column,
+                }
+            )
+        else:
+            shape.dimensions |= set(rollup.get_dimensions())
+            shape.measures |= set(rollup.get_measures())
+            shape.granularity = get_finest_granularity(
+                shape.granularity, rollup.granularity
+            )
+
+        if len(shape.dimensions) > get_config(
+            "max_rollup_dimensions", MAX_ROLLUP_DIMENSIONS
+        ):
+            continue
+
+        rollup.update(
+            {
+                "granularity": shape.granularity,
+                "dimensions": "\n".join(sorted(shape.dimensions)),
+                "measures": "\n".join(sorted(shape.measures)),
+            }
+        )
+        rollup.save(ignore_permissions=True)
+        frappe.db.commit()
+
+
+def merge_shapes(shapes):
+    """Returns a shape that covers all `shapes`"""
+    shape = _dict(shapes[0], dimensions=set(), measures=set())
+    for d in shapes:
+        shape.dimensions |= d.dimensions
+        shape.measures |= d.measures
+        shape.granularity = get_finest_granularity(shape.granularity, d.granularity)
+        shape.date_filter = shape.date_filter or d.date_filter
+
+    if shape.date_filter:
+        shape.granularity = "Day"
+
+    return shape
+
+
+def refresh_rollups():
+    for rollup in frappe.get_all(
+        "Table Rollup", filters={"status": ("!=", "Failed")}, pluck="name"
+    ):
+        frappe.enqueue(
+            "insights.insights.doctype.table_rollup.table_rollup.refresh_rollup",
+            queue="long",
+            rollup=rollup,
+        )
+
+
+def refresh_rollup(rollup):
+    doc = frappe.get_doc("Table Rollup", rollup)
+    try:
+        doc.refresh()
+    except Exception:
+        frappe.db.rollback()
+        # queries reading the summary table are built on the table again
+        doc.db_set("status", "Failed", update_modified=False)
+        frappe.db.commit()
+        doc.update_queries()
+        raise
+
+
+def get_bucket_key(values):
+    return hashlib.md5(dumps(list(values), default=cstr).encode()).hexdigest()
+
+
+def get_sql_type(column_type):
+    return SQL_TYPES.get(column_type, "varchar(255)")
+
+
+def quote(name):
+    return "`{}`".format(name.replace("`", "``"))
+
+
+def split_lines(text):
+    return [line.strip() for line in cstr(text).splitlines() if line.strip()]
@@ -0,0 +1,97 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+from json import dumps
+
+from frappe import _dict
+from frappe.tests.utils import FrappeTestCase
+
+from insights.insights.doctype.table_rollup.table_rollup import (
+    get_filter_columns,
+    get_query_shape,
+    merge_shapes,
+)
+
+
+def make_query(columns, conditions=None, **kwargs):
+    query = _dict(
+        data_source="Site DB",
+        tables=[_dict(table="tabSales Invoice", join=None)],
+        columns=[_dict(table="tabSales Invoice", **column) for column in columns],
+        filters=dumps({"group_operator": "&", "conditions": conditions or []}),
+        transform_type=None,
+        incremental_refresh=0,
+    )
+    query.update(kwargs)
+    return query
+
+
+POSTING_MONTH = {
+    "column": "posting_date",
+    "type": "Date",
+    "aggregation": "Group By",
+    "format_option": dumps({"date_format": "Month"}),
+}
+TOTAL = {"column": "grand_total", "type": "Decimal", "aggregation": "Sum"}
+
+
+class TestTableRollup(FrappeTestCase):
+    def test_query_shape(self):
+        query = make_query(
+            [POSTING_MONTH, {"column": "customer", "aggregation": "Group By"}, TOTAL],
+            conditions=[
+                {
+                    "left": {"table": "tabSales Invoice", "column": "company"},
+                    "operator": {"value": "="},
+                    "right": {"value": "Acme"},
+                }
+            ],
+        )
+        shape = get_query_shape(query)
+        self.assertEqual(shape.date_column, "posting_date")
+        self.assertEqual(shape.granularity, "Month")
+        self.assertEqual(shape.dimensions, {"customer", "company"})
+        self.assertEqual(shape.measures, {"grand_total"})
+        self.assertFalse(shape.date_filter)
+
+    def test_unsupported_shapes(self):
+        average = dict(TOTAL, aggregation="Avg")
+        hourly = dict(POSTING_MONTH, format_option=dumps({"date_format": "Hour"}))
+        self.assertIsNone(get_query_shape(make_query([POSTING_MONTH, average])))
+        self.assertIsNone(get_query_shape(make_query([hourly, TOTAL])))
+        self.assertIsNone(get_query_shape(make_query([TOTAL])))
+        self.assertIsNone(
+            get_query_shape(make_query([POSTING_MONTH, TOTAL], transform_type="Pivot"))
+        )
+
+    def test_filter_columns(self):
+        filters = {
+            "conditions": [
+                {
+                    "left": {"table": "tabSales Invoice", "column": "posting_date"},
+                    "operator": {"value": "timespan"},
+                    "right": {"value": "last 7 days"},
+                },
+                {"group_operator": "|", "conditions": []},
+            ]
+        }
+        self.assertEqual(
+            get_filter_columns(filters), [("tabSales Invoice", "posting_date")]
+        )
+        self.assertIsNone(get_filter_columns({"conditions": [{"left": {}}]}))
+
+    def test_merge_shapes(self):
+        monthly = get_query_shape(make_query([POSTING_MONTH, TOTAL]))
+        daily = get_query_shape(
+            make_query(
+                [
+                    dict(POSTING_MONTH, format_option=dumps({"date_format": "Day"})),
+                    {"column": "customer", "aggregation": "Group By"},
+                    dict(TOTAL, column="outstanding_amount", aggregation="Max"),
+                ]
+            )
+        )
+        shape = merge_shapes([monthly, daily])
+        self.assertEqual(shape.granularity, "Day")
+        self.assertEqual(shape.dimensions, {"customer"})
+        self.assertEqual(shape.measures, {"grand_total", "outstanding_amount"})
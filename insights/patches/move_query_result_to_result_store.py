@@ -0,0 +1,37 @@
+import json
+import frappe
+
+from insights.insights.doctype.query.result_store import store_result
+
+
+def execute():
+    if not frappe.db.a_row_exists("Query") or not frappe.db.has_column(
+        "Query", "result"
+    ):
+        return
+
+    Query = frappe.qb.DocType("Query")
+    queries = (
+        frappe.qb.from_(Query)
+        .select(Query.name, Query.result)
+        .where(Query.result.isnotnull() & (Query.result != ""))
+        .run(as_dict=True)
+    )
+
+    for query in queries:
+        try:
+            result = json.loads(query.result)
+        except ValueError:
+            continue
+
+        stored_result = store_result(query.name, result)
+        # result is no longer a field, clear the leftover column
+        # so that it isn't loaded along with the document
+        (
+            frappe.qb.update(Query)
+            .set(Query.result_key, stored_result.result_key)
+            .set(Query.result_rows, stored_result.row_count)
+            .set(Query.result_size, stored_result.result_size)
+            .set(Query.result, None)
+            .where(Query.name == query.name)
+        ).run()
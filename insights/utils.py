@@ -0,0 +1,64 @@
+# Copyright (c) 2022, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import frappe
+from frappe.utils import cint, now
+
+STANDARD_FIELDS = ["name", "creation", "modified", "owner", "modified_by"]
+
+
+def bulk_insert(doctype, fields, values, names=None):
+    """Inserts `values` as rows of `doctype` without loading documents.
+
+    Standard fields are filled in, so `values` only hold values of `fields`.
+    Pass `names` to set names upfront, random names are generated otherwise.
+    No document hooks or validations are run.
+    """
+    if not values:
+        return
+
+    if names is None:
+        names = [frappe.generate_hash(length=10) for _ in values]
+
+    timestamp = now()
+    user = frappe.session.user
+    frappe.db.bulk_insert(
+        doctype,
+        fields=STANDARD_FIELDS + list(fields),
+        values=[
+            (name, timestamp, timestamp, user, user) + tuple(row)
+            for name, row in zip(names, values)
+        ],
+    )
+
+
+def get_config(key, default):
+    """Returns `insights_<key>` from site config, `default` if it isn't set"""
+    return cint(frappe.conf.get(f"insights_{key}")) or default
+
+
+def run_in_threads(func, items, max_workers):
+    """Calls `func` for each of `items` on a pool of `max_workers` threads.
+
+    Every call gets its own site context & database connection, so `func` can use
+    the frappe API as usual. Yields `(item, future)` pairs as the calls complete.
+    """
+    site = frappe.local.site
+    sites_path = frappe.local.sites_path
+    user = frappe.session.user
+
+    def run(item):
+        frappe.init(site=site, sites_path=sites_path)
+        try:
+            frappe.connect()
+            frappe.set_user(user)
+            return func(item)
+        finally:
+            frappe.destroy()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run, item): item for item in items}
+        for future in as_completed(futures):
+            yield futures[future], future